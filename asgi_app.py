@@ -0,0 +1,251 @@
+# asgi_app.py — вебхук Telegram как ASGI-приложение (uvicorn), без фреймворков
+#
+#   POST /{WEBHOOK_PATH}  секрет из X-Telegram-Bot-Api-Secret-Token → апдейт в очередь → сразу 200;
+#                         из очереди каждый апдейт — своей задачей в ChatOrderedUpdateProcessor
+#   GET  /healthz         liveness: процесс жив и event loop отвечает
+#   GET  /readyz          readiness: бот поднят, разбор очереди жив, очередь не забита
+#   GET  /metrics         Prometheus
+#
+# Запуск: python asgi_app.py (или main.py с PUBLIC_URL) — setWebhook один раз, затем
+# uvicorn в ОДНОМ процессе. Порядок апдейтов одного чата (ChatOrderedUpdateProcessor),
+# FloodGuard, SingleFlight и JobQueue живут в памяти процесса: при --workers N апдейты
+# чата разъедутся по процессам, лимиты умножатся на N, а джобы (flush зарплат, prefetch,
+# перечитывание словарей) пойдут N раз. Масштабируемся репликами (Cloud Run instances):
+# аренда FX и хранилище общие, а маршрутизацию чатов держит один процесс на реплику.
+# Вручную: uvicorn asgi_app:app --port $PORT (без --workers; вебхук тогда ставим сами).
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+from typing import Callable
+
+from telegram import Bot, Update
+from telegram.ext import Application
+
+import metrics
+from config import TOKEN, PUBLIC_URL, PORT, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_QUEUE_SIZE, WEBHOOK_DRAIN_SECONDS
+
+MAX_BODY_BYTES = 1 << 20   # апдейты Telegram — килобайты
+SECRET_HEADER = b"x-telegram-bot-api-secret-token"
+
+WEBHOOK_UPDATES = metrics.Counter("cake_webhook_updates_total", "Запросы на вебхук по результату", ("result",))
+metrics.register(WEBHOOK_UPDATES)
+
+
+def webhook_secret(token: str | None = TOKEN) -> str:
+    """WEBHOOK_SECRET или производный от токена: совпадает во всех процессах и репликах без настройки."""
+    if WEBHOOK_SECRET:
+        return WEBHOOK_SECRET
+    return hashlib.sha256(f"cake-webhook:{token or ''}".encode()).hexdigest()[:48] if token else ""
+
+
+def _build_default() -> Application:
+    from main import build_application   # main импортирует этот модуль — берём лениво
+    return build_application(webhook=True)
+
+
+class WebhookApp:
+    """ASGI-приложение: lifespan поднимает/гасит Application, HTTP — вебхук, health и метрики."""
+
+    def __init__(self, build: Callable[[], Application] = _build_default, *, url_path: str = WEBHOOK_PATH,
+                 secret: str | None = None, queue_size: int = WEBHOOK_QUEUE_SIZE,
+                 drain_seconds: float = WEBHOOK_DRAIN_SECONDS):
+        self.build = build
+        self.url_path = "/" + url_path.strip("/")
+        self.secret = webhook_secret() if secret is None else secret
+        self.queue_size = queue_size
+        self.drain_seconds = drain_seconds
+        self.bot_app: Application | None = None
+        self.queue: asyncio.Queue | None = None
+        self._fetcher: asyncio.Task | None = None
+        self._inflight: set[asyncio.Task] = set()
+        self._slots: asyncio.Semaphore | None = None
+        self._ready = False
+
+    # ── lifespan ─────────────────────────────────────────────────────────────
+    async def startup(self) -> None:
+        app = self.bot_app = self.build()
+        await app.initialize()
+        if app.post_init:
+            await app.post_init(app)
+        await app.start()   # JobQueue; update_queue не используем — апдейты идут через self.queue
+        self.queue = asyncio.Queue(self.queue_size)
+        # в работе и в ожидании лока чата — не больше, чем пускает семафор процессора (max_pending);
+        # сверх него апдейты копятся в self.queue, а полная очередь — 503 и повтор от Telegram
+        self._slots = asyncio.Semaphore(app.update_processor.max_concurrent_updates)
+        self._fetcher = asyncio.create_task(self._fetch(), name="webhook-fetcher")
+        self._ready = True
+        if not self.secret:
+            logging.warning("webhook secret is empty — X-Telegram-Bot-Api-Secret-Token is not checked")
+        logging.info("webhook app ready: %d in flight, queue %d",
+                     app.update_processor.max_concurrent_updates, self.queue_size)
+
+    async def shutdown(self) -> None:
+        """Перестаём быть ready, даём очереди доработать (SIGTERM у Cloud Run — ~10 с), гасим бота."""
+        self._ready = False
+        if self.queue is not None:
+            try:
+                await asyncio.wait_for(self.queue.join(), self.drain_seconds)
+            except asyncio.TimeoutError:
+                logging.warning("webhook queue not drained: %d updates dropped", self.queue.qsize())
+        tasks = [t for t in (self._fetcher, *self._inflight) if t is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._fetcher = None
+        app = self.bot_app
+        if app is None:
+            return
+        if app.running:
+            await app.stop()
+        if app.post_stop:
+            await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+    async def _fetch(self) -> None:
+        """
+        Как встроенный fetcher PTB: каждый апдейт — отдельной задачей. Ждать апдейт здесь нельзя:
+        занятый чат держит лок в ChatOrderedUpdateProcessor, и его очередь заняла бы всех,
+        кто разбирает self.queue, — остальные чаты стояли бы. Задачи создаются по порядку
+        очереди, поэтому лок чата они берут в том же порядке.
+        """
+        while True:
+            await self._slots.acquire()
+            update = await self.queue.get()
+            task = asyncio.create_task(self._process(update))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _process(self, update) -> None:
+        app = self.bot_app
+        try:
+            # тот же путь, что у встроенного fetcher-а PTB: порядок в чате, лимиты, request_id
+            await app.update_processor.process_update(update, app.process_update(update))
+        except Exception as e:
+            logging.exception("update %s failed: %s", getattr(update, "update_id", "?"), e)
+        finally:
+            self._slots.release()
+            self.queue.task_done()
+
+    def ready(self) -> bool:
+        return (self._ready and self.queue is not None and self.queue.qsize() < self.queue_size
+                and self._fetcher is not None and not self._fetcher.done())
+
+    # ── ASGI ─────────────────────────────────────────────────────────────────
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, receive, send)
+
+    async def _lifespan(self, receive, send) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    await self.startup()
+                except Exception as e:
+                    logging.exception("webhook app startup failed: %s", e)
+                    await send({"type": "lifespan.startup.failed", "message": repr(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _http(self, scope, receive, send) -> None:
+        path, method = scope["path"].rstrip("/") or "/", scope["method"]
+        if path == self.url_path and method == "POST":
+            status, body = await self._webhook(scope, receive)
+            await _respond(send, status, body)
+        elif path == "/healthz":
+            await _respond(send, 200, b"ok")
+        elif path == "/readyz":
+            ready = self.ready()
+            info = {"ready": ready, "queued": self.queue.qsize() if self.queue else 0, "in_flight": len(self._inflight)}
+            await _respond(send, 200 if ready else 503, json.dumps(info).encode(), b"application/json")
+        elif path == "/metrics" and method == "GET":
+            await _respond(send, 200, metrics.render().encode(), metrics.CONTENT_TYPE.encode())
+        else:
+            await _respond(send, 404, b"not found")
+
+    async def _webhook(self, scope, receive) -> tuple[int, bytes]:
+        if self.secret:
+            got = dict(scope["headers"]).get(SECRET_HEADER, b"")
+            if not hmac.compare_digest(got, self.secret.encode()):
+                WEBHOOK_UPDATES.inc(result="forbidden")
+                return 403, b"forbidden"
+        if not self._ready:
+            WEBHOOK_UPDATES.inc(result="not_ready")
+            return 503, b"not ready"   # Telegram повторит доставку
+
+        body = await _read_body(receive)
+        if body is None:
+            WEBHOOK_UPDATES.inc(result="too_large")
+            return 413, b"too large"
+        try:
+            update = Update.de_json(json.loads(body), self.bot_app.bot)
+        except Exception as e:
+            WEBHOOK_UPDATES.inc(result="bad_request")
+            logging.warning("bad webhook payload: %s", e)
+            return 400, b"bad request"
+        if update is None:
+            return 200, b"ok"
+        try:
+            self.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            WEBHOOK_UPDATES.inc(result="queue_full")
+            return 503, b"busy"
+        WEBHOOK_UPDATES.inc(result="accepted")
+        return 200, b"ok"
+
+
+async def _read_body(receive) -> bytes | None:
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > MAX_BODY_BYTES:
+            return None
+        chunks.append(chunk)
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def _respond(send, status: int, body: bytes, content_type: bytes = b"text/plain; charset=utf-8") -> None:
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", content_type), (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+
+app = WebhookApp()
+
+
+# ───────────────────────────────
+# ЗАПУСК
+
+async def set_webhook(url: str, secret: str) -> None:
+    """Один раз до старта uvicorn, не из lifespan: при рестартах приложения не дёргаем setWebhook."""
+    async with Bot(TOKEN) as bot:
+        await bot.set_webhook(url=url, secret_token=secret or None, allowed_updates=Update.ALL_TYPES)
+
+
+def run(host: str = "0.0.0.0", port: int = PORT) -> None:
+    import uvicorn
+
+    if PUBLIC_URL:
+        asyncio.run(set_webhook(f"{PUBLIC_URL}/{WEBHOOK_PATH}", webhook_secret()))
+    # log_config=None: логи uvicorn идут через наш корневой логгер (logs.setup в main)
+    uvicorn.run("asgi_app:app", host=host, port=port, workers=1, lifespan="on",
+                log_config=None, access_log=False, timeout_graceful_shutdown=int(WEBHOOK_DRAIN_SECONDS) + 1)
+
+
+if __name__ == "__main__":
+    import logs
+    logs.setup()
+    run()
@@ -0,0 +1,85 @@
+"""
+Пропускная способность обработки апдейтов в зависимости от MAX_CONCURRENT_UPDATES.
+
+Гоняем настоящий serve_cached_and_update через ChatOrderedUpdateProcessor,
+но с медленными фейками вместо FX/хранилища и Telegram:
+    python -m benchmarks.bench_concurrency [--updates 400] [--chats 50] [--fx-ms 40] [--send-ms 60]
+"""
+import argparse
+import asyncio
+import time
+from unittest import mock
+
+from telegram import Chat, Message, Update
+
+import rate_dispatcher
+from calculator import FXSnapshot
+from update_processor import ChatOrderedUpdateProcessor
+
+_SNAPSHOT = FXSnapshot(base="KZT", rates={"USD": 0.002, "EUR": 0.0017, "RUB": 0.16}, provider_ts=None)
+
+
+class SlowMessage(Message):
+    """Message, у которого reply_text «ходит в Telegram» send_ms миллисекунд."""
+    send_delay = 0.0
+    log: list = []
+
+    async def reply_text(self, text, **kwargs):
+        await asyncio.sleep(self.send_delay)
+        SlowMessage.log.append((self.chat.id, self.message_id))
+
+
+def _make_updates(n: int, chats: int) -> list[Update]:
+    updates = []
+    for i in range(n):
+        chat = Chat(id=i % chats, type="private")
+        updates.append(Update(update_id=i, message=SlowMessage(message_id=i, date=None, chat=chat, text="EUR")))
+    return updates
+
+
+async def _run(limit: int, updates: list[Update], fx_delay: float) -> float:
+    async def slow_snapshot():
+        await asyncio.sleep(fx_delay)   # чтение хранилища/FX на каждом запросе
+        return _SNAPSHOT, False
+
+    async def handle(update):
+        await rate_dispatcher.serve_cached_and_update(update, ccy_code="EUR", country_iso3=None)
+
+    processor = ChatOrderedUpdateProcessor(limit, max_pending=limit * 8)
+    with mock.patch.object(rate_dispatcher, "current_snapshot", slow_snapshot), \
+         mock.patch.object(rate_dispatcher, "RESPONSE_PRERENDER", False):
+        async with processor:
+            start = time.perf_counter()
+            await asyncio.gather(*(processor.process_update(u, handle(u)) for u in updates))
+            return time.perf_counter() - start
+
+
+def _check_order(log: list) -> bool:
+    last: dict[int, int] = {}
+    for chat_id, msg_id in log:
+        if msg_id < last.get(chat_id, -1):
+            return False
+        last[chat_id] = msg_id
+    return True
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--updates", type=int, default=400)
+    ap.add_argument("--chats", type=int, default=50)
+    ap.add_argument("--fx-ms", type=float, default=40)
+    ap.add_argument("--send-ms", type=float, default=60)
+    ap.add_argument("--limits", default="1,2,4,8,16,32,64")
+    args = ap.parse_args()
+
+    SlowMessage.send_delay = args.send_ms / 1000
+    print(f"{args.updates} updates, {args.chats} chats, fx={args.fx_ms}ms send={args.send_ms}ms")
+    print(f"{'limit':>6} {'seconds':>9} {'updates/s':>10} {'in-order':>9}")
+    for limit in (int(x) for x in args.limits.split(",")):
+        SlowMessage.log = []
+        elapsed = asyncio.run(_run(limit, _make_updates(args.updates, args.chats), args.fx_ms / 1000))
+        print(f"{limit:>6} {elapsed:>9.2f} {args.updates / elapsed:>10.1f} {str(_check_order(SlowMessage.log)):>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""
+Микробенчмарки горячего пути: резолвер → расчёт/карточка → serve_cached_and_update, /trend.
+
+Полностью офлайн: словари — образцы из benchmarks/data, хранилище и FX API —
+in-memory стенды (benchmarks/fakes.py). Для каждого сценария печатаем p50/p90/p99
+и число обращений к хранилищу и FX API на запрос:
+    python -m benchmarks.bench_hotpaths [--requests 2000] [--json out.json]
+    python -m benchmarks.bench_hotpaths --baseline out.json [--tolerance 1.5]   # exit 1 при регрессии p50
+"""
+import os
+from pathlib import Path
+
+_DATA = Path(__file__).resolve().parent / "data"
+# до импорта cake_dictionary: словари из образцов, без Firestore и без собранного снимка
+os.environ.setdefault("DICTIONARY_SOURCE", "local")
+os.environ.setdefault("DICTIONARY_DATA_DIR", str(_DATA))
+os.environ.setdefault("DICTIONARY_SNAPSHOT", str(_DATA / "missing.snapshot"))
+os.environ.setdefault("HISTORY_DB_PATH", ":memory:")
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import sys
+import time
+from contextlib import ExitStack
+from unittest import mock
+
+import calculator
+import cake_dictionary
+import rate_dispatcher
+import wage_index
+from benchmarks.fakes import FakeFXAPI, FakeStore, FakeUpdate, reset_process_state
+from calculator import compute_cake_salary
+from config import CAKE_PRICE_KZT
+from salary_card import salary_card
+
+_RATES = {"USD": 0.00196, "EUR": 0.00181, "RUB": 0.178, "GBP": 0.00155, "CNY": 0.0141, "UAH": 0.081,
+          "BYN": 0.0064, "UZS": 24.9, "KGS": 0.171, "AMD": 0.76, "PLN": 0.0078, "TRY": 0.067, "JPY": 0.29}
+_GARBAGE = ["привет", "сколько стоит торт?", "123", "🎂", "", "   ", "a", "KZ", "asdfgh", "USDT", "евро доллар"]
+
+
+# ───────────────────────────────
+# КОРПУС
+
+def _variants(s: str, rnd: random.Random) -> str:
+    return rnd.choice((s, s.lower(), s.title(), f"  {s} ", s.capitalize()))
+
+
+def _typo(s: str, rnd: random.Random) -> str:
+    i = rnd.randrange(1, len(s))
+    return s[:i] + s[i + 1:] if rnd.random() < 0.5 else s[:i] + rnd.choice("АЕИОУAEIOU") + s[i + 1:]
+
+
+def build_corpus(n: int, seed: int = 42) -> list[str]:
+    """Смесь, похожая на реальный трафик: коды и алиасы валют, страны целиком, префиксы, опечатки, мусор."""
+    rnd = random.Random(seed)
+    d = cake_dictionary.current()
+    codes = sorted(set(d.alias_to_ccy.values()))
+    aliases = sorted(d.alias_to_ccy)
+    names = sorted(d.country_name_to_iso3)
+    long_names = [x for x in names if len(x) >= 6]
+    kinds = (
+        (0.30, lambda: rnd.choice(codes)),
+        (0.15, lambda: rnd.choice(aliases)),
+        (0.25, lambda: rnd.choice(names)),
+        (0.12, lambda: (lambda x: x[:rnd.randint(4, min(6, len(x)))])(rnd.choice(long_names))),
+        (0.10, lambda: _typo(rnd.choice(long_names), rnd)),
+        (0.08, lambda: rnd.choice(_GARBAGE)),
+    )
+    out = []
+    for _ in range(n):
+        r, acc = rnd.random(), 0.0
+        for weight, make in kinds:
+            acc += weight
+            if r <= acc:
+                break
+        out.append(_variants(make(), rnd))
+    return out
+
+
+WAGE_YEAR = 2024
+
+
+def wage_docs(years=(WAGE_YEAR,)) -> list[dict]:
+    rnd = random.Random(7)
+    iso3s = sorted(set(cake_dictionary.current().country_name_to_iso3.values()))
+    return [
+        {"iso3": iso3, "country": iso3.title(), "value": rnd.randint(300, 7000), "unit": "USD", "year": year,
+         "source": {"name": "UNECE", "year": year, "url": "https://w3.unece.org/"}}
+        for iso3 in iso3s for year in years
+    ]
+
+
+# ───────────────────────────────
+# ЗАМЕРЫ
+
+def _percentiles(samples_ns: list[int]) -> dict:
+    s = sorted(samples_ns)
+
+    def pct(p):
+        return s[min(len(s) - 1, int(len(s) * p))] / 1000
+
+    return {"p50": pct(0.50), "p90": pct(0.90), "p99": pct(0.99), "max": s[-1] / 1000, "n": len(s)}
+
+
+def bench_sync(fn, inputs) -> dict:
+    samples = []
+    for x in inputs:
+        t0 = time.perf_counter_ns()
+        fn(x)
+        samples.append(time.perf_counter_ns() - t0)
+    return _percentiles(samples)
+
+
+async def bench_dispatch(pairs, store: FakeStore, fx: FakeFXAPI, before=None) -> dict:
+    """serve_cached_and_update на каждую пару; before() — подготовка состояния, вне замера."""
+    calls_before, fx_before = store.calls.copy(), fx.requests
+    samples = []
+    for ccy, iso3 in pairs:
+        if before:
+            before()
+        update = FakeUpdate()
+        t0 = time.perf_counter_ns()
+        await rate_dispatcher.serve_cached_and_update(update, ccy_code=ccy, country_iso3=iso3)
+        samples.append(time.perf_counter_ns() - t0)
+        assert update.message.replies, "no reply"
+    # фоновые рефреши (stale-while-revalidate) тоже считаем
+    if rate_dispatcher._refresh_task:
+        await rate_dispatcher._refresh_task
+    stats = _percentiles(samples)
+    n = len(pairs)
+    stats["store_calls"] = {k: (v - calls_before[k]) / n for k, v in store.calls.items() if v != calls_before[k]}
+    stats["fx_requests"] = (fx.requests - fx_before) / n
+    return stats
+
+
+def _drop_process_snapshot():
+    calculator._snapshot = None
+    rate_dispatcher._stored_at = None
+    rate_dispatcher._recorded_version = None
+
+
+def _drop_responses():
+    rate_dispatcher.response_cache.clear()
+
+
+async def run_dispatcher(pairs) -> dict[str, dict]:
+    results = {}
+    with ExitStack() as stack:
+        store = FakeStore(wage_docs()).install(stack)
+        fx = FakeFXAPI(_RATES).install(stack)
+        reset_process_state(stack)
+        await wage_index.refresh_wage_index()
+
+        def empty_store():
+            _drop_process_snapshot()
+            _drop_responses()
+            store.snapshots.clear()
+
+        def stored_only():
+            _drop_process_snapshot()
+            _drop_responses()
+
+        # порядок важен: сначала пустое хранилище (FX API), дальше — всё теплее
+        results["empty store → FX API"] = await bench_dispatch(pairs[:200], store, fx, empty_store)
+        results["snapshot in store only"] = await bench_dispatch(pairs[:500], store, fx, stored_only)
+        results["in-process, cache miss"] = await bench_dispatch(pairs, store, fx, _drop_responses)
+        results["warm (cache hit)"] = await bench_dispatch(pairs, store, fx)
+    return results
+
+
+def run_all(n: int) -> dict[str, dict]:
+    corpus = build_corpus(n)
+    resolved = [cake_dictionary.resolve_user_input(q) for q in corpus]
+    pairs = [p for p in resolved if p[0] or p[1]]
+
+    results = {"resolver/resolve_user_input": bench_sync(cake_dictionary.resolve_user_input, corpus)}
+
+    kzt_per_usd = 1 / _RATES["USD"]
+    salaries = [d["value"] for d in wage_docs()] * (n // 50 + 1)
+    results["calculator/compute_cake_salary"] = bench_sync(
+        lambda s: compute_cake_salary(s, kzt_per_usd=kzt_per_usd), salaries[:n])
+    calcs = []
+    for doc in wage_docs():
+        calc = compute_cake_salary(doc["value"], kzt_per_usd=kzt_per_usd)
+        calc.update(country=doc["country"], unit="USD", value=doc["value"], source=doc["source"],
+                    converted_price=CAKE_PRICE_KZT / kzt_per_usd, amount=123.45, ccy_code="USD",
+                    ts_display="2025-01-01 00:00:00")
+        calcs.append(calc)
+    results["calculator/salary_card"] = bench_sync(salary_card, (calcs * (n // len(calcs) + 1))[:n])
+
+    # /trend: ряды за 25 лет по всем странам, расчёт только в памяти
+    series = wage_index.build_series(wage_docs(range(WAGE_YEAR - 24, WAGE_YEAR + 1)))
+    iso3s = list(series) * (n // len(series) + 1)
+    cake_usd = CAKE_PRICE_KZT * _RATES["USD"]
+    with mock.patch.object(wage_index, "_series", series):
+        results["wages/cake_trend"] = bench_sync(lambda i: rate_dispatcher.cake_trend(i, cake_usd), iso3s[:n])
+
+    for label, stats in asyncio.run(run_dispatcher(pairs)).items():
+        results[f"dispatcher/{label}"] = stats
+    return results
+
+
+def _print(results: dict[str, dict]) -> None:
+    print(f"  {'scenario':<42} {'p50 µs':>9} {'p90 µs':>9} {'p99 µs':>9} {'max µs':>9}  backend calls / request")
+    for name, s in results.items():
+        backend = ""
+        if "fx_requests" in s:
+            calls = {**s["store_calls"], "fx_http": s["fx_requests"]}
+            backend = ", ".join(f"{k}={v:.2f}" for k, v in calls.items() if v) or "—"
+        print(f"  {name:<42} {s['p50']:9.1f} {s['p90']:9.1f} {s['p99']:9.1f} {s['max']:9.1f}  {backend}")
+
+
+def _regressions(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    out = []
+    for name, base in baseline.items():
+        cur = results.get(name)
+        if cur and cur["p50"] > base["p50"] * tolerance:
+            out.append(f"{name}: p50 {cur['p50']:.1f} µs > {base['p50']:.1f} µs × {tolerance}")
+        if cur and "fx_requests" in base and (cur["fx_requests"] > base["fx_requests"]
+                                              or any(v > base["store_calls"].get(k, 0) for k, v in cur["store_calls"].items())):
+            out.append(f"{name}: больше обращений к бэкенду, чем в базовой линии")
+    return out
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--requests", type=int, default=2000)
+    ap.add_argument("--json", type=Path, help="сохранить результаты (базовая линия)")
+    ap.add_argument("--baseline", type=Path, help="сравнить с сохранённой базовой линией")
+    ap.add_argument("--tolerance", type=float, default=1.5)
+    args = ap.parse_args()
+
+    logging.disable(logging.WARNING)
+    results = run_all(args.requests)
+    print(f"{args.requests} inputs, dictionaries {cake_dictionary.current().version}")
+    _print(results)
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2, ensure_ascii=False), encoding="utf-8")
+    if args.baseline:
+        bad = _regressions(results, json.loads(args.baseline.read_text(encoding="utf-8")), args.tolerance)
+        for line in bad:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if bad else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
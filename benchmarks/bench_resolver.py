@@ -0,0 +1,103 @@
+"""
+Резолвер стран: текущие dict-ы (с руками выписанными префиксами) против CountryIndex.
+
+Меряем время построения, задержку поиска (p50/p99) и память (tracemalloc):
+    python -m benchmarks.bench_resolver [--data benchmarks/data] [--repeat 20]
+
+«dict + все префиксы» — это то, во что превратится country_name_to_iso3.json,
+если продолжать дописывать туда каждый 4–N-буквенный префикс руками.
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+import tracemalloc
+from pathlib import Path
+
+from cake_dictionary import CountryIndex, norm_country
+
+DEFAULT_DATA = Path(__file__).resolve().parent / "data"
+
+
+def _measure(build):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    obj = build()
+    build_ms = (time.perf_counter() - t0) * 1000
+    mem = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return obj, build_ms, mem
+
+
+def _with_all_prefixes(names: dict[str, str]) -> dict[str, str]:
+    out = dict(names)
+    owners: dict[str, set] = {}
+    for name, iso3 in names.items():
+        for n in range(4, len(name)):
+            owners.setdefault(name[:n], set()).add(iso3)
+    out.update({p: next(iter(isos)) for p, isos in owners.items() if len(isos) == 1 and p not in out})
+    return out
+
+
+def _typo(s: str, rnd: random.Random) -> str:
+    i = rnd.randrange(1, len(s))
+    return s[:i] + s[i + 1:] if rnd.random() < 0.5 else s[:i] + rnd.choice("АЕИОУAEIOU") + s[i + 1:]
+
+
+def _corpus(names: list[str], rnd: random.Random) -> dict[str, list[str]]:
+    long_names = [n for n in names if len(n) >= 6]
+    return {
+        "exact": names,
+        "prefix": [n[:rnd.randint(4, min(6, len(n)))] for n in long_names],
+        "typo": [_typo(n, rnd) for n in long_names],
+    }
+
+
+def _latency(fn, queries: list[str], repeat: int) -> tuple[float, float, float]:
+    samples = []
+    found = 0
+    for _ in range(repeat):
+        for q in queries:
+            t0 = time.perf_counter_ns()
+            r = fn(q)
+            samples.append(time.perf_counter_ns() - t0)
+            found += r is not None
+    samples.sort()
+    p50 = statistics.median(samples) / 1000
+    p99 = samples[int(len(samples) * 0.99) - 1] / 1000
+    return p50, p99, found / (len(queries) * repeat)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--data", type=Path, default=DEFAULT_DATA)
+    ap.add_argument("--repeat", type=int, default=20)
+    args = ap.parse_args()
+
+    raw = json.loads((args.data / "country_name_to_iso3.json").read_text(encoding="utf-8"))
+    names = {norm_country(k): v.strip().upper() for k, v in raw.items() if isinstance(v, str)}
+    rnd = random.Random(42)
+    corpus = _corpus(sorted(names), rnd)
+
+    plain, plain_ms, plain_mem = _measure(lambda: dict(names))
+    inflated, infl_ms, infl_mem = _measure(lambda: _with_all_prefixes(names))
+    index, idx_ms, idx_mem = _measure(lambda: CountryIndex(names))
+
+    def index_lookup(q):
+        return names.get(q) or index.lookup(q)
+
+    print(f"{len(names)} names; build / memory:")
+    print(f"  {'dict (как сейчас)':<28} {plain_ms:8.2f} ms {plain_mem / 1024:9.1f} KiB ({len(plain)} keys)")
+    print(f"  {'dict + все префиксы':<28} {infl_ms:8.2f} ms {infl_mem / 1024:9.1f} KiB ({len(inflated)} keys)")
+    print(f"  {'dict + CountryIndex':<28} {idx_ms:8.2f} ms {(plain_mem + idx_mem) / 1024:9.1f} KiB")
+    print()
+    print(f"  {'queries':<8} {'resolver':<22} {'p50 µs':>8} {'p99 µs':>8} {'resolved':>9}")
+    for kind, queries in corpus.items():
+        for label, fn in (("dict", plain.get), ("dict + все префиксы", inflated.get), ("dict + CountryIndex", index_lookup)):
+            p50, p99, hit = _latency(fn, queries, args.repeat)
+            print(f"  {kind:<8} {label:<22} {p50:8.2f} {p99:8.2f} {hit:9.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Холодный старт: время от запуска интерпретатора до первого обработанного апдейта.
+
+Каждый замер — отдельный процесс `python -c ...`: import main → post_init
+(загрузка индекса зарплат) → on_text("USD") с фейковым reply_text. Хранилище —
+временная SQLite (DB_BACKEND=sqlite), FX-снимок подставляем в память: сеть
+здесь не меряем. Сравниваем словари из бинарного снимка и из JSON:
+    python -m benchmarks.bench_startup [--data benchmarks/data] [--runs 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_DATA = Path(__file__).resolve().parent / "data"
+
+_CHILD = r"""
+import asyncio, json, sys, time
+t0 = time.perf_counter()
+import main
+t_import = time.perf_counter()
+from telegram import Chat, Message, Update
+from calculator import FXSnapshot, set_fx_snapshot
+
+class _Message(Message):
+    async def reply_text(self, text, **kwargs):
+        self.__dict__.setdefault("_replies", []).append(text)
+
+async def first_update():
+    await main.post_init(None)
+    set_fx_snapshot(FXSnapshot(base="KZT", rates={"USD": 0.002}, provider_ts=None))
+    msg = _Message(message_id=1, date=None, chat=Chat(id=1, type="private"), text="USD")
+    await main.on_text(Update(update_id=1, message=msg), None)
+    assert msg.__dict__.get("_replies"), "no reply"
+
+asyncio.run(first_update())
+t_done = time.perf_counter()
+print(json.dumps({
+    "import_ms": (t_import - t0) * 1000,
+    "first_update_ms": (t_done - t0) * 1000,
+    "firestore_loaded": "google.cloud.firestore" in sys.modules,
+}))
+"""
+
+_FIRESTORE_IMPORT = r"""
+import json, time
+t0 = time.perf_counter()
+from google.cloud import firestore
+print(json.dumps({"import_ms": (time.perf_counter() - t0) * 1000}))
+"""
+
+
+def _run(code: str, env: dict) -> tuple[dict, float]:
+    t0 = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env,
+                         capture_output=True, text=True, check=True)
+    wall_ms = (time.perf_counter() - t0) * 1000
+    return json.loads(out.stdout.strip().splitlines()[-1]), wall_ms
+
+
+def _series(code: str, env: dict, runs: int) -> tuple[dict, float, bool]:
+    results = [_run(code, env) for _ in range(runs)]
+    med = {k: statistics.median(r[k] for r, _ in results) for k in results[0][0] if k.endswith("_ms")}
+    wall = statistics.median(w for _, w in results)
+    return med, wall, any(r.get("firestore_loaded") for r, _ in results)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--data", type=Path, default=DEFAULT_DATA)
+    ap.add_argument("--runs", type=int, default=5)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot = Path(tmp) / "dictionary.snapshot"
+        base_env = {
+            **os.environ,
+            "DB_BACKEND": "sqlite",
+            "DB_PATH": str(Path(tmp) / "bench.db"),
+            "DICTIONARY_DATA_DIR": str(args.data),
+            "PYTHONDONTWRITEBYTECODE": "1",
+        }
+        subprocess.run([sys.executable, "dictionary_data.py", "--source", "local", "--out", str(snapshot)],
+                       cwd=ROOT, env=base_env, check=True, capture_output=True)
+        variants = {
+            "snapshot": {**base_env, "DICTIONARY_SNAPSHOT": str(snapshot)},
+            "json": {**base_env, "DICTIONARY_SNAPSHOT": str(Path(tmp) / "missing.snapshot")},
+        }
+
+        print(f"{args.runs} runs per variant (median), DB_BACKEND=sqlite")
+        print(f"  {'dictionaries':<14} {'import ms':>10} {'1st update ms':>14} {'process ms':>11} {'firestore':>10}")
+        for label, env in variants.items():
+            med, wall, fs = _series(_CHILD, env, args.runs)
+            print(f"  {label:<14} {med['import_ms']:10.1f} {med['first_update_ms']:14.1f} {wall:11.1f} {str(fs):>10}")
+
+        try:
+            med, _, _ = _series(_FIRESTORE_IMPORT, base_env, args.runs)
+            print(f"\n  import google.cloud.firestore (теперь отложен до первого обращения): {med['import_ms']:.1f} ms")
+        except subprocess.CalledProcessError:
+            print("\n  google-cloud-firestore не установлен")
+
+
+if __name__ == "__main__":
+    main()
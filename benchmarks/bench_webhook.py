@@ -0,0 +1,135 @@
+"""
+Нагрузочный прогон вебхука синтетическими апдейтами: время ack и пропускная способность.
+
+В процессе (по умолчанию): asgi_app.WebhookApp с настоящими хендлерами main.py, но
+Telegram/FX/хранилище — фейки из benchmarks/fakes.py (send-ms — задержка «Telegram»):
+    python -m benchmarks.bench_webhook [--updates 2000] [--chats 500] [--send-ms 30] [--workers 16]
+По HTTP против запущенного сервера (uvicorn asgi_app:app ...):
+    python -m benchmarks.bench_webhook --url http://127.0.0.1:8080/tgwebhook --secret ... [--concurrency 64]
+"""
+import os
+from pathlib import Path
+
+_DATA = Path(__file__).resolve().parent / "data"
+os.environ.setdefault("DICTIONARY_SOURCE", "local")
+os.environ.setdefault("DICTIONARY_DATA_DIR", str(_DATA))
+os.environ.setdefault("DICTIONARY_SNAPSHOT", str(_DATA / "missing.snapshot"))
+os.environ.setdefault("HISTORY_DB_PATH", ":memory:")
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+from contextlib import ExitStack
+
+import httpx
+from telegram.ext import Application, MessageHandler, filters
+
+import asgi_app
+import metrics
+import wage_index
+from benchmarks.bench_hotpaths import _RATES, _percentiles, wage_docs
+from benchmarks.fakes import (FakeFXAPI, FakeStore, FakeTelegramAPI, asgi_request, reset_process_state,
+                              synthetic_update)
+from update_processor import ChatOrderedUpdateProcessor
+
+_TEXTS = ("USD", "EUR", "RUB", "Германия", "США", "GBP", "Китай", "UZS", "Армения", "привет")
+_SECRET = "bench-secret"
+
+
+def _payloads(n: int, chats: int) -> list[bytes]:
+    # у одного чата тексты не повторяются подряд — флуд-контроль не сливает их как дубли
+    return [json.dumps(synthetic_update(i, 1000 + i % chats, _TEXTS[(i + i // chats) % len(_TEXTS)])).encode()
+            for i in range(n)]
+
+
+def build_bench_app(telegram: FakeTelegramAPI, workers: int) -> asgi_app.WebhookApp:
+    import main   # хендлеры бота; TELEGRAM_TOKEN не нужен
+
+    def build() -> Application:
+        app = (Application.builder().token("1:BENCH").request(telegram).updater(None)
+               .concurrent_updates(ChatOrderedUpdateProcessor(workers)).build())
+        app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, main.on_text))
+        return app
+
+    return asgi_app.WebhookApp(build, secret=_SECRET, queue_size=1 << 16)
+
+
+async def run_in_process(n: int, chats: int, send_ms: float, workers: int) -> dict:
+    telegram = FakeTelegramAPI(delay=send_ms / 1000)
+    with ExitStack() as stack:
+        FakeStore(wage_docs()).install(stack)
+        FakeFXAPI(_RATES).install(stack)
+        reset_process_state(stack)
+        await wage_index.refresh_wage_index()
+        app = build_bench_app(telegram, workers)
+        await app.startup()
+        headers = {"X-Telegram-Bot-Api-Secret-Token": _SECRET}
+        acks = []
+        start = time.perf_counter()
+        for body in _payloads(n, chats):
+            t0 = time.perf_counter_ns()
+            status, _ = await asgi_request(app, "POST", "/" + asgi_app.WEBHOOK_PATH, body, headers)
+            acks.append(time.perf_counter_ns() - t0)
+            assert status == 200, status
+        accepted = time.perf_counter() - start
+        await app.queue.join()
+        done = time.perf_counter() - start
+        await app.shutdown()
+    stats = _percentiles(acks)
+    stats.update(accepted_s=accepted, processed_s=done, updates_per_s=n / done,
+                 replies=telegram.calls["sendMessage"], flood_dropped=sum(
+                     metrics.FLOOD_DROPPED.value(reason=r) for r in ("duplicate", "limited")))
+    return stats
+
+
+async def run_http(url: str, secret: str, n: int, chats: int, concurrency: int) -> dict:
+    payloads = _payloads(n, chats)
+    acks, errors = [], 0
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(client, body):
+        nonlocal errors
+        async with sem:
+            t0 = time.perf_counter_ns()
+            r = await client.post(url, content=body, headers={"X-Telegram-Bot-Api-Secret-Token": secret,
+                                                              "Content-Type": "application/json"})
+            acks.append(time.perf_counter_ns() - t0)
+            errors += r.status_code != 200
+
+    start = time.perf_counter()
+    async with httpx.AsyncClient(limits=httpx.Limits(max_connections=concurrency)) as client:
+        await asyncio.gather(*(one(client, b) for b in payloads))
+    elapsed = time.perf_counter() - start
+    stats = _percentiles(acks)
+    stats.update(accepted_s=elapsed, updates_per_s=n / elapsed, errors=errors)
+    return stats
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--updates", type=int, default=2000)
+    ap.add_argument("--chats", type=int, default=500)
+    ap.add_argument("--send-ms", type=float, default=30)
+    ap.add_argument("--workers", type=int, default=16)
+    ap.add_argument("--url", help="вебхук запущенного сервера; без него — прогон в процессе")
+    ap.add_argument("--secret", default="")
+    ap.add_argument("--concurrency", type=int, default=64)
+    args = ap.parse_args()
+
+    logging.disable(logging.WARNING)
+    if args.url:
+        s = asyncio.run(run_http(args.url, args.secret, args.updates, args.chats, args.concurrency))
+    else:
+        s = asyncio.run(run_in_process(args.updates, args.chats, args.send_ms, args.workers))
+    print(f"{args.updates} updates, {args.chats} chats")
+    print(f"  ack µs: p50 {s['p50']:.1f}  p90 {s['p90']:.1f}  p99 {s['p99']:.1f}  max {s['max']:.1f}")
+    print(f"  accepted in {s['accepted_s']:.2f}s, {s['updates_per_s']:.0f} updates/s end-to-end")
+    for key in ("processed_s", "replies", "flood_dropped", "errors"):
+        if key in s:
+            print(f"  {key}: {s[key]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+In-memory стенды вместо Firestore/SQLite и FX API для офлайн-бенчмарков.
+
+FakeStore подменяет функции хранилища в модулях, которые их импортировали
+(rate_dispatcher, wage_index, wage_writer), и считает вызовы; FakeFXAPI —
+httpx.MockTransport с ответом в формате open.er-api.com; FakeTelegramAPI —
+Bot API для python-telegram-bot (getMe, sendMessage, ...) без сети.
+"""
+import asyncio
+import copy
+import json
+import time
+from collections import Counter
+from contextlib import ExitStack
+from unittest import mock
+
+import httpx
+
+import calculator
+import rate_dispatcher
+import wage_index
+import wage_writer
+from fx_providers import Provider
+from telegram.request import BaseRequest
+
+
+class FakeStore:
+    """Хранилище снимков и зарплат в памяти; calls — счётчик вызовов по имени функции."""
+
+    def __init__(self, wage_docs: list[dict] | None = None):
+        self.snapshots: list[dict] = []
+        self.wages: dict[str, dict] = {d["iso3"]: dict(d) for d in (wage_docs or [])}
+        self.calls: Counter = Counter()
+        self.leases: dict[str, tuple[str, float]] = {}   # name -> (owner, monotonic expires_at)
+
+    def get_latest_snapshot(self, base="KZT", fresh=False):
+        self.calls["get_latest_snapshot"] += 1
+        return copy.deepcopy(self.snapshots[-1]) if self.snapshots else None
+
+    def cache_snapshot(self, doc):
+        self.calls["cache_snapshot"] += 1
+        self.snapshots.append(copy.deepcopy(doc))
+
+    def acquire_lease(self, name, owner, ttl_seconds):
+        self.calls["acquire_lease"] += 1
+        held = self.leases.get(name)
+        if held and held[0] != owner and held[1] > time.monotonic():
+            return False
+        self.leases[name] = (owner, time.monotonic() + ttl_seconds)
+        return True
+
+    def release_lease(self, name, owner):
+        self.calls["release_lease"] += 1
+        if self.leases.get(name, ("",))[0] == owner:
+            del self.leases[name]
+
+    def list_wage_docs(self):
+        self.calls["list_wage_docs"] += 1
+        return [dict(d) for d in self.wages.values()]
+
+    def upsert_wage_docs(self, updates, year, unit="USD"):
+        self.calls["upsert_wage_docs"] += 1
+        for iso3, patch in updates.items():
+            self.wages.setdefault(iso3, {"iso3": iso3}).update(patch)
+
+    def install(self, stack: ExitStack) -> "FakeStore":
+        for module, names in (
+            (rate_dispatcher, ("get_latest_snapshot", "cache_snapshot", "acquire_lease", "release_lease")),
+            (wage_index, ("list_wage_docs",)),
+            (wage_writer, ("upsert_wage_docs",)),
+        ):
+            for name in names:
+                stack.enter_context(mock.patch.object(module, name, getattr(self, name)))
+        return self
+
+
+class FakeFXAPI:
+    """FX-провайдер: одна таблица курсов base=KZT; requests — число HTTP-запросов."""
+
+    def __init__(self, rates: dict[str, float]):
+        self.rates = rates
+        self.requests = 0
+
+    def _handler(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        body = {"result": "success", "base_code": "KZT", "time_last_update_unix": 1_700_000_000, "rates": self.rates}
+        return httpx.Response(200, content=json.dumps(body))
+
+    def install(self, stack: ExitStack) -> "FakeFXAPI":
+        client = httpx.AsyncClient(transport=httpx.MockTransport(self._handler))
+        stack.enter_context(mock.patch.object(calculator, "_get_client", lambda: client))
+        # один провайдер в формате open.er-api: hedge-запросы не искажают счёт обращений
+        stack.enter_context(mock.patch.object(calculator, "_providers", [Provider("fake", calculator._API)]))
+        return self
+
+
+class FakeTelegramAPI(BaseRequest):
+    """request= для Application.builder(): отвечает на методы Bot API, считает их и может тормозить."""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.calls: Counter = Counter()
+        self.sent: list[dict] = []
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        name = url.rsplit("/", 1)[-1]
+        self.calls[name] += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        params = request_data.parameters if request_data else {}
+        if name == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Cake", "username": "cake_bot"}
+        elif name == "sendMessage":
+            self.sent.append(params)
+            result = {"message_id": len(self.sent), "date": 0, "text": params.get("text", ""),
+                      "chat": {"id": params.get("chat_id"), "type": "private"}}
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+def synthetic_update(update_id: int, chat_id: int, text: str, chat_type: str = "private") -> dict:
+    """JSON апдейта с текстовым сообщением — как его присылает Telegram на вебхук."""
+    return {"update_id": update_id,
+            "message": {"message_id": update_id, "date": 0, "text": text,
+                        "chat": {"id": chat_id, "type": chat_type},
+                        "from": {"id": chat_id, "is_bot": False, "first_name": "U"}}}
+
+
+async def asgi_request(app, method: str, path: str, body: bytes = b"", headers: dict | None = None):
+    """Один HTTP-запрос к ASGI-приложению без сервера: (status, body)."""
+    scope = {"type": "http", "method": method, "path": path, "query_string": b"",
+             "headers": [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]}
+    sent = []
+    pending = [{"type": "http.request", "body": body, "more_body": False}]
+
+    async def receive():
+        return pending.pop(0) if pending else {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    return sent[0]["status"], b"".join(m.get("body", b"") for m in sent[1:])
+
+
+class FakeMessage:
+    def __init__(self, text: str = ""):
+        self.text = text
+        self.replies: list[str] = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+
+
+class FakeUpdate:
+    def __init__(self, text: str = ""):
+        self.message = FakeMessage(text)
+
+
+def reset_process_state(stack: ExitStack) -> None:
+    """Чистый процесс: без снимка в памяти, без кеша ответов, без фоновых задач."""
+    for module, name, value in (
+        (calculator, "_snapshot", None),
+        (calculator, "_refresh_lock", asyncio.Lock()),
+        (rate_dispatcher, "_stored_at", None),
+        (rate_dispatcher, "_recorded_version", None),
+        (rate_dispatcher, "_refresh_task", None),
+        (rate_dispatcher, "_prerendered_for", None),
+        (rate_dispatcher, "_prerender_task", None),
+        (rate_dispatcher, "_lease_busy_until", 0.0),
+        (wage_index, "_refresh_task", None),
+        (wage_writer, "_pending", {}),
+        (wage_writer, "_last_written", {}),
+    ):
+        stack.enter_context(mock.patch.object(module, name, value))
+    rate_dispatcher.response_cache.clear()
@@ -0,0 +1,131 @@
+# cache.py — in-process LRU с TTL на запись (первый уровень перед хранилищем)
+#            и SingleFlight — схлопывание одинаковых запросов в полёте
+import asyncio
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+MISSING = object()  # маркер промаха: None — валидное (негативное) значение
+
+
+class LRUCache:
+    """
+    Ограниченный LRU-кеш с TTL на каждую запись и счётчиками hit/miss/eviction.
+    Потокобезопасен: хранилище вызывается и из event loop, и из asyncio.to_thread.
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=MISSING):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl: float | None = None) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def memory_bytes(self) -> int:
+        """Грубая оценка: ключи + значения (строки/кортежи/словари первого уровня)."""
+        def size(obj) -> int:
+            n = sys.getsizeof(obj)
+            if isinstance(obj, (tuple, list)):
+                n += sum(size(x) for x in obj)
+            elif isinstance(obj, dict):
+                n += sum(size(k) + size(v) for k, v in obj.items())
+            return n
+        with self._lock:
+            items = list(self._data.items())
+        return sum(size(k) + size(v) for k, (_, v) in items)
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class SingleFlight:
+    """
+    Схлопывание одинаковых запросов в полёте: пока для ключа идёт вычисление,
+    остальные вызовы с тем же ключом ждут его результат (или его исключение).
+    Если первого отменили, ожидающие не получают его CancelledError — один из них
+    запускает вычисление заново, остальные ждут уже его. Результат не кешируется — после завершения следующий вызов считает заново.
+    Только для одного event loop.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: dict = {}   # key -> asyncio.Future
+        self.calls = 0
+        self.shared = 0             # вызовы, получившие чужой результат
+
+    async def run(self, key, fn):
+        """fn() — фабрика корутины; вызывается только у первого в полёте."""
+        self.calls += 1
+        while (fut := self._inflight.get(key)) is not None:
+            self.shared += 1
+            try:
+                # shield: отмена одного ожидающего не должна отменять общий результат
+                return await asyncio.shield(fut)
+            except asyncio.CancelledError:
+                # отменили нас самих — выходим; отменили первого — пробуем снова
+                if not fut.cancelled() or asyncio.current_task().cancelling():
+                    raise
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except BaseException as e:
+            fut.set_exception(e)
+            fut.exception()   # помечаем извлечённым: без ожидающих не будет «never retrieved»
+            raise
+        else:
+            fut.set_result(result)
+            return result
+        finally:
+            self._inflight.pop(key, None)
+
+    def inflight(self) -> int:
+        return len(self._inflight)
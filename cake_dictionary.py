@@ -1,83 +1,226 @@
 # cake_dictionary.py  (простая версия)
-import json, re, unicodedata
-from pathlib import Path
+import asyncio, logging, re, sys, threading
+from array import array
+from bisect import bisect_left
+from types import MappingProxyType
+from dictionary_data import (SNAPSHOT_PATH, _norm_ccy, norm_country, build_from_sources,
+                             load_sources, read_snapshot, source_kind, source_stamps, source_version)
 
-# Где лежат json-файлы
-DATA_DIR = Path(__file__).resolve().parent / "cake_data"
+# ───────────────────────────────
+# Индекс по названиям стран: любой однозначный префикс (bisect по отсортированному
+# массиву) и небольшие опечатки (триграммы + ограниченное расстояние Левенштейна)
+# — без ручных алиасов вида «БЕЛГ».
 
-def _load_json(name: str):
+MIN_PREFIX_LEN = 3
+MIN_FUZZY_LEN = 4
+# опечатка внутри префикса — только для длинного ввода: у коротких слов почти любой
+# префикс на расстоянии 1 («торт» → «ПОРТ(УГАЛИЯ)», «test» → «EST(ONIA)»);
+# короче — сравниваем лишь с полными названиями
+MIN_FUZZY_PREFIX_LEN = 6
+_FUZZY_CANDIDATES = 32
+
+def _max_typos(n: int) -> int:
+    return 1 if n <= 6 else 2
+
+def _trigrams(s: str) -> set[int]:
+    # триграмма упакована в int (3 кодпоинта по 21 бит) — компактнее строковых ключей
+    p = [ord(c) for c in f"${s}$"]
+    return {(p[i] << 42) | (p[i + 1] << 21) | p[i + 2] for i in range(len(p) - 2)}
+
+def _prefix_distance(a: str, b: str, k: int, whole: bool = False) -> int:
     """
-    Загружаем JSON:
-    - prod: Firestore (collection=name_without_json, document=name_without_json)
-    - dev: локальный JSON-файл cake_data/name
+    min по j расстояния Левенштейна между a и b[:j] (опечатка в префиксе или в
+    полном названии), с отсечкой: всё, что больше k, возвращается как k+1.
+    whole=True — только расстояние до b целиком. Считаем полосу шириной 2k+1 вокруг диагонали.
     """
-    collection = name.replace(".json", "")
-    try:
-        from google.cloud import firestore
-        db = firestore.Client()
-
-        # читаем ровно один документ с таким же именем, как коллекция
-        doc_ref = db.collection(collection).document(collection)
-        doc = doc_ref.get()
-        if doc.exists:
-            return doc.to_dict()
-    except Exception as e:
-        print(f"⚠️ Firestore недоступен для {collection}, fallback на локальный JSON ({e})")
+    n = len(a)
+    cap = k + 1
+    if whole and len(b) > n + k:
+        return cap
+    b = b[:n + k]
+    m = len(b)
+    prev = [min(j, cap) for j in range(m + 1)]
+    for i in range(1, n + 1):
+        ca = a[i - 1]
+        lo, hi = max(1, i - k), min(m, i + k)
+        cur = [cap] * (m + 1)
+        cur[0] = min(i, cap)
+        for j in range(lo, hi + 1):
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != b[j - 1]), cap)
+        if min(cur[lo - 1:hi + 1]) >= cap:
+            return cap
+        prev = cur
+    if whole:
+        return prev[m]
+    return min(prev[max(0, n - k):] or [cap])
+
+class CountryIndex:
+    """
+    Компактный индекс: отсортированный кортеж имён + параллельный кортеж ISO3,
+    постинги триграмм упакованы в один array («триграмма -> (start << 16) | count»).
+    """
+
+    __slots__ = ("names", "iso3", "_grams", "_postings")
+
+    def __init__(self, name_to_iso3: dict[str, str]):
+        items = sorted(name_to_iso3.items())
+        self.names = tuple(k for k, _ in items)
+        self.iso3 = tuple(sys.intern(v) for _, v in items)
+        postings: dict[int, list[int]] = {}
+        for i, name in enumerate(self.names):
+            for g in _trigrams(name):
+                postings.setdefault(g, []).append(i)
+        self._postings = array("I")
+        self._grams: dict[int, int] = {}
+        for g, ids in postings.items():
+            self._grams[g] = (len(self._postings) << 16) | len(ids)
+            self._postings.extend(ids)
+
+    def prefix(self, text: str, limit: int | None = None) -> list[str]:
+        """Разные ISO3 стран, чьё название начинается с text (в порядке имён)."""
+        found: list[str] = []
+        i = bisect_left(self.names, text)
+        while i < len(self.names) and self.names[i].startswith(text):
+            if self.iso3[i] not in found:
+                found.append(self.iso3[i])
+                if limit and len(found) >= limit:
+                    break
+            i += 1
+        return found
+
+    def fuzzy(self, text: str) -> str | None:
+        """ISO3 ближайшего названия (или, для длинного ввода, его префикса), если он однозначен."""
+        k = _max_typos(len(text))
+        whole = len(text) < MIN_FUZZY_PREFIX_LEN
+        grams = _trigrams(text)
+        hits: dict[int, int] = {}
+        for g in grams:
+            packed = self._grams.get(g)
+            if packed is None:
+                continue
+            start = packed >> 16
+            for i in self._postings[start:start + (packed & 0xFFFF)]:
+                hits[i] = hits.get(i, 0) + 1
+        # q-граммный фильтр: d правок портят не больше 3d триграмм (+1 — хвост «$» у префикса)
+        min_len, max_len = len(text) - k, (len(text) + k if whole else float("inf"))
+        candidates = [i for i, n in hits.items()
+                      if n >= len(grams) - 3 * k - 1 and min_len <= len(self.names[i]) <= max_len]
+        candidates.sort(key=hits.__getitem__, reverse=True)
+        best_d, best = k + 1, set()
+        for i in candidates[:_FUZZY_CANDIDATES]:
+            if hits[i] < len(grams) - 3 * best_d - 1:
+                break  # дальше кандидаты не могут быть даже не хуже лучшего
+            d = _prefix_distance(text, self.names[i], k, whole)
+            if d < best_d:
+                best_d, best = d, {self.iso3[i]}
+            elif d == best_d:
+                best.add(self.iso3[i])
+        return next(iter(best)) if best_d <= k and len(best) == 1 else None
+
+    def lookup(self, text: str) -> str | None:
+        """Однозначный префикс → ISO3, иначе попытка с опечаткой."""
+        if len(text) >= MIN_PREFIX_LEN:
+            found = self.prefix(text, limit=2)
+            if len(found) == 1:
+                return found[0]
+            if found:
+                return None  # префикс неоднозначен — гадать не будем
+        if len(text) >= MIN_FUZZY_LEN:
+            return self.fuzzy(text)
+        return None
+
+# ───────────────────────────────
+# Опубликованные словари: один неизменяемый объект на версию. Перезагрузка строит
+# новый целиком (в потоке, вне обработки апдейтов) и подменяет ссылку _current —
+# присваивание атомарно, поэтому читатель, взявший current(), никогда не увидит
+# недостроенную карту или индекс от другой версии.
+
+class Dictionaries:
+    __slots__ = ("version", "alias_to_ccy", "ccy_aliases", "iso3_to_ccy", "ccy_to_iso3", "country_name_to_iso3",
+                 "iso3_to_name", "index")
+
+    def __init__(self, maps: dict[str, dict], version: str):
+        self.version = version
+        self.alias_to_ccy = MappingProxyType(dict(maps["alias_to_ccy"]))                  # алиас валюты → код валюты
+        self.ccy_aliases = tuple(sorted(self.alias_to_ccy))                                # для префиксного поиска
+        self.iso3_to_ccy = MappingProxyType(dict(maps["iso3_to_ccy"]))                    # ISO3 → базовая валюта страны
+        self.ccy_to_iso3 = MappingProxyType({c: i for i, c in self.iso3_to_ccy.items()})  # валюта → «её» страна
+        self.country_name_to_iso3 = MappingProxyType(dict(maps["country_name_to_iso3"]))  # название/алиас → ISO3
+        # обратная мапа ISO3 -> NAME (первый попавшийся нейм — стабильно в рамках версии)
+        iso3_to_name: dict[str, str] = {}
+        for name, iso in self.country_name_to_iso3.items():
+            iso3_to_name.setdefault(iso, name)
+        self.iso3_to_name = MappingProxyType(iso3_to_name)
+        self.index = CountryIndex(self.country_name_to_iso3)
+
+# Загружаем данные: сначала готовый бинарный снимок (собран при сборке образа),
+# иначе — Firestore/локальные JSON (см. dictionary_data.load_sources).
+# Снимок из другого источника (образ собран из локальных JSON, а DICTIONARY_SOURCE —
+# Firestore) не берём: иначе до первой перезагрузки отвечали бы по чужим словарям
+def _load_initial() -> Dictionaries:
+    snap = read_snapshot(SNAPSHOT_PATH)
+    if snap is not None and snap.get("source", "local") != source_kind():
+        logging.info("dictionary snapshot %s is built from %s, DICTIONARY_SOURCE reads %s — ignored",
+                     snap["version"], snap.get("source", "local"), source_kind())
+        snap = None
+    if snap is not None:
+        return Dictionaries(snap["maps"], snap["version"])
+    raw = load_sources()
+    return Dictionaries(build_from_sources(raw), source_version(raw))
 
-    # fallback → локальный JSON (dev)
-    path = DATA_DIR / name
+_current = _load_initial()
+_stamps: dict | None = None        # отметки источников (mtime / update_time) на момент последней проверки
+_reload_lock = threading.Lock()
+
+def current() -> Dictionaries:
+    return _current
+
+def reload_dictionaries(force: bool = False) -> bool:
+    """
+    Проверяет источники и, если содержимое поменялось, публикует новую версию.
+    Блокирующая — вызывать через asyncio.to_thread. True — если словари подменены.
+    """
+    global _current, _stamps
+    with _reload_lock:
+        stamps = source_stamps()
+        if stamps == _stamps and not force:
+            return False
+        raw = load_sources()
+        version = source_version(raw)
+        if version == _current.version:
+            _stamps = stamps
+            return False
+        maps = build_from_sources(raw)
+        if not maps["alias_to_ccy"] or not maps["country_name_to_iso3"]:
+            # источник отдал пустоту (битый файл, недоступен Firestore) — оставляем прежнюю версию
+            logging.warning("dictionaries %s are empty, keeping %s", version, _current.version)
+            return False
+        new = Dictionaries(maps, version)
+        _current = new
+        _stamps = stamps
+    logging.info("dictionaries reloaded: %s", version)
+    return True
+
+async def refresh_dictionaries(context=None) -> None:
+    """Job для PTB JobQueue: перестраиваем словари в потоке, event loop не блокируем."""
     try:
-        with path.open("r", encoding="utf-8") as f:
-            return json.load(f)
+        await asyncio.to_thread(reload_dictionaries)
     except Exception as e:
-        print(f"❌ Ошибка чтения локального {name}: {e}")
-        return {}
-
-# Нормализация
-def _norm_ccy(s: str) -> str:
-    # валюты: вверхний регистр, выкидываем всё кроме латинских букв/цифр/символов валют
-    s = unicodedata.normalize("NFKC", (s or "")).strip().upper().replace("Ё", "Е")
-    return re.sub(r"[^A-ZА-Я0-9$₽¥₼€£]", "", s)
-
-def _norm_country(s: str) -> str:
-    # страны: вверхний регистр, схлопываем пробелы (знаки не трогаем — у тебя в json есть скобки)
-    s = unicodedata.normalize("NFKC", (s or "")).strip().upper().replace("Ё", "Е")
-    return re.sub(r"\s+", " ", s)
-
-# Загружаем данные
-_aliases_raw              = _load_json("aliases.json")                 # {"USD": ["USD","$","ДОЛЛАР",...]} — ТОЛЬКО валюты
-_ccy_to_iso3_raw          = _load_json("currency_to_iso3.json")        # {"USD":"USA", "KZT":"KAZ", ...} (ISO3 справа; null допускается)
-_country_name_to_iso3_raw = _load_json("country_name_to_iso3.json")    # {"UNITED STATES":"USA", "БЕЛЬГИЯ":"BEL", "БЕЛГ":"BEL", ...}
-
-# Строим: алиас валюты → код валюты
-ALIAS_TO_CCY = {}
-for code, aliases in (_aliases_raw or {}).items():
-    if not isinstance(aliases, list):
-        continue
-    code_key = _norm_ccy(str(code))
-    if not code_key:
-        continue
-    ALIAS_TO_CCY[code_key] = code_key  # сам код тоже алиас
-    for a in aliases:
-        if isinstance(a, str):
-            k = _norm_ccy(a)
-            if k:
-                ALIAS_TO_CCY[k] = code_key
-
-# Строим: ISO3 → базовая валюта страны (только если однозначно задана)
-ISO3_TO_CCY = {}
-for ccy, iso3 in (_ccy_to_iso3_raw or {}).items():
-    if isinstance(ccy, str) and isinstance(iso3, str):
-        c = ccy.strip().upper()
-        i = iso3.strip().upper()
-        if len(c) == 3 and len(i) == 3:
-            ISO3_TO_CCY[i] = c
-
-# Строим: название страны/алиас → ISO3
-COUNTRY_NAME_TO_ISO3 = {}
-for k, v in (_country_name_to_iso3_raw or {}).items():
-    if isinstance(k, str) and isinstance(v, str):
-        COUNTRY_NAME_TO_ISO3[_norm_country(k)] = v.strip().upper()
+        logging.warning("dictionary reload failed: %s", e)
+
+def __getattr__(name: str):
+    # совместимость: cake_dictionary.ALIAS_TO_CCY и т.п. — всегда текущая версия
+    attr = {
+        "ALIAS_TO_CCY": "alias_to_ccy",
+        "ISO3_TO_CCY": "iso3_to_ccy",
+        "COUNTRY_NAME_TO_ISO3": "country_name_to_iso3",
+        "COUNTRY_INDEX": "index",
+        "DICTIONARY_VERSION": "version",
+    }.get(name)
+    if attr is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(_current, attr)
+
 
 def resolve_user_input(raw: str):
     """
@@ -86,33 +229,85 @@ def resolve_user_input(raw: str):
     Правила:
     - если введена валюта/её алиас → (CCY, None)
     - если введена страна/её алиас (в т.ч. 4 буквы по-русски из json) → (валюта страны если известна, ISO3)
+    - если точного совпадения нет — однозначный префикс названия или опечатка (current().index)
     - если распознаны оба (редко) → приоритет у явной валюты ввода
     """
+    d = _current   # одна версия словарей на весь вызов
     text_ccy = _norm_ccy(raw)
-    text_cty = _norm_country(raw)
+    text_cty = norm_country(raw)
 
     # 1) валюта по алиасам
     ccy = None
     if re.fullmatch(r"[A-Z]{3}", text_ccy):
         ccy = text_ccy
     else:
-        ccy = ALIAS_TO_CCY.get(text_ccy)
+        ccy = d.alias_to_ccy.get(text_ccy)
 
-    # 2) страна по названиям/алиасам
-    iso3 = COUNTRY_NAME_TO_ISO3.get(text_cty)
+    # 2) страна по названиям/алиасам; если точного совпадения нет — префикс или опечатка
+    iso3 = d.country_name_to_iso3.get(text_cty)
+    if not iso3 and not ccy:
+        iso3 = d.index.lookup(text_cty)
 
     # 3) если есть ISO3 и валюта не распознана напрямую — попробуем подтянуть по ISO3
     if iso3 and not ccy:
-        ccy = ISO3_TO_CCY.get(iso3)
+        ccy = d.iso3_to_ccy.get(iso3)
 
     return ccy, iso3
 
 # опционально — простые геттеры, если где-то в коде пригодятся
 def iso3_from_country_name(name: str):
-    return COUNTRY_NAME_TO_ISO3.get(_norm_country(name))
+    d = _current
+    key = norm_country(name)
+    return d.country_name_to_iso3.get(key) or d.index.lookup(key)
 
 def to_ccy_code(user_input: str):
     key = _norm_ccy(user_input)
     if re.fullmatch(r"[A-Z]{3}", key):
         return key
-    return ALIAS_TO_CCY.get(key)
\ No newline at end of file
+    return _current.alias_to_ccy.get(key)
+
+def currency_to_iso3(user_input: str):
+    """Страна, для которой валюта — базовая (USD → USA). Для EUR и прочих общих валют — None."""
+    ccy = to_ccy_code(user_input)
+    return _current.ccy_to_iso3.get(ccy) if ccy else None
+
+def resolve_country_iso3_from_user_input(raw: str):
+    """Только страна: по названию/префиксу/опечатке, иначе — по валюте («тенге» → KAZ)."""
+    ccy, iso3 = resolve_user_input(raw)
+    if iso3:
+        return iso3
+    return _current.ccy_to_iso3.get(ccy) if ccy else None
+
+# ───────────────────────────────
+# Подсказки для inline-режима: всё, что начинается с введённого (валюты и страны)
+
+MIN_SUGGEST_LEN = 2
+
+def suggest(raw: str, limit: int = 8) -> list[tuple[str | None, str | None]]:
+    """
+    Кандидаты (ccy_code | None, country_iso3 | None) для ввода на лету («амер» → USA, …):
+    точное распознавание, затем префиксы алиасов валют и названий стран, затем опечатка.
+    """
+    d = _current
+    out: list[tuple[str | None, str | None]] = []
+
+    def add(pair):
+        if (pair[0] or pair[1]) and pair not in out:
+            out.append(pair)
+
+    add(resolve_user_input(raw))
+    text_ccy = _norm_ccy(raw)
+    text_cty = norm_country(raw)
+    if len(text_cty) >= MIN_SUGGEST_LEN:
+        for iso3 in d.index.prefix(text_cty, limit):
+            add((d.iso3_to_ccy.get(iso3), iso3))
+    if len(text_ccy) >= MIN_SUGGEST_LEN:
+        i = bisect_left(d.ccy_aliases, text_ccy)
+        while i < len(d.ccy_aliases) and d.ccy_aliases[i].startswith(text_ccy) and len(out) < limit:
+            add((d.alias_to_ccy[d.ccy_aliases[i]], None))
+            i += 1
+    if not out and len(text_cty) >= MIN_FUZZY_LEN:
+        iso3 = d.index.fuzzy(text_cty)
+        if iso3:
+            add((d.iso3_to_ccy.get(iso3), iso3))
+    return out[:limit]
@@ -1,31 +1,208 @@
-import requests
+import asyncio
+import logging
+import httpx
+from dataclasses import dataclass, field
 from typing import Optional
-from datetime import datetime, timezone
-from config import CAKE_PRICE_KZT, UNECE_YEAR
+from datetime import datetime, timezone, timedelta
+from config import CAKE_PRICE_KZT, FX_TTL_HOURS
+import metrics
+import fx_providers
+from fx_providers import FXError
 
-_API = "https://open.er-api.com/v6/latest/KZT"
+_API = fx_providers.KNOWN_PROVIDERS["open_er_api"][1]   # URL основного провайдера (тесты, стенды)
+
+# HTTP-клиент: общий пул keep-alive соединений, явные таймауты, ограниченные ретраи
+_TIMEOUT = httpx.Timeout(5.0, connect=3.0, read=5.0)
+_LIMITS = httpx.Limits(max_connections=10, max_keepalive_connections=5, keepalive_expiry=60)
+_RETRIES = 2            # повторов всего списка провайдеров после первого круга
+_RETRY_BACKOFF = 0.5    # секунд, удваивается на каждый повтор
+
+# провайдеры по FX_PROVIDERS, у каждого свой circuit breaker (см. fx_providers)
+_providers: list[fx_providers.Provider] = fx_providers.configured()
 
-class FXError(Exception): ...
 class NoWageError(Exception): ...
 
 
-def _get_usd_kzt_rate() -> float:
-    """Берём курс USD/KZT из внешнего API."""
-    r = requests.get(_API, timeout=10)
-    if r.status_code != 200:
-        raise FXError(f"FX API error: {r.status_code}")
-    data = r.json()
-    # API: base=KZT, rates.USD -> сколько USD за 1 KZT
-    usd_per_kzt = data["rates"]["USD"]
-    # Нам нужен KZT за 1 USD, поэтому берём обратное
-    kzt_per_usd = 1 / usd_per_kzt
-    return kzt_per_usd
+# ───────────────────────────────
+# FX SNAPSHOT: вся таблица курсов одним объектом
+
+@dataclass(frozen=True)
+class FXSnapshot:
+    """
+    Снимок всей таблицы курсов провайдера (base=KZT: сколько CCY за 1 KZT).
+    Один снимок обслуживает любые валюты и USD для блока зарплаты.
+    """
+    base: str
+    rates: dict[str, float]
+    provider_ts: datetime | None
+    fetched_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+    ttl: timedelta = timedelta(hours=FX_TTL_HOURS)
+    provider: str | None = None   # кто из FX_PROVIDERS отдал таблицу (hedge/fallback — не обязательно первый)
+
+    @property
+    def expires_at(self) -> datetime:
+        return self.fetched_at + self.ttl
+
+    @property
+    def version(self) -> int:
+        # версия снимка = время обновления у провайдера (unix)
+        return int((self.provider_ts or self.fetched_at).timestamp())
+
+    def is_fresh(self, now: datetime | None = None) -> bool:
+        return (now or datetime.now(timezone.utc)) < self.expires_at
+
+    def rate(self, ccy: str) -> float | None:
+        rate = self.rates.get((ccy or "").strip().upper())
+        return float(rate) if rate is not None else None
+
+    def convert(self, ccy: str, amount_kzt: float | None = None) -> float | None:
+        """Цена amount_kzt (по умолчанию — торта) в валюте CCY."""
+        rate = self.rate(ccy)
+        if rate is None:
+            return None
+        base = CAKE_PRICE_KZT if amount_kzt is None else float(amount_kzt)
+        return float(base) * rate
+
+    def convert_many(self, ccys, amount_kzt: float | None = None) -> dict[str, float | None]:
+        """Цена торта сразу во многих валютах за один проход по одному снимку (KZT — без курса)."""
+        base = float(CAKE_PRICE_KZT if amount_kzt is None else amount_kzt)
+        rates = self.rates
+        out: dict[str, float | None] = {}
+        for ccy in ccys:
+            code = (ccy or "").strip().upper()
+            rate = 1.0 if code == self.base else rates.get(code)
+            out[code] = base * float(rate) if rate is not None else None
+        return out
+
+    def kzt_per_usd(self) -> float:
+        usd_per_kzt = self.rate("USD")
+        if not usd_per_kzt:
+            raise FXError("USD rate missing in snapshot")
+        return 1 / usd_per_kzt
+
+    def to_doc(self) -> dict:
+        """Документ для хранилища: вся таблица + явные fetched_at/expires_at."""
+        return {
+            "base": self.base,
+            "version": self.version,
+            "rates": dict(self.rates),
+            "provider_ts": self.provider_ts,
+            "fetched_at": self.fetched_at,
+            "expires_at": self.expires_at,
+            "provider": self.provider,
+        }
+
+    @classmethod
+    def from_doc(cls, doc: dict) -> "FXSnapshot":
+        fetched_at = _as_utc(doc["fetched_at"])
+        expires_at = _as_utc(doc.get("expires_at")) or fetched_at + timedelta(hours=FX_TTL_HOURS)
+        return cls(
+            base=str(doc.get("base") or "KZT").upper(),
+            rates={str(k).upper(): float(v) for k, v in (doc.get("rates") or {}).items()},
+            provider_ts=_as_utc(doc.get("provider_ts")),
+            fetched_at=fetched_at,
+            ttl=expires_at - fetched_at,
+            provider=doc.get("provider"),
+        )
+
+
+def _as_utc(ts) -> datetime | None:
+    """datetime (в т.ч. Firestore DatetimeWithNanoseconds) или ISO-строка → aware UTC."""
+    if ts is None:
+        return None
+    if not isinstance(ts, datetime):
+        ts = datetime.fromisoformat(str(ts).replace("Z", "+00:00"))
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.astimezone(timezone.utc)
+
+
+def _parse_snapshot(data: dict, kind: str = "open_er_api") -> FXSnapshot:
+    base, rates, provider_ts = fx_providers.PARSERS[kind](data)
+    return FXSnapshot(base=base, rates=rates, provider_ts=provider_ts)
+
 
+_client: httpx.AsyncClient | None = None
 
-def compute_cake_salary(salary_usd: float, *, kzt_per_usd: float) -> dict:
+def _get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(timeout=_TIMEOUT, limits=_LIMITS)
+    return _client
+
+async def close_fx_client() -> None:
+    """Закрываем пул соединений (на остановке приложения)."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def _fetch_snapshot() -> FXSnapshot:
+    """
+    Вся таблица от первого ответившего провайдера (hedged, с circuit breaker).
+    Если упали все — повторяем круг с паузой, но не больше _RETRIES раз.
+    """
+    with metrics.span("fx_fetch"):
+        last_exc: Exception | None = None
+        for attempt in range(_RETRIES + 1):
+            if attempt:
+                await asyncio.sleep(_RETRY_BACKOFF * 2 ** (attempt - 1))
+            try:
+                provider, (base, rates, provider_ts) = await fx_providers.fetch_hedged(_get_client(), _providers)
+            except FXError as e:
+                last_exc = e
+                logging.warning("FX fetch round %d failed: %s", attempt + 1, e)
+                if all(p.breaker.state == "open" for p in _providers):
+                    break   # все выключены — ждать тут нечего, отдадим устаревший снимок
+                continue
+            return FXSnapshot(base=base, rates=rates, provider_ts=provider_ts, provider=provider.name)
+        raise last_exc or FXError("FX API unavailable")
+
+
+_snapshot: FXSnapshot | None = None
+_refresh_lock = asyncio.Lock()
+
+async def get_fx_snapshot(force: bool = False) -> FXSnapshot:
+    """
+    Возвращает in-process снимок, обновляя его не чаще раза в TTL.
+    Сколько бы валют ни спросили — на обновление уходит один upstream-вызов:
+    параллельные запросы ждут один и тот же рефреш под локом.
+    """
+    global _snapshot
+    snap = _snapshot
+    if not force and snap is not None and snap.is_fresh():
+        return snap
+    async with _refresh_lock:
+        snap = _snapshot
+        if force or snap is None or not snap.is_fresh():
+            snap = await _fetch_snapshot()
+            _snapshot = snap
+    return snap
+
+
+def peek_fx_snapshot() -> FXSnapshot | None:
+    """Текущий in-process снимок без похода в сеть (может быть устаревшим)."""
+    return _snapshot
+
+def set_fx_snapshot(snap: FXSnapshot) -> None:
+    """Принимаем снимок извне (из хранилища), если он не старее текущего."""
+    global _snapshot
+    if _snapshot is None or snap.fetched_at >= _snapshot.fetched_at:
+        _snapshot = snap
+
+
+async def _get_usd_kzt_rate() -> float:
+    """Курс KZT за 1 USD из текущего снимка."""
+    # API: base=KZT, rates.USD -> сколько USD за 1 KZT, поэтому берём обратное
+    return (await get_fx_snapshot()).kzt_per_usd()
+
+
+def compute_cake_salary(salary_usd: float, *, kzt_per_usd: float, provider: str | None = None) -> dict:
     """
     Чистая функция: считает зарплату в KZT и «в тортах»,
     если на входе дана зарплата (в USD) и курс (KZT за 1 USD).
+    provider — откуда курс (FXSnapshot.provider), если известно.
     """
     if salary_usd is None:
         raise NoWageError("No UNECE wage provided")
@@ -41,35 +218,35 @@ def compute_cake_salary(salary_usd: float, *, kzt_per_usd: float) -> dict:
         "fx": {
             "pair": "USD/KZT",
             "rate": float(kzt_per_usd),
-            "api": _API,  # справочно
+            "provider": provider,  # справочно
         },
     }
 
-def convert_kzt(title: str, amount_kzt: float | None = None) -> Optional[float]:
+async def convert_kzt(title: str, amount_kzt: float | None = None) -> Optional[float]:
     """Возвращает материализованную цену 1 торта в валюте CCY.
-    Если amount_kzt не передан — используем CAKE_PRICE_KZT из конфига."""
-
-    ccy = (title or "").strip().upper()
+    Если amount_kzt не передан — используем CAKE_PRICE_KZT из конфига.
+    Курс берётся из общего снимка (см. get_fx_snapshot)."""
 
     try:
-        data = requests.get(_API, timeout=5).json()
-        rate = data.get("rates", {}).get(ccy)
-        if rate is None:
-            return None
-        base = CAKE_PRICE_KZT if amount_kzt is None else float(amount_kzt)
-        return float(base) * float(rate)
+        return (await get_fx_snapshot()).convert(title, amount_kzt)
     except Exception:
         return None
 
 #тест
+async def _repl():
+    try:
+        while True:
+            b = input("Узнать цену казахского торта. Введите название валюты (или exit для выхода): ").upper()
+            if b == "EXIT":
+                break
+            # пример без прокси
+            value = await convert_kzt(b)
+            if value is not None:
+                print(f"600000 KZT = {value:,.2f} {b}")
+            else:
+                print("Валюта не найдена.")
+    finally:
+        await close_fx_client()
+
 if __name__ == "__main__":
-    while True:
-        b = input("Узнать цену казахского торта. Введите название валюты (или exit для выхода): ").upper()
-        if b == "EXIT":
-            break
-        # пример без прокси
-        value = convert_kzt(600_000, b)
-        if value is not None:
-            print(f"600000 KZT = {value:,.2f} {b}")
-        else:
-            print("Валюта не найдена.")
\ No newline at end of file
+    asyncio.run(_repl())
@@ -6,10 +6,87 @@ from typing import Final
 # Базовая цена торта
 CAKE_PRICE_KZT: Final[float] = 600_000
 
-# Источник UNECE
-UNECE_YEAR = 2024
+# Источник UNECE. В памяти держим все годы (wage_index); UNECE_YEAR закрепляет год
+# основного ответа, по умолчанию у каждой страны берём самый свежий
+UNECE_YEAR = int(os.getenv("UNECE_YEAR") or 0) or None
 UNECE_UNIT = "USD"
 
+# Сколько живёт снимок курсов (часы)
+FX_TTL_HOURS = 24
+# Как часто прогреваем популярные валюты (часы) — заметно чаще, чем истекает TTL
+FX_PREFETCH_HOURS = 6
+# FX-провайдеры по порядку (см. fx_providers.KNOWN_PROVIDERS или «name=format:url»),
+# через сколько секунд дублировать запрос следующему и когда выключать сбоящий
+FX_PROVIDERS = os.getenv("FX_PROVIDERS", "open_er_api,currency_api,currency_api_mirror")
+FX_HEDGE_AFTER_SECONDS = float(os.getenv("FX_HEDGE_AFTER_SECONDS", "1.0"))
+FX_BREAKER_FAILURES = int(os.getenv("FX_BREAKER_FAILURES", "3"))
+FX_BREAKER_RESET_SECONDS = float(os.getenv("FX_BREAKER_RESET_SECONDS", "30"))
+# Аренда в хранилище: в FX API за всех реплик ходит одна. Срок аренды (с запасом на ретраи),
+# сколько ждать чужой снимок, если своего нет совсем, и как долго не переспрашивать занятую аренду
+FX_LEASE_SECONDS = float(os.getenv("FX_LEASE_SECONDS", "30"))
+FX_LEASE_WAIT_SECONDS = float(os.getenv("FX_LEASE_WAIT_SECONDS", "5"))
+FX_LEASE_RETRY_SECONDS = float(os.getenv("FX_LEASE_RETRY_SECONDS", "10"))
+
+# Как часто перечитываем индекс зарплат (часы)
+WAGE_INDEX_REFRESH_HOURS = 6
+# Как часто сбрасываем накопленные salary_kzt/cake_salary в хранилище (секунды)
+WAGE_FLUSH_SECONDS = 60
+# Как часто проверяем, не поменялись ли словари (json / документы Firestore), секунды
+DICTIONARY_RELOAD_SECONDS = int(os.getenv("DICTIONARY_RELOAD_SECONDS", "300"))
+
+# Кеш готовых ответов (записей) и пререндер всех пар страна/валюта на новый снимок
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "4096"))
+RESPONSE_PRERENDER = os.getenv("RESPONSE_PRERENDER", "1") not in {"0", "false", "no"}
+# /compare: сколько валют максимум в одном ответе
+MAX_COMPARE_ITEMS = int(os.getenv("MAX_COMPARE_ITEMS", "25"))
+# Inline-режим: сколько подсказок, кеш ответов у нас (записи, секунды) и у Telegram (cache_time, секунды)
+INLINE_MAX_RESULTS = int(os.getenv("INLINE_MAX_RESULTS", "10"))
+INLINE_CACHE_SIZE = int(os.getenv("INLINE_CACHE_SIZE", "2048"))
+INLINE_CACHE_TTL_SECONDS = int(os.getenv("INLINE_CACHE_TTL_SECONDS", "600"))
+INLINE_TELEGRAM_CACHE_SECONDS = int(os.getenv("INLINE_TELEGRAM_CACHE_SECONDS", "300"))
+
+# Параллельная обработка апдейтов: сколько выполняется одновременно и сколько всего
+# может быть в работе+ожидании, прежде чем новые апдейты начнут ждать (backpressure)
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "16"))
+MAX_PENDING_UPDATES = int(os.getenv("MAX_PENDING_UPDATES", "256"))
+
+# Флуд-контроль в on_text (token bucket): запросов в секунду и запас на чат и на пользователя;
+# одинаковый запрос из чата в пределах окна сливаем с предыдущим; предупреждение — не чаще раза в N секунд
+FLOOD_CHAT_RATE = float(os.getenv("FLOOD_CHAT_RATE", "1.0"))
+FLOOD_CHAT_BURST = float(os.getenv("FLOOD_CHAT_BURST", "10"))
+FLOOD_USER_RATE = float(os.getenv("FLOOD_USER_RATE", "0.5"))
+FLOOD_USER_BURST = float(os.getenv("FLOOD_USER_BURST", "5"))
+FLOOD_DUPLICATE_SECONDS = float(os.getenv("FLOOD_DUPLICATE_SECONDS", "5"))
+FLOOD_WARN_SECONDS = float(os.getenv("FLOOD_WARN_SECONDS", "30"))
+FLOOD_MAX_KEYS = int(os.getenv("FLOOD_MAX_KEYS", "50000"))
+
+# Логи: уровень, формат (json — для Cloud Logging, text — локально), доля апдейтов,
+# у которых пишем DEBUG, и размер очереди до потока-писателя (сверх — строки выбрасываем)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").strip().upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").strip().lower()
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.01"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# Вебхук (asgi_app): URL сервиса (пусто — polling), порт от Cloud Run, путь, секрет для
+# X-Telegram-Bot-Api-Secret-Token (по умолчанию выводится из токена — одинаков во всех процессах),
+# очередь принятых апдейтов и сколько ждать её при остановке
+PUBLIC_URL = os.getenv("PUBLIC_URL", "").rstrip("/")
+PORT = int(os.getenv("PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "tgwebhook").strip("/")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1024"))
+WEBHOOK_DRAIN_SECONDS = float(os.getenv("WEBHOOK_DRAIN_SECONDS", "8"))
+
+# Хранилище: firestore (Cloud Run) | sqlite (self-hosted, см. docker-compose.yml)
+DB_BACKEND = os.getenv("DB_BACKEND", "firestore").strip().lower()
+DB_PATH = os.getenv("DB_PATH", str(Path(__file__).resolve().parent / "exchange_rates.db"))
+
+# In-process кеш перед хранилищем (секунды)
+CACHE_MAXSIZE = int(os.getenv("CACHE_MAXSIZE", "1024"))
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", "3600"))             # зарплаты
+CACHE_RATE_TTL_SECONDS = int(os.getenv("CACHE_RATE_TTL_SECONDS", "300"))    # курсы/снимки: другие реплики могли обновить
+CACHE_NEGATIVE_TTL_SECONDS = int(os.getenv("CACHE_NEGATIVE_TTL_SECONDS", "300"))
+
 # Убираем @ в начале username
 def _normalize_username(s: str | None) -> str:
     s = (s or "").strip()
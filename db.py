@@ -1,19 +1,129 @@
-# db.py — только Firestore
+# db.py — выбор хранилища по DB_BACKEND: firestore (по умолчанию) | sqlite
+# + первый уровень кеша: in-process LRU с TTL (курсы и зарплаты меняются максимум раз в день)
 
-from db_firestore import (
-    is_rate_cached,
-    cache_rate,
-    get_cached_rate,
-    get_wage_doc,
-    upsert_wage_doc,
-    _wages_col,
-)
+import metrics
+from cache import LRUCache, MISSING
+from config import (DB_BACKEND, CACHE_MAXSIZE, CACHE_TTL_SECONDS, CACHE_RATE_TTL_SECONDS,
+                    CACHE_NEGATIVE_TTL_SECONDS)
+
+if DB_BACKEND == "sqlite":
+    import db_sqlite as _backend
+else:
+    import db_firestore as _backend
+    from db_firestore import _wages_col
+
+_rates_cache = LRUCache("rates", CACHE_MAXSIZE, CACHE_RATE_TTL_SECONDS)
+_wages_cache = LRUCache("wages", CACHE_MAXSIZE, CACHE_TTL_SECONDS)
+metrics.register_cache(_rates_cache)
+metrics.register_cache(_wages_cache)
+
+def _call(op: str, *args, **kwargs):
+    """Вызов бэкенда со счётчиками: cake_backend_calls_total / cake_upstream_errors_total{upstream="store"}."""
+    metrics.BACKEND_CALLS.inc(backend=DB_BACKEND, op=op)
+    try:
+        return getattr(_backend, op)(*args, **kwargs)
+    except Exception:
+        metrics.UPSTREAM_ERRORS.inc(upstream="store")
+        raise
+
+def _read_through(cache: LRUCache, key, loader):
+    value = cache.get(key)
+    if value is not MISSING:
+        return value
+    value = loader()
+    # негативный кеш: «нет такого» помним недолго
+    cache.set(key, value, ttl=CACHE_NEGATIVE_TTL_SECONDS if value is None else None)
+    return value
+
+def cache_stats() -> list[dict]:
+    """Счётчики hit/miss/eviction по каждому кешу."""
+    return [_rates_cache.stats(), _wages_cache.stats()]
+
+def clear_caches() -> None:
+    _rates_cache.clear()
+    _wages_cache.clear()
+
+# ───────────────────────────────
+# EXCHANGE RATES
+
+def is_rate_cached(title: str) -> bool:
+    return get_cached_rate(title) is not None
+
+def get_cached_rate(title: str):
+    t = title.strip().upper()
+    return _read_through(_rates_cache, ("rate", t), lambda: _call("get_cached_rate", t))
+
+def cache_rate(title: str, rate: float):
+    _call("cache_rate", title, rate)
+    _rates_cache.invalidate(("rate", title.strip().upper()))
+
+def get_latest_snapshot(base: str = "KZT", fresh: bool = False) -> dict | None:
+    """fresh=True — мимо кеша: другая реплика могла только что записать новый снимок."""
+    b = base.strip().upper()
+    if fresh:
+        _rates_cache.invalidate(("snapshot", b))
+    return _read_through(_rates_cache, ("snapshot", b), lambda: _call("get_latest_snapshot", b))
+
+def cache_snapshot(doc: dict) -> None:
+    _call("cache_snapshot", doc)
+    _rates_cache.invalidate(("snapshot", str(doc.get("base") or "KZT").upper()))
+
+# ───────────────────────────────
+# LEASES (кто из реплик обновляет общие данные) — всегда мимо кеша
+
+def acquire_lease(name: str, owner: str, ttl_seconds: float) -> bool:
+    return _call("acquire_lease", name, owner, ttl_seconds)
+
+def release_lease(name: str, owner: str) -> None:
+    _call("release_lease", name, owner)
+
+# ───────────────────────────────
+# WAGES
+
+def get_wage_doc(iso3: str) -> dict | None:
+    i = (iso3 or "").strip().upper()
+    return _read_through(_wages_cache, i, lambda: _call("get_wage_doc", i))
+
+def list_wage_docs() -> list[dict]:
+    # полная выгрузка для wage_index — мимо кеша
+    return _call("list_wage_docs")
+
+def upsert_wage_doc(iso3: str, patch: dict, *args, **kwargs) -> None:
+    _call("upsert_wage_doc", iso3, patch, *args, **kwargs)
+    _wages_cache.invalidate((iso3 or "").strip().upper())
+
+def upsert_wage_docs(updates: dict[str, dict], *args, **kwargs) -> None:
+    _call("upsert_wage_docs", updates, *args, **kwargs)
+    for iso3 in updates:
+        _wages_cache.invalidate((iso3 or "").strip().upper())
+
+def put_wage_docs(docs) -> int:
+    """Массовая загрузка (wages_ingest.py): полные документы под ISO3_YYYY_UNIT."""
+    n = _call("put_wage_docs", docs)
+    _wages_cache.clear()
+    return n
+
+def migrate_legacy_wage_ids() -> int:
+    n = _call("migrate_legacy_wage_ids")
+    _wages_cache.clear()
+    return n
 
 __all__ = [
     "is_rate_cached",
     "cache_rate",
     "get_cached_rate",
+    "cache_snapshot",
+    "get_latest_snapshot",
+    "acquire_lease",
+    "release_lease",
     "get_wage_doc",
+    "list_wage_docs",
     "upsert_wage_doc",
-    "_wages_col",
-]
\ No newline at end of file
+    "upsert_wage_docs",
+    "put_wage_docs",
+    "migrate_legacy_wage_ids",
+    "cache_stats",
+    "clear_caches",
+]
+if DB_BACKEND != "sqlite":
+    __all__.append("_wages_col")
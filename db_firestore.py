@@ -1,24 +1,31 @@
 # db_firestore.py
+import logging
 import os
 from datetime import datetime, timezone, timedelta
-from google.cloud import firestore
-from config import UNECE_YEAR, UNECE_UNIT
-from cake_dictionary import COUNTRY_NAME_TO_ISO3  # NAME -> ISO3
+from config import UNECE_UNIT, UNECE_YEAR, FX_TTL_HOURS
+import cake_dictionary
 
 USE_EMULATOR = bool(os.getenv("FIRESTORE_EMULATOR_HOST"))  # эмулятор используется только если переменная выставлена
 
 _db = None
+_fs = None
 
 
-print(f"[Firestore] project={os.getenv('GOOGLE_CLOUD_PROJECT')} emulator={os.getenv('FIRESTORE_EMULATOR_HOST') or '-'}", flush=True)
+def _firestore():
+    """google.cloud.firestore импортируем при первом обращении — это ~сотни мс холодного старта."""
+    global _fs
+    if _fs is None:
+        from google.cloud import firestore
+        _fs = firestore
+    return _fs
 
 def _get_db():
     global _db
     if _db is None:
         # Если нужно, можно явно пробросить project:
-        _db = firestore.Client(project=os.getenv("GOOGLE_CLOUD_PROJECT"))
-        print(f"[Firestore] project={os.getenv('GOOGLE_CLOUD_PROJECT')} "
-              f"emulator={os.getenv('FIRESTORE_EMULATOR_HOST') or '-'}", flush=True)
+        _db = _firestore().Client(project=os.getenv("GOOGLE_CLOUD_PROJECT"))
+        logging.info("Firestore client: project=%s emulator=%s",
+                     os.getenv("GOOGLE_CLOUD_PROJECT"), os.getenv("FIRESTORE_EMULATOR_HOST") or "-")
     return _db
 
 def _col():
@@ -27,78 +34,217 @@ def _col():
 def _wages_col():
     return _get_db().collection("avg_wages_unece")
 
-# ── добавляем обратную мапу ISO3 -> NAME (берём первый попавшийся нейм)
-# если в COUNTRY_NAME_TO_ISO3 несколько неймов на один ISO3, выберем любой стабильный
-ISO3_TO_COUNTRY_NAME: dict[str, str] = {}
-for name, iso in COUNTRY_NAME_TO_ISO3.items():
-    ISO3_TO_COUNTRY_NAME.setdefault(iso, name)
+def _snapshots_col(base: str):
+    # fx_snapshots/{BASE}/versions/{version} — одна версия = вся таблица курсов
+    return _get_db().collection("fx_snapshots").document(base.strip().upper()).collection("versions")
 
 def _doc_id(key: str, year: int, unit: str) -> str:
     return f"{key.strip().upper()}_{year}_{unit.strip().upper()}"
 
-def _doc_id_candidates_from_iso3(iso3: str, year: int, unit: str) -> list[str]:
-    iso3 = (iso3 or "").strip().upper()
-    ids = { _doc_id(iso3, year, unit) }
-    # попробовать старый стиль: NAME_YYYY_UNIT
-    name = ISO3_TO_COUNTRY_NAME.get(iso3)
-    if name:
-        ids.add(_doc_id(name, year, unit))
-    return list(ids)
+def _parse_doc_id(doc_id: str) -> tuple[str, int, str] | None:
+    """KEY_YYYY_UNIT → (KEY, год, UNIT); KEY может быть и ISO3, и старым NAME с пробелами."""
+    parts = doc_id.rsplit("_", 2)
+    if len(parts) != 3 or not parts[1].isdigit():
+        return None
+    return parts[0], int(parts[1]), parts[2]
 
 # ───────────────────────────────
 # WAGES
 
+def _wage_year(doc: dict) -> int:
+    try:
+        return int(doc.get("year") or (doc.get("source") or {}).get("year") or 0)
+    except (TypeError, ValueError):
+        return 0
+
 def get_wage_doc(iso3: str) -> dict | None:
-    print(f"[DEBUG] get_wage_doc iso3={repr(iso3)}")
+    """Документ с зарплатой за UNECE_YEAR (если задан), иначе за самый свежий год — как wage_index."""
+    logging.debug("firestore get_wage_doc", extra={"iso3": iso3})
 
-    db = firestore.Client()
-    col = db.collection("avg_wages_unece")
+    # все годы страны — единицы документов; без limit(1): под ISO3 может лежать
+    # и документ только с производными полями от write-behind
+    best = None
+    for doc in _wages_col().where("iso3", "==", iso3).stream():
+        data = doc.to_dict()
+        if data.get("salary_usd", data.get("value")) is None:
+            continue
+        year = _wage_year(data)
+        if UNECE_YEAR and year == UNECE_YEAR:
+            return data
+        if best is None or year > _wage_year(best):
+            best = data
 
-    docs = col.where("iso3", "==", iso3).limit(1).stream()
-    for doc in docs:
-        return doc.to_dict()
+    return best
 
-    return None
+def list_wage_docs() -> list[dict]:
+    """Вся коллекция avg_wages_unece (несколько десятков стран) одним запросом."""
+    return [doc.to_dict() for doc in _wages_col().stream()]
 
-def upsert_wage_doc(iso3: str, patch: dict, year: int = UNECE_YEAR, unit: str = UNECE_UNIT) -> None:
-    """
-    Обновляем существующий документ, если он уже есть под ISO3_ID или NAME_ID.
-    Если не нашли — создаём под СТАРЫМ стилем (NAME_YYYY_UNIT), чтобы не ломать твою базу.
-    """
+def _wage_patch(iso3: str, patch: dict, year: int, unit: str) -> tuple[str, dict]:
+    """Канонический ID ISO3_YYYY_UNIT и патч с ключевыми полями — без чтений."""
     iso3 = (iso3 or "").strip().upper()
-    candidates = _doc_id_candidates_from_iso3(iso3, year, unit)
-
-    # 1) если есть существующий — обновим его
-    for doc_id in candidates:
-        ref = _wages_col().document(doc_id)
-        if ref.get().exists:
-            if "updated_at" not in patch:
-                patch = {**patch, "updated_at": firestore.SERVER_TIMESTAMP}
-            # проставим iso3 внутри документа
-            patch = {"iso3": iso3, **patch}
-            ref.set(patch, merge=True)
-            return
-
-    # 2) иначе создаём НОВЫЙ документ в старом стиле (NAME_YYYY_UNIT)
-    name = ISO3_TO_COUNTRY_NAME.get(iso3, iso3)  # если имени нет, упадём на ISO3
-    doc_id = _doc_id(name, year, unit)
     if "updated_at" not in patch:
-        patch = {**patch, "updated_at": firestore.SERVER_TIMESTAMP}
-    patch = {"iso3": iso3, **patch}
+        patch = {**patch, "updated_at": _firestore().SERVER_TIMESTAMP}
+    return _doc_id(iso3, year, unit), {"iso3": iso3, "year": year, "unit": unit.strip().upper(), **patch}
+
+def upsert_wage_doc(iso3: str, patch: dict, year: int, unit: str = UNECE_UNIT) -> None:
+    """set(merge=True) под ISO3_YYYY_UNIT. Старые NAME_YYYY_UNIT переносит migrate_legacy_wage_ids."""
+    doc_id, patch = _wage_patch(iso3, patch, year, unit)
     _wages_col().document(doc_id).set(patch, merge=True)
 
+_BATCH_LIMIT = 500  # лимит операций в одном Firestore batch
+
+def _commit_in_batches(ops) -> int:
+    """ops — итератор (op, ref, data); коммитим пачками по _BATCH_LIMIT. Возвращает число операций."""
+    db = _get_db()
+    batch, n, total = db.batch(), 0, 0
+    for op, ref, data in ops:
+        if op == "delete":
+            batch.delete(ref)
+        else:
+            batch.set(ref, data, merge=True)
+        n += 1
+        if n == _BATCH_LIMIT:
+            batch.commit()
+            total += n
+            batch, n = db.batch(), 0
+    if n:
+        batch.commit()
+        total += n
+    return total
+
+def upsert_wage_docs(updates: dict[str, dict], year: int, unit: str = UNECE_UNIT) -> None:
+    """Пакетный upsert_wage_doc для write-behind: только batch-записи, без get_all."""
+    def ops():
+        for iso3, patch in updates.items():
+            doc_id, data = _wage_patch(iso3, patch, year, unit)
+            yield "set", _wages_col().document(doc_id), data
+    _commit_in_batches(ops())
+
+def put_wage_docs(docs) -> int:
+    """Полные документы (с iso3/year/unit) для массовой загрузки, см. wages_ingest.py."""
+    def ops():
+        for doc in docs:
+            doc_id, data = _wage_patch(doc["iso3"], doc, int(doc["year"]), doc["unit"])
+            yield "set", _wages_col().document(doc_id), data
+    return _commit_in_batches(ops())
+
+def migrate_legacy_wage_ids() -> int:
+    """
+    Одноразовый перенос NAME_YYYY_UNIT → ISO3_YYYY_UNIT. Поля канонического документа
+    (если он уже появился от write-behind) свежее и побеждают; старый документ удаляем.
+    Возвращает число перенесённых документов.
+    """
+    col = _wages_col()
+    docs = {snap.id: snap.to_dict() for snap in col.stream()}
+    name_to_iso3 = cake_dictionary.current().country_name_to_iso3
+    moves = []
+    for doc_id, data in docs.items():
+        parsed = _parse_doc_id(doc_id)
+        if parsed is None:
+            logging.warning("wage doc %s: unexpected id, skipped", doc_id)
+            continue
+        key, year, unit = parsed
+        iso3 = str(data.get("iso3") or name_to_iso3.get(key) or "").strip().upper()
+        if len(iso3) != 3:
+            logging.warning("wage doc %s: unknown country, skipped", doc_id)
+            continue
+        target = _doc_id(iso3, year, unit)
+        if target != doc_id:
+            merged = {**data, **docs.get(target, {}), "iso3": iso3, "year": year, "unit": unit}
+            moves.append((doc_id, target, merged))
+
+    def ops():
+        # _BATCH_LIMIT чётный — set и delete одного переноса всегда попадают в один batch
+        for doc_id, target, merged in moves:
+            yield "set", col.document(target), merged
+            yield "delete", col.document(doc_id), None
+    _commit_in_batches(ops())
+    return len(moves)
+
+# ───────────────────────────────
+# FX SNAPSHOTS: вся таблица курсов одним версионированным документом
+#
+# Старые версии чистит Firestore TTL по полю purge_at:
+#   gcloud firestore fields ttls update purge_at --collection-group=versions --enable-ttl
+# purge_at отстоит от expires_at на SNAPSHOT_RETENTION, чтобы последний снимок
+# можно было отдать как устаревший, пока идёт обновление.
+
+SNAPSHOT_RETENTION = timedelta(days=7)
+
+def cache_snapshot(doc: dict) -> None:
+    """doc — FXSnapshot.to_doc(): base, version, rates, provider_ts, fetched_at, expires_at."""
+    base = str(doc.get("base") or "KZT").upper()
+    _snapshots_col(base).document(str(doc["version"])).set({
+        **doc,
+        "base": base,
+        "purge_at": doc["expires_at"] + SNAPSHOT_RETENTION,
+        "updated_at": _firestore().SERVER_TIMESTAMP,
+    })
+
+def get_latest_snapshot(base: str = "KZT") -> dict | None:
+    """Последний снимок таблицы — ровно одно чтение документа."""
+    docs = (
+        _snapshots_col(base)
+        .order_by("fetched_at", direction=_firestore().Query.DESCENDING)
+        .limit(1)
+        .stream()
+    )
+    for doc in docs:
+        return doc.to_dict()
+    return None
+
+# ───────────────────────────────
+# LEASES: коллекция leases/{name} = {owner, expires_at}; берём в транзакции,
+# поэтому из всех реплик, пришедших одновременно, аренду получает ровно одна
+
+def _leases_col():
+    return _get_db().collection("leases")
+
+def _lease_is_free(data: dict | None, owner: str, now: datetime) -> bool:
+    if not data:
+        return True
+    expires_at = data.get("expires_at")
+    return data.get("owner") == owner or expires_at is None or expires_at <= now
+
+def acquire_lease(name: str, owner: str, ttl_seconds: float) -> bool:
+    ref = _leases_col().document(name)
+
+    @_firestore().transactional
+    def _acquire(tx) -> bool:
+        now = datetime.now(timezone.utc)
+        snap = ref.get(transaction=tx)
+        if not _lease_is_free(snap.to_dict() if snap.exists else None, owner, now):
+            return False
+        tx.set(ref, {"owner": owner, "expires_at": now + timedelta(seconds=ttl_seconds), "acquired_at": now})
+        return True
+
+    return _acquire(_get_db().transaction())
+
+def release_lease(name: str, owner: str) -> None:
+    ref = _leases_col().document(name)
+
+    @_firestore().transactional
+    def _release(tx) -> None:
+        snap = ref.get(transaction=tx)
+        if snap.exists and (snap.to_dict() or {}).get("owner") == owner:
+            tx.delete(ref)
+
+    _release(_get_db().transaction())
+
 # ───────────────────────────────
-# EXCHANGE RATES (без изменений)
+# EXCHANGE RATES (поштучные KZT->CCY, legacy)
 
 def is_rate_cached(title: str) -> bool:
     return _col().document(title.strip().upper()).get().exists
 
 def cache_rate(title: str, rate: float):
-    expires_at = datetime.now(timezone.utc) + timedelta(hours=24)
+    fetched_at = datetime.now(timezone.utc)
     _col().document(title.strip().upper()).set({
         "rate": float(rate),
-        "ts": expires_at,
-        "updated_at": firestore.SERVER_TIMESTAMP
+        "fetched_at": fetched_at,
+        "expires_at": fetched_at + timedelta(hours=FX_TTL_HOURS),
+        "updated_at": _firestore().SERVER_TIMESTAMP
     })
 
 def _ts_to_str(ts) -> str:
@@ -109,16 +255,19 @@ def _ts_to_str(ts) -> str:
             return ts.astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
         return str(ts)
     except Exception:
-        import logging
         logging.exception("Bad timestamp value: %r", ts)
         return "1970-01-01 00:00:00"
 
 def get_cached_rate(title: str):
+    """(title, rate, время получения). Старые документы хранили в ts время ИСТЕЧЕНИЯ (now+24h)."""
     t = title.strip().upper()
     doc = _col().document(t).get()
     if not doc.exists:
         return None
     data = doc.to_dict() or {}
     rate = float(data["rate"])
-    ts_str = _ts_to_str(data.get("ts"))
-    return t, rate, ts_str
\ No newline at end of file
+    fetched_at = data.get("fetched_at")
+    if fetched_at is None and isinstance(data.get("ts"), datetime):
+        fetched_at = data["ts"] - timedelta(hours=24)
+    ts_str = _ts_to_str(fetched_at)
+    return t, rate, ts_str
@@ -0,0 +1,295 @@
+# db_sqlite.py — self-hosted хранилище (DB_BACKEND=sqlite), тот же интерфейс, что у db_firestore
+import json
+import logging
+import sqlite3
+import threading
+from datetime import datetime, timezone, timedelta
+from config import UNECE_UNIT, UNECE_YEAR, DB_PATH
+
+# Одно долгоживущее соединение на процесс. Хендлеры ходят сюда и из event loop,
+# и из asyncio.to_thread, поэтому check_same_thread=False + свой лок.
+_conn: sqlite3.Connection | None = None
+_lock = threading.RLock()
+
+SNAPSHOT_RETENTION = timedelta(days=7)  # как purge_at в Firestore
+
+_TS_FMT = "%Y-%m-%d %H:%M:%S"
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+def _get_conn() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        with _lock:
+            if _conn is None:
+                conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None,
+                                       cached_statements=64)  # кеш подготовленных выражений
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.execute("PRAGMA busy_timeout=5000")
+                migrate(conn)
+                _conn = conn
+                logging.info("SQLite: path=%s", DB_PATH)
+    return _conn
+
+def _fetchone(sql: str, params: tuple):
+    with _lock:
+        return _get_conn().execute(sql, params).fetchone()
+
+def close() -> None:
+    global _conn
+    with _lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
+
+# ───────────────────────────────
+# МИГРАЦИИ (PRAGMA user_version)
+
+def _migration_1(conn: sqlite3.Connection) -> None:
+    # таблица курсов — в том виде, в каком она уже лежит в exchange_rates.db
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS exchange_rates (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL UNIQUE,
+            rate  FLOAT NOT NULL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )""")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_exchange_rates_title ON exchange_rates(title)")
+
+    # legacy-мусор: перепутанные столбцы (title='1110.6', rate='USD') и нечисловые курсы
+    conn.execute("""
+        DELETE FROM exchange_rates
+        WHERE typeof(rate) NOT IN ('real', 'integer')
+           OR NOT (title GLOB '[A-Z][A-Z][A-Z]' OR title GLOB 'KZT->[A-Z][A-Z][A-Z]')""")
+    # старые ключи 'USD' → 'KZT->USD', если новой записи ещё нет
+    conn.execute("""
+        DELETE FROM exchange_rates
+        WHERE title GLOB '[A-Z][A-Z][A-Z]'
+          AND ('KZT->' || title) IN (SELECT title FROM exchange_rates)""")
+    conn.execute("UPDATE exchange_rates SET title = 'KZT->' || title WHERE title GLOB '[A-Z][A-Z][A-Z]'")
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS fx_snapshots (
+            base TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            rates TEXT NOT NULL,
+            provider_ts TEXT,
+            fetched_at TEXT NOT NULL,
+            expires_at TEXT NOT NULL,
+            purge_at TEXT NOT NULL,
+            PRIMARY KEY (base, version)
+        )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_fx_snapshots_fetched ON fx_snapshots(base, fetched_at)")
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS avg_wages_unece (
+            doc_id TEXT PRIMARY KEY,
+            iso3 TEXT NOT NULL,
+            year INTEGER,
+            unit TEXT,
+            data TEXT NOT NULL
+        )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_avg_wages_iso3 ON avg_wages_unece(iso3)")
+
+def _migration_2(conn: sqlite3.Connection) -> None:
+    # аренды между процессами (uvicorn workers на одном файле): кто обновляет общие данные
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL      -- unix, UTC
+        )""")
+
+def _migration_3(conn: sqlite3.Connection) -> None:
+    # какой FX-провайдер отдал снимок (hedge/fallback)
+    conn.execute("ALTER TABLE fx_snapshots ADD COLUMN provider TEXT")
+
+_MIGRATIONS = [_migration_1, _migration_2, _migration_3]
+
+def migrate(conn: sqlite3.Connection | None = None) -> int:
+    """Накатывает недостающие миграции, возвращает итоговую версию схемы."""
+    conn = conn or _get_conn()
+    with _lock:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for n, step in enumerate(_MIGRATIONS[version:], start=version + 1):
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                step(conn)
+                conn.execute(f"PRAGMA user_version={n}")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            logging.info("SQLite migrated to schema v%d", n)
+            version = n
+    return version
+
+# ───────────────────────────────
+# WAGES
+
+def _doc_id(key: str, year: int, unit: str) -> str:
+    return f"{key.strip().upper()}_{year}_{unit.strip().upper()}"
+
+def get_wage_doc(iso3: str) -> dict | None:
+    row = _fetchone(
+        # документы только с производными полями от write-behind (без зарплаты) пропускаем
+        """SELECT data FROM avg_wages_unece
+           WHERE iso3 = ? AND COALESCE(json_extract(data, '$.salary_usd'), json_extract(data, '$.value')) IS NOT NULL
+           ORDER BY year = ? DESC, year DESC LIMIT 1""",   # UNECE_YEAR, иначе самый свежий — как wage_index
+        ((iso3 or "").strip().upper(), UNECE_YEAR or 0),
+    )
+    return json.loads(row[0]) if row else None
+
+def list_wage_docs() -> list[dict]:
+    with _lock:
+        rows = _get_conn().execute("SELECT data FROM avg_wages_unece").fetchall()
+    return [json.loads(r[0]) for r in rows]
+
+def upsert_wage_doc(iso3: str, patch: dict, year: int, unit: str = UNECE_UNIT) -> None:
+    """Merge-запись как set(merge=True) в Firestore, ключ — ISO3_YYYY_UNIT."""
+    iso3 = (iso3 or "").strip().upper()
+    if "updated_at" not in patch:
+        patch = {**patch, "updated_at": _now().isoformat()}
+    patch = {"iso3": iso3, "year": year, "unit": unit.strip().upper(), **patch}
+    with _lock:
+        _get_conn().execute(
+            """INSERT INTO avg_wages_unece (doc_id, iso3, year, unit, data) VALUES (?, ?, ?, ?, ?)
+               ON CONFLICT(doc_id) DO UPDATE SET data = json_patch(data, excluded.data)""",
+            (_doc_id(iso3, year, unit), iso3, year, unit.strip().upper(), json.dumps(patch, default=str)),
+        )
+
+def _in_transaction(fn):
+    with _lock:
+        conn = _get_conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    return result
+
+def upsert_wage_docs(updates: dict[str, dict], year: int, unit: str = UNECE_UNIT) -> None:
+    """Пакетный upsert одной транзакцией (для write-behind)."""
+    if not updates:
+        return
+
+    def write(conn):
+        for iso3, patch in updates.items():
+            upsert_wage_doc(iso3, patch, year, unit)
+    _in_transaction(write)
+
+def put_wage_docs(docs) -> int:
+    """Полные документы (с iso3/year/unit) одной транзакцией, см. wages_ingest.py."""
+    docs = list(docs)
+
+    def write(conn):
+        for doc in docs:
+            upsert_wage_doc(doc["iso3"], doc, int(doc["year"]), doc["unit"])
+        return len(docs)
+    return _in_transaction(write) if docs else 0
+
+def migrate_legacy_wage_ids() -> int:
+    """Строки не под ISO3_YYYY_UNIT (импорт из старой выгрузки) → канонический ID; поля канонической побеждают."""
+    def move(conn):
+        rows = conn.execute(
+            "SELECT doc_id, iso3, year, unit, data FROM avg_wages_unece "
+            "WHERE doc_id <> iso3 || '_' || year || '_' || unit").fetchall()
+        for doc_id, iso3, year, unit, data in rows:
+            conn.execute(
+                """INSERT INTO avg_wages_unece (doc_id, iso3, year, unit, data) VALUES (?, ?, ?, ?, ?)
+                   ON CONFLICT(doc_id) DO UPDATE SET data = json_patch(excluded.data, data)""",
+                (_doc_id(iso3, year, unit), iso3, year, unit, data))
+            conn.execute("DELETE FROM avg_wages_unece WHERE doc_id = ?", (doc_id,))
+        return len(rows)
+    return _in_transaction(move)
+
+# ───────────────────────────────
+# FX SNAPSHOTS
+
+def _iso(ts) -> str | None:
+    return ts.astimezone(timezone.utc).isoformat() if isinstance(ts, datetime) else ts
+
+def cache_snapshot(doc: dict) -> None:
+    base = str(doc.get("base") or "KZT").upper()
+    now = _now()
+    with _lock:
+        conn = _get_conn()
+        conn.execute(
+            """INSERT OR REPLACE INTO fx_snapshots
+               (base, version, rates, provider_ts, fetched_at, expires_at, purge_at, provider)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+            (base, int(doc["version"]), json.dumps(doc["rates"]), _iso(doc.get("provider_ts")),
+             _iso(doc["fetched_at"]), _iso(doc["expires_at"]), _iso(doc["expires_at"] + SNAPSHOT_RETENTION),
+             doc.get("provider")),
+        )
+        # аналог Firestore TTL
+        conn.execute("DELETE FROM fx_snapshots WHERE purge_at < ?", (now.isoformat(),))
+
+def get_latest_snapshot(base: str = "KZT") -> dict | None:
+    row = _fetchone(
+        """SELECT base, version, rates, provider_ts, fetched_at, expires_at, provider
+           FROM fx_snapshots WHERE base = ? ORDER BY fetched_at DESC LIMIT 1""",
+        (base.strip().upper(),),
+    )
+    if not row:
+        return None
+    base, version, rates, provider_ts, fetched_at, expires_at, provider = row
+    return {
+        "base": base,
+        "version": version,
+        "rates": json.loads(rates),
+        "provider_ts": provider_ts,
+        "fetched_at": fetched_at,
+        "expires_at": expires_at,
+        "provider": provider,
+    }
+
+# ───────────────────────────────
+# LEASES: один держатель на имя; истёкшую аренду может забрать любой
+
+def acquire_lease(name: str, owner: str, ttl_seconds: float) -> bool:
+    """Взять или продлить аренду. Одно UPSERT-выражение — атомарно и между процессами."""
+    now = _now().timestamp()
+    with _lock:
+        cur = _get_conn().execute(
+            """INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?)
+               ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+               WHERE leases.expires_at <= ? OR leases.owner = excluded.owner""",
+            (name, owner, now + ttl_seconds, now),
+        )
+    return cur.rowcount == 1
+
+def release_lease(name: str, owner: str) -> None:
+    with _lock:
+        _get_conn().execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+# ───────────────────────────────
+# EXCHANGE RATES (поштучные KZT->CCY, legacy)
+
+def is_rate_cached(title: str) -> bool:
+    return _fetchone("SELECT 1 FROM exchange_rates WHERE title = ?", (title.strip().upper(),)) is not None
+
+def cache_rate(title: str, rate: float):
+    with _lock:
+        _get_conn().execute(
+            """INSERT INTO exchange_rates (title, rate, timestamp) VALUES (?, ?, ?)
+               ON CONFLICT(title) DO UPDATE SET rate = excluded.rate, timestamp = excluded.timestamp""",
+            (title.strip().upper(), float(rate), _now().strftime(_TS_FMT)),
+        )
+
+def get_cached_rate(title: str):
+    """(title, rate, время получения в UTC) | None; timestamp — время записи, не истечения."""
+    t = title.strip().upper()
+    row = _fetchone("SELECT rate, timestamp FROM exchange_rates WHERE title = ?", (t,))
+    if not row:
+        return None
+    return t, float(row[0]), str(row[1])
+
+
+if __name__ == "__main__":
+    # ручной прогон миграций: DB_PATH=... python db_sqlite.py
+    print(f"schema v{migrate()} at {DB_PATH}")
@@ -0,0 +1,222 @@
+# dictionary_data.py — источники словарей (Firestore / локальные JSON) и бинарный снимок
+#
+# Снимок собирается на этапе сборки образа (см. Dockerfile):
+#     python dictionary_data.py --source local
+# и при старте читается одним pickle.load — без импорта google.cloud.firestore
+# и без сетевых запросов. Модуль без побочных эффектов при импорте.
+import argparse
+import hashlib
+import json
+import logging
+import os
+import pickle
+import re
+import sys
+import unicodedata
+from datetime import datetime, timezone
+from pathlib import Path
+from config import DB_BACKEND
+
+# Где лежат json-файлы
+DATA_DIR = Path(os.getenv("DICTIONARY_DATA_DIR") or Path(__file__).resolve().parent / "cake_data")
+SOURCES = ("aliases.json", "currency_to_iso3.json", "country_name_to_iso3.json")
+
+SNAPSHOT_PATH = Path(os.getenv("DICTIONARY_SNAPSHOT") or Path(__file__).resolve().parent / "cake_data" / "dictionary.snapshot")
+SNAPSHOT_MAGIC = b"CAKEDICT"
+# Откуда брать словари без снимка: auto | firestore | local (тесты, бенчмарки, офлайн)
+DEFAULT_SOURCE = os.getenv("DICTIONARY_SOURCE", "auto").strip().lower()
+SNAPSHOT_FORMAT = 1   # меняем при любом изменении структуры build_maps
+
+# Нормализация
+def _norm_ccy(s: str) -> str:
+    # валюты: вверхний регистр, выкидываем всё кроме латинских букв/цифр/символов валют
+    s = unicodedata.normalize("NFKC", (s or "")).strip().upper().replace("Ё", "Е")
+    return re.sub(r"[^A-ZА-Я0-9$₽¥₼€£]", "", s)
+
+def norm_country(s: str) -> str:
+    """Ключ COUNTRY_NAME_TO_ISO3 — им же нормализуют названия снаружи (wages_ingest)."""
+    # страны: вверхний регистр, схлопываем пробелы (знаки не трогаем — у тебя в json есть скобки)
+    s = unicodedata.normalize("NFKC", (s or "")).strip().upper().replace("Ё", "Е")
+    return re.sub(r"\s+", " ", s)
+
+# ───────────────────────────────
+# ИСТОЧНИКИ
+
+_fs_client = None
+
+def _firestore_docs(names, field_paths=None):
+    """
+    prod: collection=name_without_json, document=name_without_json.
+    Все документы одним get_all; firestore импортируем только здесь.
+    """
+    global _fs_client
+    if _fs_client is None:
+        from google.cloud import firestore
+        _fs_client = firestore.Client()
+    db = _fs_client
+    refs = [db.collection(n.replace(".json", "")).document(n.replace(".json", "")) for n in names]
+    return [doc for doc in db.get_all(refs, field_paths=field_paths) if doc.exists]
+
+def _load_from_firestore(names) -> dict[str, dict]:
+    return {f"{doc.id}.json": doc.to_dict() for doc in _firestore_docs(names)}
+
+def _load_local(name: str) -> dict:
+    """dev: локальный JSON-файл cake_data/name."""
+    path = DATA_DIR / name
+    try:
+        with path.open("r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        logging.error("cannot read local dictionary %s: %s", name, e)
+        return {}
+
+def _uses_firestore(source: str) -> bool:
+    return source in {"auto", "firestore"} and not (source == "auto" and DB_BACKEND == "sqlite")
+
+def source_kind(source: str | None = None) -> str:
+    """Откуда на деле читаются словари при таком source: firestore | local."""
+    return "firestore" if _uses_firestore(source or DEFAULT_SOURCE) else "local"
+
+def load_sources(source: str | None = None) -> dict[str, dict]:
+    """
+    source: auto — Firestore, недостающее из локальных JSON (self-hosted: только JSON);
+            firestore | local — только указанный источник. По умолчанию DICTIONARY_SOURCE.
+    """
+    source = source or DEFAULT_SOURCE
+    raw: dict[str, dict] = {}
+    if _uses_firestore(source):
+        try:
+            raw = _load_from_firestore(SOURCES)
+        except Exception as e:
+            logging.warning("Firestore unavailable for dictionaries, falling back to local JSON: %s", e)
+    if source != "firestore":
+        for name in SOURCES:
+            if name not in raw:
+                raw[name] = _load_local(name)
+    return raw
+
+def source_stamps(source: str | None = None) -> dict[str, object]:
+    """
+    Дешёвая проверка «поменялось ли что-то»: update_time документов Firestore
+    (без полей) и (mtime, size) локальных файлов. Сами данные не читаем.
+    """
+    source = source or DEFAULT_SOURCE
+    stamps: dict[str, object] = {}
+    if _uses_firestore(source):
+        try:
+            for doc in _firestore_docs(SOURCES, field_paths=[]):
+                stamps[f"{doc.id}.json"] = doc.update_time
+        except Exception as e:
+            logging.warning("Firestore unavailable for dictionary stamps: %s", e)
+    if source != "firestore":
+        for name in SOURCES:
+            if name not in stamps:
+                try:
+                    st = (DATA_DIR / name).stat()
+                    stamps[name] = (st.st_mtime_ns, st.st_size)
+                except OSError:
+                    stamps[name] = None
+    return stamps
+
+def source_version(raw: dict[str, dict]) -> str:
+    """Версия содержимого: хеш нормализованного JSON всех источников."""
+    blob = json.dumps(raw, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")
+    return hashlib.sha256(blob).hexdigest()[:16]
+
+# ───────────────────────────────
+# ПОСТРОЕНИЕ КАРТ
+
+def build_maps(aliases_raw, ccy_to_iso3_raw, country_name_to_iso3_raw) -> dict[str, dict]:
+    """
+    aliases_raw:              {"USD": ["USD","$","ДОЛЛАР",...]} — ТОЛЬКО валюты
+    ccy_to_iso3_raw:          {"USD":"USA", "KZT":"KAZ", ...} (ISO3 справа; null допускается)
+    country_name_to_iso3_raw: {"UNITED STATES":"USA", "БЕЛЬГИЯ":"BEL", ...}
+    """
+    # Строим: алиас валюты → код валюты
+    alias_to_ccy = {}
+    for code, aliases in (aliases_raw or {}).items():
+        if not isinstance(aliases, list):
+            continue
+        code_key = _norm_ccy(str(code))
+        if not code_key:
+            continue
+        alias_to_ccy[code_key] = code_key  # сам код тоже алиас
+        for a in aliases:
+            if isinstance(a, str):
+                k = _norm_ccy(a)
+                if k:
+                    alias_to_ccy[k] = code_key
+
+    # Строим: ISO3 → базовая валюта страны (только если однозначно задана)
+    iso3_to_ccy = {}
+    for ccy, iso3 in (ccy_to_iso3_raw or {}).items():
+        if isinstance(ccy, str) and isinstance(iso3, str):
+            c = ccy.strip().upper()
+            i = iso3.strip().upper()
+            if len(c) == 3 and len(i) == 3:
+                iso3_to_ccy[i] = c
+
+    # Строим: название страны/алиас → ISO3
+    country_name_to_iso3 = {}
+    for k, v in (country_name_to_iso3_raw or {}).items():
+        if isinstance(k, str) and isinstance(v, str):
+            country_name_to_iso3[norm_country(k)] = v.strip().upper()
+
+    return {
+        "alias_to_ccy": alias_to_ccy,
+        "iso3_to_ccy": iso3_to_ccy,
+        "country_name_to_iso3": country_name_to_iso3,
+    }
+
+def build_from_sources(raw: dict[str, dict]) -> dict[str, dict]:
+    return build_maps(*(raw.get(name) for name in SOURCES))
+
+# ───────────────────────────────
+# БИНАРНЫЙ СНИМОК: MAGIC | FORMAT (1 байт) | pickle({"version", "built_at", "source", "maps"})
+
+def write_snapshot(maps: dict[str, dict], version: str, path: Path = SNAPSHOT_PATH, *,
+                   source: str = "local") -> None:
+    payload = {"version": version, "built_at": datetime.now(timezone.utc).isoformat(), "source": source,
+               "maps": maps}
+    tmp = path.with_suffix(".tmp")
+    with tmp.open("wb") as f:
+        f.write(SNAPSHOT_MAGIC + bytes([SNAPSHOT_FORMAT]))
+        pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+    tmp.replace(path)
+
+def read_snapshot(path: Path = SNAPSHOT_PATH) -> dict | None:
+    """{"version", "built_at", "source", "maps"} или None, если снимка нет или он другого формата."""
+    try:
+        with path.open("rb") as f:
+            header = f.read(len(SNAPSHOT_MAGIC) + 1)
+            if header[:-1] != SNAPSHOT_MAGIC or header[-1] != SNAPSHOT_FORMAT:
+                logging.warning("dictionary snapshot %s has another format, ignored", path.name)
+                return None
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.warning("dictionary snapshot %s is unreadable, ignored: %s", path.name, e)
+        return None
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Собрать бинарный снимок словарей cake_dictionary")
+    ap.add_argument("--source", choices=("auto", "firestore", "local"), default=DEFAULT_SOURCE)
+    ap.add_argument("--out", type=Path, default=SNAPSHOT_PATH)
+    args = ap.parse_args(argv)
+
+    raw = load_sources(args.source)
+    maps = build_from_sources(raw)
+    if not any(maps.values()):
+        # нет данных — не пишем пустой снимок, старт пойдёт по обычному пути
+        print("⚠️ Словари пусты — снимок не записан", file=sys.stderr)
+        return 0
+    version = source_version(raw)
+    write_snapshot(maps, version, args.out, source=source_kind(args.source))
+    print(f"dictionary snapshot {version}: " + ", ".join(f"{k}={len(v)}" for k, v in maps.items()) + f" → {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+# flood_control.py — token bucket на чат и на пользователя перед диспетчером
+#
+# Спам кнопкой клавиатуры или волна упоминаний в группе не должны превращаться
+# в такую же волну чтений Firestore и запросов к FX API:
+#   • тот же запрос (ccy, iso3) из того же чата в пределах FLOOD_DUPLICATE_SECONDS — молча
+#     сливаем с предыдущим (ответ уже отправлен или вот-вот уйдёт);
+#   • сверх скорости FLOOD_*_RATE (с запасом FLOOD_*_BURST) — отбрасываем; предупреждаем
+#     чат не чаще раза в FLOOD_WARN_SECONDS, чтобы сами предупреждения не стали флудом.
+import time
+from collections import OrderedDict
+from typing import Callable
+
+from config import (FLOOD_CHAT_RATE, FLOOD_CHAT_BURST, FLOOD_USER_RATE, FLOOD_USER_BURST,
+                    FLOOD_DUPLICATE_SECONDS, FLOOD_WARN_SECONDS, FLOOD_MAX_KEYS)
+
+OK = "ok"
+DUPLICATE = "duplicate"
+LIMITED = "limited"
+
+
+class TokenBucket:
+    """
+    Ведро на ключ: rate токенов в секунду, не больше burst. Ключей не больше max_keys —
+    самые давно не писавшие вытесняются (их ведро и так уже полное).
+    """
+
+    def __init__(self, rate: float, burst: float, clock: Callable[[], float] = time.monotonic,
+                 max_keys: int = FLOOD_MAX_KEYS):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.max_keys = max_keys
+        self._buckets: OrderedDict = OrderedDict()   # key -> [токены, время последнего пополнения]
+
+    def allow(self, key, cost: float = 1.0) -> bool:
+        now = self.clock()
+        b = self._buckets.get(key)
+        if b is None:
+            b = self._buckets[key] = [float(self.burst), now]
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            b[0] = min(self.burst, b[0] + (now - b[1]) * self.rate)
+            b[1] = now
+            self._buckets.move_to_end(key)
+        if b[0] < cost:
+            return False
+        b[0] -= cost
+        return True
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class FloodGuard:
+    """Решение по одному входящему запросу: OK, DUPLICATE (слить) или LIMITED (отбросить)."""
+
+    def __init__(self, chat_rate: float = FLOOD_CHAT_RATE, chat_burst: float = FLOOD_CHAT_BURST,
+                 user_rate: float = FLOOD_USER_RATE, user_burst: float = FLOOD_USER_BURST,
+                 duplicate_window: float = FLOOD_DUPLICATE_SECONDS, warn_every: float = FLOOD_WARN_SECONDS,
+                 clock: Callable[[], float] = time.monotonic, max_keys: int = FLOOD_MAX_KEYS):
+        self.chats = TokenBucket(chat_rate, chat_burst, clock, max_keys)
+        self.users = TokenBucket(user_rate, user_burst, clock, max_keys)
+        self.duplicate_window = duplicate_window
+        self.warn_every = warn_every
+        self.clock = clock
+        self.max_keys = max_keys
+        self._last: OrderedDict = OrderedDict()     # chat_id -> (запрос, время)
+        self._warned: OrderedDict = OrderedDict()   # chat_id -> время последнего предупреждения
+
+    def _remember(self, d: OrderedDict, key, value) -> None:
+        d[key] = value
+        d.move_to_end(key)
+        if len(d) > self.max_keys:
+            d.popitem(last=False)
+
+    def check(self, chat_id, user_id, request) -> str:
+        now = self.clock()
+        last = self._last.get(chat_id)
+        if last is not None and last[0] == request and now - last[1] < self.duplicate_window:
+            return DUPLICATE
+        if user_id is not None and not self.users.allow(user_id):
+            return LIMITED
+        if chat_id is not None and not self.chats.allow(chat_id):
+            return LIMITED
+        self._remember(self._last, chat_id, (request, now))
+        return OK
+
+    def should_warn(self, chat_id) -> bool:
+        """Предупреждать ли чат об ограничении: не чаще раза в warn_every."""
+        now = self.clock()
+        last = self._warned.get(chat_id)
+        if last is not None and now - last < self.warn_every:
+            return False
+        self._remember(self._warned, chat_id, now)
+        return True
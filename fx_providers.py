@@ -0,0 +1,200 @@
+# fx_providers.py — несколько FX-источников: circuit breaker на каждый и hedged-запросы
+#
+# Порядок опроса — FX_PROVIDERS (по умолчанию open_er_api, currency_api, currency_api_mirror).
+# Первый провайдер не ответил за FX_HEDGE_AFTER_SECONDS — параллельно спрашиваем
+# следующий, побеждает первый успешный ответ. Ошибка — сразу следующий, не дожидаясь
+# таймаута. Провайдер, упавший FX_BREAKER_FAILURES раз подряд, выключается на
+# FX_BREAKER_RESET_SECONDS (потом один пробный запрос — half-open).
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Callable
+
+import httpx
+
+import metrics
+from config import FX_PROVIDERS, FX_HEDGE_AFTER_SECONDS, FX_BREAKER_FAILURES, FX_BREAKER_RESET_SECONDS
+
+
+class FXError(Exception): ...
+
+
+# ───────────────────────────────
+# ФОРМАТЫ ОТВЕТОВ → (base, rates, provider_ts); rates: сколько CCY за 1 KZT
+
+def parse_open_er_api(data: dict) -> tuple[str, dict[str, float], datetime | None]:
+    """open.er-api.com/v6/latest/KZT"""
+    rates = data.get("rates")
+    if data.get("result", "success") != "success" or not isinstance(rates, dict) or not rates:
+        raise FXError(f"FX API bad payload: {data.get('error-type') or data.get('result')}")
+    provider_unix = data.get("time_last_update_unix")
+    provider_ts = datetime.fromtimestamp(provider_unix, timezone.utc) if provider_unix else None
+    return str(data.get("base_code") or "KZT").upper(), {str(k).upper(): float(v) for k, v in rates.items()}, provider_ts
+
+
+def parse_currency_api(data: dict) -> tuple[str, dict[str, float], datetime | None]:
+    """fawazahmed0/currency-api: {"date": "2025-01-01", "kzt": {"usd": 0.0019, ...}}"""
+    rates = data.get("kzt")
+    if not isinstance(rates, dict) or not rates:
+        raise FXError("FX API bad payload: no kzt table")
+    date = data.get("date")
+    provider_ts = datetime.fromisoformat(date).replace(tzinfo=timezone.utc) if date else None
+    # в таблице есть и крипта/металлы — оставляем только трёхбуквенные коды
+    return "KZT", {k.upper(): float(v) for k, v in rates.items() if len(k) == 3 and v}, provider_ts
+
+
+PARSERS: dict[str, Callable] = {
+    "open_er_api": parse_open_er_api,
+    "currency_api": parse_currency_api,
+}
+
+# name -> (формат, URL)
+KNOWN_PROVIDERS: dict[str, tuple[str, str]] = {
+    "open_er_api": ("open_er_api", "https://open.er-api.com/v6/latest/KZT"),
+    "currency_api": ("currency_api", "https://cdn.jsdelivr.net/npm/@fawazahmed0/currency-api@latest/v1/currencies/kzt.json"),
+    "currency_api_mirror": ("currency_api", "https://latest.currency-api.pages.dev/v1/currencies/kzt.json"),
+}
+
+
+# ───────────────────────────────
+# CIRCUIT BREAKER
+
+class CircuitBreaker:
+    """closed → (N ошибок подряд) → open → (reset_after) → half-open: один пробный запрос."""
+
+    def __init__(self, failures: int = FX_BREAKER_FAILURES, reset_after: float = FX_BREAKER_RESET_SECONDS,
+                 clock: Callable[[], float] = time.monotonic):
+        self.failures = failures
+        self.reset_after = reset_after
+        self.clock = clock
+        self._errors = 0
+        self._opened_at: float | None = None
+        self._trial = False   # half-open: пробный запрос уже в полёте
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        return "half_open" if self.clock() - self._opened_at >= self.reset_after else "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial:
+            self._trial = True
+            return True
+        return False
+
+    def release(self) -> None:
+        """Пробный запрос отменён (проиграл hedge) — это не ошибка, следующий может попробовать."""
+        self._trial = False
+
+    def success(self) -> None:
+        self._errors = 0
+        self._opened_at = None
+        self._trial = False
+
+    def failure(self) -> None:
+        self._errors += 1
+        self._trial = False
+        if self._opened_at is not None or self._errors >= self.failures:
+            self._opened_at = self.clock()   # из half-open — снова open на полный срок
+
+
+@dataclass
+class Provider:
+    name: str
+    url: str
+    kind: str = "open_er_api"
+    breaker: CircuitBreaker = field(default_factory=CircuitBreaker)
+
+    async def fetch(self, client: httpx.AsyncClient):
+        """Один запрос без ретраев. Любая ошибка — FXError (и минус в breaker)."""
+        metrics.BACKEND_CALLS.inc(backend="fx", op=self.name)
+        try:
+            r = await client.get(self.url)
+            if r.status_code != 200:
+                raise FXError(f"FX API {self.name} error: {r.status_code}")
+            result = PARSERS[self.kind](r.json())
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
+        except Exception as e:
+            self.breaker.failure()
+            metrics.UPSTREAM_ERRORS.inc(upstream=f"fx:{self.name}")
+            if isinstance(e, FXError):
+                raise
+            raise FXError(f"FX API {self.name} failed: {e!r}") from e
+        self.breaker.success()
+        return result
+
+
+def configured(names: str = FX_PROVIDERS) -> list[Provider]:
+    """Провайдеры из FX_PROVIDERS: «name» из KNOWN_PROVIDERS или «name=kind:url»."""
+    providers = []
+    for item in (x.strip() for x in names.split(",")):
+        if not item:
+            continue
+        if "=" in item:
+            name, spec = item.split("=", 1)
+            kind, url = spec.split(":", 1)
+        elif item in KNOWN_PROVIDERS:
+            name, (kind, url) = item, KNOWN_PROVIDERS[item]
+        else:
+            logging.warning("unknown FX provider %r — skipped", item)
+            continue
+        if kind not in PARSERS:
+            logging.warning("unknown FX provider format %r for %s — skipped", kind, name)
+            continue
+        providers.append(Provider(name.strip(), url.strip(), kind))
+    return providers
+
+
+# ───────────────────────────────
+# HEDGED FETCH
+
+async def fetch_hedged(client: httpx.AsyncClient, providers: list[Provider],
+                       hedge_after: float = FX_HEDGE_AFTER_SECONDS):
+    """
+    Первый успешный ответ среди доступных провайдеров: (provider, (base, rates, provider_ts)).
+    Следующий провайдер стартует, если текущие молчат дольше hedge_after или упали.
+    """
+    pending = list(providers)
+    running: dict[asyncio.Task, Provider] = {}
+    errors: list[str] = []
+
+    def launch() -> bool:
+        # breaker спрашиваем только в момент запуска: half-open пробу не тратим впустую
+        while pending:
+            p = pending.pop(0)
+            if p.breaker.allow():
+                running[asyncio.create_task(p.fetch(client))] = p
+                return True
+        return False
+
+    if not launch():
+        raise FXError("FX API unavailable: all providers are open-circuit")
+    try:
+        while running:
+            done, _ = await asyncio.wait(running, timeout=hedge_after if pending else None,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                slow = ", ".join(p.name for p in running.values())
+                if launch():
+                    metrics.FX_HEDGES.inc()
+                    logging.info("FX %s slower than %.2fs — hedging", slow, hedge_after)
+                continue
+            for task in done:
+                p = running.pop(task)
+                if task.exception() is None:
+                    return p, task.result()
+                errors.append(str(task.exception()))
+                logging.warning("%s", task.exception())
+                launch()   # упал — следующий сразу, не дожидаясь остальных
+    finally:
+        for task in running:
+            task.cancel()
+    raise FXError("FX API unavailable: " + "; ".join(errors))
@@ -0,0 +1,163 @@
+# logs.py — структурные логи (JSON для Cloud Run) через очередь + correlation ID на апдейт
+#
+# logging.* в хендлерах только кладёт запись в очередь (QueueHandler), в stdout пишет
+# отдельный поток (QueueListener) — медленный stdout не останавливает event loop.
+# Очередь ограничена: если она полна, строку выбрасываем и считаем в cake_log_dropped_total.
+#
+#   with logs.request_context(update):         # update_processor: один request_id на апдейт
+#       logging.debug("serve", extra={"ccy": "USD"})
+#
+# DEBUG-события семплируются по запросам (LOG_DEBUG_SAMPLE_RATE): у попавшего в выборку
+# апдейта видно все отладочные строки, у остальных — ни одной.
+import atexit
+import copy
+import json
+import logging
+import queue
+import random
+import sys
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+import metrics
+from config import LOG_LEVEL, LOG_FORMAT, LOG_DEBUG_SAMPLE_RATE, LOG_QUEUE_SIZE
+
+# поля текущего запроса: request_id, update_id, chat_id, user_id, sampled
+_context: ContextVar[dict] = ContextVar("log_context", default={})
+
+_STD_FIELDS = set(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {"message", "asctime"}
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s"
+
+_handler: "_NonBlockingQueueHandler | None" = None
+_listener: QueueListener | None = None
+
+
+# ───────────────────────────────
+# КОНТЕКСТ ЗАПРОСА
+
+@contextmanager
+def bind(**fields):
+    """Добавить поля ко всем записям внутри блока (и в задачах, созданных в нём)."""
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def request_context(update: object = None, sample_rate: float | None = None):
+    """Новый request_id и решение о семплировании DEBUG — один раз на апдейт."""
+    rate = LOG_DEBUG_SAMPLE_RATE if sample_rate is None else sample_rate
+    fields = {"request_id": uuid.uuid4().hex[:16], "sampled": random.random() < rate}
+    update_id = getattr(update, "update_id", None)
+    if update_id is not None:
+        fields["update_id"] = update_id
+    chat = getattr(update, "effective_chat", None)
+    if chat is not None:
+        fields["chat_id"] = chat.id
+    user = getattr(update, "effective_user", None)
+    if user is not None:
+        fields["user_id"] = user.id
+    return bind(**fields)
+
+
+def current_context() -> dict:
+    return _context.get()
+
+
+# ───────────────────────────────
+# ФОРМАТ
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись; severity/message/time — поля, которые понимает Cloud Logging."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        out = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "severity": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _STD_FIELDS and not key.startswith("_"):
+                out[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            out["exception"] = record.exc_text
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """
+    Всё, что зависит от вызывающего (contextvars, args, traceback), фиксируем здесь,
+    в потоке вызова; форматирование и запись — в потоке listener-а.
+    """
+
+    def __init__(self, q: queue.Queue, sample_rate: float):
+        super().__init__(q)
+        self.sample_rate = sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno <= logging.DEBUG:
+            sampled = _context.get().get("sampled")
+            if not (sampled if sampled is not None else random.random() < self.sample_rate):
+                return False
+        return super().filter(record)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        for key, value in _context.get().items():
+            if key != "sampled" and not hasattr(record, key):
+                setattr(record, key, value)
+        if not hasattr(record, "request_id"):
+            record.request_id = "-"
+        record.message = record.getMessage()
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg, record.args, record.exc_info = record.message, None, None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.LOG_DROPPED.inc()
+
+
+# ───────────────────────────────
+# УСТАНОВКА
+
+def setup(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT, *, stream=None,
+          sample_rate: float = LOG_DEBUG_SAMPLE_RATE, queue_size: int = LOG_QUEUE_SIZE) -> None:
+    """Корневой логгер → очередь → поток-писатель (stdout). Повторный вызов перенастраивает."""
+    global _handler, _listener
+    shutdown()
+
+    out = logging.StreamHandler(stream or sys.stdout)
+    out.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+    q: queue.Queue = queue.Queue(maxsize=queue_size)
+    _listener = QueueListener(q, out, respect_handler_level=False)
+    _handler = _NonBlockingQueueHandler(q, sample_rate)
+
+    root = logging.getLogger()
+    root.addHandler(_handler)
+    root.setLevel(level.upper())
+    _listener.start()
+
+
+def shutdown() -> None:
+    """Дописать очередь и снять обработчик (atexit; в тестах — между настройками)."""
+    global _handler, _listener
+    if _handler is not None:
+        logging.getLogger().removeHandler(_handler)
+        _handler = None
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(shutdown)
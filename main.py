@@ -1,23 +1,31 @@
 #импорты
 import logging
 from typing import Final
-from telegram import Update, KeyboardButton, ReplyKeyboardMarkup, ReplyKeyboardRemove
-from telegram.ext import (Application, CommandHandler, MessageHandler, filters, ContextTypes, ConversationHandler)
-import os
-from config import TOKEN, BOT_USERNAME, assert_required
-from rate_dispatcher import serve_cached_and_update
-from cake_dictionary import resolve_user_input
+from telegram import (Update, KeyboardButton, ReplyKeyboardMarkup, ReplyKeyboardRemove,
+                      InlineQueryResultArticle, InputTextMessageContent)
+from telegram.ext import (Application, CommandHandler, MessageHandler, InlineQueryHandler, filters, ContextTypes,
+                          ConversationHandler)
+from datetime import timedelta
+from config import (TOKEN, BOT_USERNAME, assert_required, FX_PREFETCH_HOURS, WAGE_INDEX_REFRESH_HOURS,
+                    WAGE_FLUSH_SECONDS, DICTIONARY_RELOAD_SECONDS, MAX_CONCURRENT_UPDATES, MAX_PENDING_UPDATES,
+                    INLINE_TELEGRAM_CACHE_SECONDS, PUBLIC_URL, WEBHOOK_PATH)
+from rate_dispatcher import (serve_cached_and_update, prefetch_popular_rates, serve_compare, split_compare_args,
+                             inline_answers, serve_history, serve_trend)
+from calculator import close_fx_client
+from wage_index import refresh_wage_index
+import wage_writer
+from update_processor import ChatOrderedUpdateProcessor
+from cake_dictionary import resolve_user_input, refresh_dictionaries
+import metrics
+import asgi_app
+import logs
+import flood_control
 import re
 
-PORT = int(os.getenv("PORT", "8080"))                  # Cloud Run даст $PORT
-PUBLIC_URL = os.getenv("PUBLIC_URL", "").rstrip("/")   # сюда вставим URL сервиса после деплоя
-WEBHOOK_PATH = "tgwebhook"                           # конечная точка вебхука
 
 
-# Включим ведение журнала
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO
-)
+# Включим ведение журнала: JSON в stdout через очередь (LOG_FORMAT=text — по-старому, строками)
+logs.setup()
 logger = logging.getLogger(__name__)
 logging.getLogger("httpx").setLevel(logging.WARNING)
 
@@ -56,12 +64,29 @@ async def start_command(update, context):
     )
 
 
+#флуд-контроль: повтор того же запроса сливаем, сверх лимита чата/пользователя — отбрасываем
+flood_guard = flood_control.FloodGuard()
+
+async def _flood_check(update: Update, msg, request) -> bool:
+    user = update.effective_user
+    verdict = flood_guard.check(msg.chat.id, user.id if user else None, request)
+    if verdict == flood_control.OK:
+        return True
+    metrics.FLOOD_DROPPED.inc(reason=verdict)
+    logger.debug("flood control: %s", verdict, extra={"request": request})
+    if verdict == flood_control.LIMITED and flood_guard.should_warn(msg.chat.id):
+        await msg.reply_text("Слишком много запросов — подождите немного и попробуйте снова.")
+    return False
+
 #обработчик текста общий
 async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = update.message
     if not msg:
         return
+    with metrics.span("on_text"):
+        await _handle_text(update, context, msg)
 
+async def _handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE, msg):
     text = (msg.text or "").strip()
 
     # в группах реагируем только на упоминание бота
@@ -76,10 +101,13 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     # ВСЕГДА: сначала резолвер → потом санитайзер → потом диспетчер
-    ccy_code, country_iso3 = resolve_user_input(text)
-    ccy_code, country_iso3 = _sanitize_pair(ccy_code, country_iso3)
+    with metrics.span("resolve"):
+        ccy_code, country_iso3 = resolve_user_input(text)
+        ccy_code, country_iso3 = _sanitize_pair(ccy_code, country_iso3)
 
     if ccy_code or country_iso3:
+        if not await _flood_check(update, msg, (ccy_code, country_iso3)):
+            return
         await serve_cached_and_update(update, ccy_code=ccy_code, country_iso3=country_iso3)
         return
 
@@ -88,6 +116,55 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "Или пришлите ISO-код (EUR, GBP, TRY) или название страны (США, Kazakhstan)."
     )
 
+# /compare USD EUR GBP ... или /compare all — все популярные валюты одним ответом
+COMPARE_ALL_ALIASES = {"ALL", "ВСЕ", "POPULAR", "ПОПУЛЯРНЫЕ"}
+
+async def compare_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not update.message:
+        return
+    tokens = split_compare_args(context.args)
+    if not tokens or (len(tokens) == 1 and _norm_cmd(tokens[0]) in COMPARE_ALL_ALIASES):
+        tokens = list(POPULAR_CURRENCIES)
+    with metrics.span("compare"):
+        await serve_compare(update, tokens)
+
+# /history USD 30d — мин/макс/среднее и изменение цены торта по локальной истории курсов
+async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not update.message:
+        return
+    await serve_history(update, context.args)
+
+# /trend Германия — сколько тортов в месяц зарабатывали в стране по годам
+async def trend_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not update.message:
+        return
+    await serve_trend(update, context.args)
+
+# inline: «@bot амер» в любом чате — подсказки только из памяти, upstream не ждём
+async def on_inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.inline_query
+    if not query:
+        return
+    with metrics.span("inline"):
+        answers = inline_answers(query.query, default_ccys=sorted(POPULAR_CURRENCIES))
+        results = [
+            InlineQueryResultArticle(
+                id=a["id"],
+                title=a["title"],
+                description=a["description"],
+                input_message_content=InputTextMessageContent(a["text"], **a["kwargs"]),
+            )
+            for a in answers
+        ]
+    try:
+        with metrics.span("answer_inline_query"):
+            # пока курсов нет в памяти — не даём Telegram закешировать пустой ответ
+            await query.answer(results, cache_time=INLINE_TELEGRAM_CACHE_SECONDS if results else 0, is_personal=False)
+    except Exception as e:
+        # запрос мог устареть, пока пользователь печатал дальше — это нормально
+        metrics.UPSTREAM_ERRORS.inc(upstream="telegram")
+        logger.warning("answer_inline_query failed: %s", e)
+
 # Обработка /cancel
 async def cancel(update, context):
     await update.message.reply_text(
@@ -99,7 +176,10 @@ async def cancel(update, context):
 async def help_command(update, context):
     await update.message.reply_text(
         "Вдохновителем бота стала история с <a href='https://tengrinews.kz/story/istoriya-pro-tort-600-tyisyach-tenge-516358/'>неоплаченным тортом за 600 тысяч</a>.\n\n"
-        "Нажмите /start для клавиатуры.",
+        "Нажмите /start для клавиатуры.\n"
+        "Несколько валют сразу: /compare USD EUR GBP (или /compare all — все популярные).\n"
+        "Как менялась цена: /history USD 30d.\n"
+        "Зарплата в тортах по годам: /trend Германия.",
         parse_mode="HTML",
         disable_web_page_preview=True
     )
@@ -112,35 +192,87 @@ async def custom_command(update, context):
 async def error(update: object, context: ContextTypes.DEFAULT_TYPE):
     logger.exception("Update %r caused error: %s", update, context.error)
 
-#запуск бота
-def main():
-    if not TOKEN:
-        print("⚠️ WARNING: TELEGRAM_TOKEN is not set. Бот не сможет работать без токена.", flush=True)
-        return
+#один раз грузим зарплаты в память до приёма апдейтов
+async def post_init(app: Application):
+    await refresh_wage_index()
 
-    print(f"Бот запускается... @{BOT_USERNAME}" if BOT_USERNAME else "Бот запускается...", flush=True)
+#дописываем отложенные записи зарплат и закрываем пул соединений FX-клиента при остановке
+async def post_shutdown(app: Application):
+    await wage_writer.drain()
+    await close_fx_client()
 
-    app = Application.builder().token(TOKEN).concurrent_updates(False).build()
+#сборка приложения: хендлеры и фоновые задачи (polling и каждый процесс asgi_app)
+def build_application(webhook: bool = bool(PUBLIC_URL)) -> Application:
+    # разные чаты — параллельно, внутри одного чата — по порядку
+    processor = ChatOrderedUpdateProcessor(MAX_CONCURRENT_UPDATES, MAX_PENDING_UPDATES)
+    builder = (
+        Application.builder()
+        .token(TOKEN)
+        .concurrent_updates(processor)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if webhook:
+        builder = builder.updater(None)   # вебхук принимает asgi_app, Updater не нужен
+    app = builder.build()
 
     # Хендлеры
     app.add_handler(CommandHandler("start", start_command))
     app.add_handler(CommandHandler("help", help_command))
     app.add_handler(CommandHandler("custom", custom_command))
     app.add_handler(CommandHandler("cancel", cancel))
+    app.add_handler(CommandHandler("compare", compare_command))
+    app.add_handler(CommandHandler("history", history_command))
+    app.add_handler(CommandHandler("trend", trend_command))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, on_text))
+    app.add_handler(InlineQueryHandler(on_inline_query))
 
-    if PUBLIC_URL:
-        print(f"🌐 Запуск вебхука на {PUBLIC_URL}/{WEBHOOK_PATH}", flush=True)
-        app.run_webhook(  # 🔁 не await!
-            listen="0.0.0.0",
-            port=PORT,
-            url_path=WEBHOOK_PATH,
-            webhook_url=f"{PUBLIC_URL}/{WEBHOOK_PATH}",
-            allowed_updates=Update.ALL_TYPES,
+    # Фоновый прогрев популярных валют, чтобы пользователи не ждали FX API
+    if app.job_queue:
+        app.job_queue.run_repeating(
+            prefetch_popular_rates,
+            interval=timedelta(hours=FX_PREFETCH_HOURS),
+            first=10,
+            data=POPULAR_CURRENCIES,
+            name="fx_prefetch",
+        )
+        app.job_queue.run_repeating(
+            refresh_wage_index,
+            interval=timedelta(hours=WAGE_INDEX_REFRESH_HOURS),
+            first=timedelta(hours=WAGE_INDEX_REFRESH_HOURS),
+            name="wage_index_refresh",
+        )
+        app.job_queue.run_repeating(
+            wage_writer.flush_job,
+            interval=WAGE_FLUSH_SECONDS,
+            first=WAGE_FLUSH_SECONDS,
+            name="wage_write_behind",
         )
+        app.job_queue.run_repeating(
+            refresh_dictionaries,
+            interval=DICTIONARY_RELOAD_SECONDS,
+            first=DICTIONARY_RELOAD_SECONDS,
+            name="dictionary_reload",
+        )
+    else:
+        print("⚠️ JobQueue недоступна (нужен python-telegram-bot[job-queue]) — прогрев курсов, обновление и запись зарплат, перезагрузка словарей отключены.", flush=True)
+
+    return app
+
+#запуск бота
+def main():
+    if not TOKEN:
+        print("⚠️ WARNING: TELEGRAM_TOKEN is not set. Бот не сможет работать без токена.", flush=True)
+        return
+
+    print(f"Бот запускается... @{BOT_USERNAME}" if BOT_USERNAME else "Бот запускается...", flush=True)
+
+    if PUBLIC_URL:
+        print(f"🌐 Запуск вебхука (ASGI) на {PUBLIC_URL}/{WEBHOOK_PATH}, метрики на /metrics", flush=True)
+        asgi_app.run()
     else:
         print("🌀 Запуск polling...", flush=True)
-        app.run_polling(allowed_updates=Update.ALL_TYPES)
+        build_application(webhook=False).run_polling(allowed_updates=Update.ALL_TYPES)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,184 @@
+# metrics.py — тайминги стадий и счётчики в текстовом формате Prometheus (0.0.4), без зависимостей
+#
+#   with metrics.span("resolve"):                     → cake_stage_duration_seconds{stage="resolve"}
+#   metrics.BACKEND_CALLS.inc(backend="fx", op="latest")
+#   metrics.UPSTREAM_ERRORS.inc(upstream="telegram")
+#   metrics.register_cache(lru)                        → hits/misses/evictions/size из LRUCache.stats()
+#   metrics.register_single_flight(sf)                 → calls/shared из cache.SingleFlight
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# от 0.5 мс (попадание в кеш) до 10 с (FX API с ретраями)
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _num(x: float) -> str:
+    if math.isinf(x):
+        return "+Inf" if x > 0 else "-Inf"
+    return repr(float(x)) if not float(x).is_integer() else str(int(x))
+
+
+class Counter:
+    """Монотонный счётчик с метками. Потокобезопасен (хранилище зовётся и из to_thread)."""
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(str(labels.get(n, "")) for n in self.labelnames), 0.0)
+
+    def collect(self) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_labels(self.labelnames, k)} {_num(v)}" for k, v in items]
+        return lines
+
+
+class Histogram:
+    """Гистограмма с фиксированными бакетами (кумулятивные счётчики считаем при выдаче)."""
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = STAGE_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: dict[tuple, list] = {}   # labels -> [счётчики по бакетам..., +Inf, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        i = next((i for i, b in enumerate(self.buckets) if value <= b), len(self.buckets))
+        with self._lock:
+            s = self._series.get(key)
+            if s is None:
+                s = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            s[i] += 1
+            s[-1] += value
+
+    def count(self, **labels) -> int:
+        s = self._series.get(tuple(str(labels.get(n, "")) for n in self.labelnames))
+        return sum(s[:-1]) if s else 0
+
+    @contextmanager
+    def time(self, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def collect(self) -> list[str]:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, s in items:
+            acc = 0
+            for bound, n in zip(self.buckets + (math.inf,), s[:-1]):
+                acc += n
+                le = 'le="' + _num(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {acc}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_num(s[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {acc}")
+        return lines
+
+
+# ───────────────────────────────
+# МЕТРИКИ БОТА
+
+STAGE_SECONDS = Histogram(
+    "cake_stage_duration_seconds",
+    "Время стадии обработки запроса (resolve, snapshot, fx_fetch, render, wage_lookup, wage_upsert, reply_text, ...)",
+    ("stage",),
+)
+BACKEND_CALLS = Counter("cake_backend_calls_total", "Обращения к хранилищу и FX API", ("backend", "op"))
+UPSTREAM_ERRORS = Counter("cake_upstream_errors_total", "Ошибки внешних зависимостей", ("upstream",))
+FX_HEDGES = Counter("cake_fx_hedged_requests_total", "Дублирующие запросы к следующему FX-провайдеру из-за медленного ответа")
+FX_LEASES = Counter("cake_fx_lease_total", "Попытки взять аренду на обновление курсов", ("result",))
+FLOOD_DROPPED = Counter("cake_flood_dropped_total", "Запросы, отброшенные флуд-контролем", ("reason",))
+LOG_DROPPED = Counter("cake_log_dropped_total", "Строки лога, выброшенные из-за переполненной очереди")
+
+_REGISTRY: list = [STAGE_SECONDS, BACKEND_CALLS, UPSTREAM_ERRORS, FX_HEDGES, FX_LEASES, FLOOD_DROPPED, LOG_DROPPED]
+_caches: list = []
+_flights: list = []
+
+
+def span(stage: str):
+    """Контекстный менеджер: время стадии → cake_stage_duration_seconds{stage=...}."""
+    return STAGE_SECONDS.time(stage=stage)
+
+
+def register(metric) -> None:
+    _REGISTRY.append(metric)
+
+
+def register_cache(cache) -> None:
+    """LRUCache сам считает hit/miss/eviction — на /metrics читаем его stats(), горячий путь не трогаем."""
+    _caches.append(cache)
+
+
+def register_single_flight(flight) -> None:
+    """SingleFlight: сколько вызовов всего и сколько получили чужой результат."""
+    _flights.append(flight)
+
+
+def _collect_flights() -> list[str]:
+    lines = []
+    for field, help in (("calls", "Вызовы через SingleFlight"), ("shared", "Вызовы, схлопнутые с уже идущим")):
+        name = f"cake_coalesce_{field}_total"
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} counter"]
+        lines += [f'{name}{{op="{_escape(f.name)}"}} {getattr(f, field)}' for f in _flights]
+    return lines
+
+
+def _collect_caches() -> list[str]:
+    stats = [c.stats() for c in _caches]
+    lines = []
+    for field, kind, help in (
+        ("hits", "counter", "Попадания в in-process кеш"),
+        ("misses", "counter", "Промахи in-process кеша"),
+        ("evictions", "counter", "Вытеснения из in-process кеша"),
+        ("size", "gauge", "Записей в in-process кеше"),
+    ):
+        name = f"cake_cache_{field}" + ("_total" if kind == "counter" else "")
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+        lines += [f'{name}{{cache="{_escape(s["name"])}"}} {s[field]}' for s in stats]
+    # оценка памяти — проход по записям, поэтому только на скрейпе
+    name = "cake_cache_memory_bytes"
+    lines += [f"# HELP {name} Грубая оценка памяти под записи in-process кеша", f"# TYPE {name} gauge"]
+    lines += [f'{name}{{cache="{_escape(c.name)}"}} {c.memory_bytes()}' for c in _caches]
+    return lines
+
+
+def render() -> str:
+    lines: list[str] = []
+    for metric in _REGISTRY:
+        lines += metric.collect()
+    lines += _collect_caches()
+    lines += _collect_flights()
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
@@ -1,111 +1,262 @@
+import asyncio
 import logging
-from db import get_cached_rate, cache_rate, is_rate_cached, get_wage_doc, upsert_wage_doc
-from calculator import convert_kzt, compute_cake_salary, _get_usd_kzt_rate
-from datetime import datetime, timedelta
-from config import CAKE_PRICE_KZT, UNECE_UNIT, UNECE_YEAR
+import os
+import socket
+import time
+import uuid
+from db import get_latest_snapshot, cache_snapshot, acquire_lease, release_lease
+from calculator import compute_cake_salary, get_fx_snapshot, peek_fx_snapshot, set_fx_snapshot, FXSnapshot
+from datetime import datetime, timezone, timedelta
+from config import (CAKE_PRICE_KZT, UNECE_UNIT, RESPONSE_CACHE_SIZE, RESPONSE_PRERENDER,
+                    MAX_COMPARE_ITEMS, INLINE_MAX_RESULTS, INLINE_CACHE_SIZE, INLINE_CACHE_TTL_SECONDS,
+                    FX_LEASE_SECONDS, FX_LEASE_WAIT_SECONDS, FX_LEASE_RETRY_SECONDS, FX_PREFETCH_HOURS)
 import re
 from salary_card import salary_card
-
-MAX_AGE_HOURS = 24
+import wage_index
+from wage_writer import enqueue_wage_update
+from cache import LRUCache, MISSING, SingleFlight
+import cake_dictionary
+import metrics
+import rate_history
+
+# TTL ключа не нужен — версия снимка и зарплат уже в ключе
+response_cache = LRUCache("responses", RESPONSE_CACHE_SIZE, ttl=float("inf"))
+metrics.register_cache(response_cache)
+# inline-подсказки: ключ — (запрос, версии снимка/зарплат/словарей); TTL — на случай смены словарей без версии
+inline_cache = LRUCache("inline", INLINE_CACHE_SIZE, ttl=INLINE_CACHE_TTL_SECONDS)
+metrics.register_cache(inline_cache)
+# одинаковые запросы в полёте (спам кнопкой, волна упоминаний в группе) считаем один раз
+reply_flight = SingleFlight("reply")
+snapshot_flight = SingleFlight("snapshot_refresh")
+metrics.register_single_flight(reply_flight)
+metrics.register_single_flight(snapshot_flight)
 
 #проверка со словарем
 def _is_iso3(s: str | None) -> bool:
     return bool(re.fullmatch(r"[A-Z]{3}", (s or "").strip().upper()))
 
 
-# Если у тебя уже есть эти классы в другом модуле — импортируй их и убери определения ниже
-class FXError(Exception): ...
-class NoWageError(Exception): ...
-
 def _safe_float(x) -> float | None:
     try:
         return float(str(x).replace(",", "").strip())
     except Exception:
         return None
 
-def _parse_ts(ts_val) -> datetime | None:
-    if ts_val is None:
-        return None
+# ───────────────────────────────
+# СНИМОК КУРСОВ: in-process → хранилище (один документ) → FX API
+# Устаревший снимок отдаём сразу и обновляем в фоне (stale-while-revalidate).
+# В FX API из всех реплик ходит одна — держатель аренды FX_LEASE в хранилище;
+# остальные дочитывают записанный ею снимок. Локальную историю (/history) пишет
+# каждая реплика — по строке на каждую новую версию, откуда бы она ни пришла.
+
+_refresh_task: asyncio.Task | None = None
+_stored_at: datetime | None = None   # fetched_at снимка, который уже лежит в хранилище
+_recorded_version: int | None = None   # версия снимка, уже записанная в локальную историю
+
+FX_LEASE = "fx_refresh:KZT"
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+_lease_busy_until = 0.0   # monotonic: аренда у другой реплики — до этого момента не спрашиваем снова
+
+async def refresh_snapshot(*, force: bool = False) -> FXSnapshot:
+    """Берём снимок (при необходимости из FX API) и сохраняем новую версию в хранилище."""
+    # параллельные вызовы (и фоновые, и force из prefetch) ждут один рефреш:
+    # одна запись снимка и одна строка истории
+    return await snapshot_flight.run(FX_LEASE, lambda: _refresh_snapshot(force))
+
+async def _try_lease() -> bool:
+    """Аренда на поход в FX API. Хранилище недоступно — идём сами (лучше лишний запрос, чем без курсов)."""
+    global _lease_busy_until
     try:
-        if hasattr(ts_val, "isoformat"):
-            return datetime.fromisoformat(ts_val.isoformat().replace("Z", "+00:00")).replace(tzinfo=None)
-        s = str(ts_val).strip().replace("Z", "+00:00")
+        got = await asyncio.to_thread(acquire_lease, FX_LEASE, INSTANCE_ID, FX_LEASE_SECONDS)
+    except Exception as e:
+        metrics.FX_LEASES.inc(result="error")
+        logging.warning("acquire_lease(%s) failed: %s", FX_LEASE, e)
+        return True
+    metrics.FX_LEASES.inc(result="acquired" if got else "busy")
+    if not got:
+        _lease_busy_until = time.monotonic() + FX_LEASE_RETRY_SECONDS
+    return got
+
+async def _snapshot_from_peer() -> FXSnapshot | None:
+    """
+    Аренда у другой реплики. Есть хоть какой-то снимок — один раз перечитываем хранилище
+    (вдруг там уже новый) и отдаём что есть. Нет ничего — ждём, пока держатель его запишет.
+    """
+    deadline = time.monotonic() + (0 if peek_fx_snapshot() is not None else FX_LEASE_WAIT_SECONDS)
+    while True:
+        snap = await _adopt_stored_snapshot(fresh=True)
+        if snap is not None or time.monotonic() >= deadline:
+            return snap
+        await asyncio.sleep(0.25)
+
+def _fetched_recently(snap: FXSnapshot, force: bool) -> bool:
+    """Снимок из хранилища можно взять вместо похода в FX API."""
+    if not force:
+        return snap.is_fresh()
+    # prefetch: моложе половины интервала — значит, его записали уже после нашего прошлого
+    # прогрева (ровно интервал — наш же прошлый снимок, его и пора обновить)
+    return datetime.now(timezone.utc) - snap.fetched_at < timedelta(hours=FX_PREFETCH_HOURS) / 2
+
+async def _refresh_snapshot(force: bool) -> FXSnapshot:
+    global _stored_at
+    snap = peek_fx_snapshot()
+    leased = False
+    if force or snap is None or not snap.is_fresh():
+        leased = await _try_lease()
+        if not leased:
+            peer = await _snapshot_from_peer()
+            if peer is not None:
+                return peer
+            # держатель аренды так и не записал снимок — идём в FX API сами
+    try:
+        if leased:
+            # аренда свободна, но сосед мог только что записать снимок (его prefetch, холодный
+            # старт) — перечитываем хранилище мимо кеша, прежде чем идти в FX API
+            stored = await _adopt_stored_snapshot(fresh=True)
+            if stored is not None and _fetched_recently(stored, force):
+                _schedule_prerender(stored)
+                return stored
+        snap = await get_fx_snapshot(force=force)
+        if snap.fetched_at != _stored_at:
+            try:
+                await asyncio.to_thread(cache_snapshot, snap.to_doc())
+                _stored_at = snap.fetched_at
+            except Exception as e:
+                logging.warning("cache_snapshot(%s) failed: %s", snap.version, e)
+        await _record_history(snap)
+        _schedule_prerender(snap)
+    finally:
+        if leased:
+            try:
+                await asyncio.to_thread(release_lease, FX_LEASE, INSTANCE_ID)
+            except Exception as e:
+                logging.warning("release_lease(%s) failed: %s", FX_LEASE, e)   # истечёт сама
+    return snap
+
+def _schedule_refresh() -> None:
+    """
+    Запускаем рефреш в фоне, не дожидаясь его; пока один в полёте — новые не стартуем.
+    Пока аренда у другой реплики — не дёргаем хранилище на каждый запрос.
+    """
+    global _refresh_task
+    if _refresh_task is not None and not _refresh_task.done():
+        return
+    if time.monotonic() < _lease_busy_until:
+        return
+
+    async def _run():
         try:
-            return datetime.fromisoformat(s)
-        except ValueError:
-            return datetime.strptime(s, "%Y-%m-%d %H:%M:%S")
-    except Exception:
-        return None
+            await refresh_snapshot()
+        except Exception as e:
+            logging.warning("background FX refresh failed: %s", e)
 
-def _is_fresh(ts_val, max_age_hours: int = MAX_AGE_HOURS) -> bool:
-    ts = _parse_ts(ts_val)
-    if not ts:
-        return False
-    return (datetime.now() - ts) <= timedelta(hours=max_age_hours)
+    _refresh_task = asyncio.create_task(_run())
 
-async def serve_cached_and_update(update, ccy_code: str | None, country_iso3: str | None):
-    print(f"[DEBUG] serve_cached_and_update ccy={ccy_code} iso3={country_iso3}")
+def _load_stored_snapshot(fresh: bool = False) -> None:
+    """Подтягиваем последнюю версию из хранилища в in-process снимок (одно чтение)."""
+    global _stored_at
+    try:
+        doc = get_latest_snapshot("KZT", fresh=True) if fresh else get_latest_snapshot("KZT")
+    except Exception as e:
+        logging.warning("get_latest_snapshot failed: %s", e)
+        return
+    if not doc:
+        return
+    try:
+        stored = FXSnapshot.from_doc(doc)
+    except Exception as e:
+        logging.warning("bad stored snapshot %r: %s", doc.get("version"), e)
+        return
+    set_fx_snapshot(stored)
+    _stored_at = stored.fetched_at
+
+async def _adopt_stored_snapshot(fresh: bool = False) -> FXSnapshot | None:
+    """Чтение хранилища вне event loop; новую версию оттуда — в локальную историю."""
+    await asyncio.to_thread(_load_stored_snapshot, fresh)
+    snap = peek_fx_snapshot()
+    await _record_history(snap)
+    return snap
+
+async def _record_history(snap: FXSnapshot | None) -> None:
+    """Строка в локальной истории на каждую новую версию: своя загрузка или снимок другой реплики."""
+    global _recorded_version
+    if snap is None or snap.version == _recorded_version:
+        return
+    _recorded_version = snap.version
+    await rate_history.record_snapshot(snap)
+
+async def current_snapshot() -> tuple[FXSnapshot | None, bool]:
+    """(снимок, устарел ли). None — только если курсов нет нигде и FX API недоступен."""
+    snap = peek_fx_snapshot()
+    if snap is not None and snap.is_fresh():
+        return snap, False
+
+    # чтение хранилища (на промахе кеша — сетевой round-trip) — вне event loop
+    snap = await _adopt_stored_snapshot()
+    if snap is not None:
+        if snap.is_fresh():
+            return snap, False
+        _schedule_refresh()
+        return snap, True
+
+    # не знаем вообще ничего — придётся подождать upstream
+    try:
+        return await refresh_snapshot(), False
+    except Exception as e:
+        logging.exception("FX snapshot fetch failed: %s", e)
+        return None, False
+
+async def prefetch_popular_rates(context) -> None:
+    """Job для PTB JobQueue: обновляем снимок до истечения TTL (data=популярные валюты)."""
+    try:
+        snap = await refresh_snapshot(force=True)
+    except Exception as e:
+        logging.warning("prefetch_popular_rates failed: %s", e)
+        return
+    missing = [c for c in (context.job.data or ()) if snap.rate(c) is None]
+    if missing:
+        logging.warning("FX snapshot %s has no rates for %s", snap.version, missing)
+
+def _fmt_snapshot_ts(snap: FXSnapshot) -> str:
+    return snap.fetched_at.astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+_CARD_KWARGS = {"parse_mode": "HTML", "disable_web_page_preview": True}
+
+def render_reply(snap: FXSnapshot | None, stale: bool, ccy_code: str | None,
+                 country_iso3: str | None, *, write_behind: bool = True) -> tuple[str, dict, bool]:
+    """
+    Собираем ответ: (текст, kwargs для reply_text, можно ли кешировать).
+    Для данного снимка и индекса зарплат результат детерминирован.
+    write_behind=False — пререндер: производные поля зарплаты в хранилище не ставим.
+    """
     parts: list[str] = []
+    amount = None
+    ts_display = None
+    cacheable = True
 
     # ── Блок 1: курс торта в валюте ───────────────────────────────────────────
     if ccy_code:
         try:
-            title = f"KZT->{ccy_code}"
             if ccy_code == "KZT":
                 parts.append(f"Казахский торт стоит {CAKE_PRICE_KZT:,.2f} KZT")
+            elif snap is None:
+                cacheable = False
+                parts.append("⚠️ Не удалось получить курс для выбранной валюты, попробуйте позже.")
             else:
-                cached = None
-                try:
-                    cached = get_cached_rate(title)  # (code_title, amount, ts) | None
-                except Exception as e:
-                    logging.warning("get_cached_rate(%s) failed: %s", title, e)
-
-                use_cache = False
-                amount = None
-                code_title = ccy_code
-                ts_display = None
-
-                if cached:
-                    code_title, cached_amount, ts = cached
-                    if _is_fresh(ts):
-                        fval = _safe_float(cached_amount)
-                        if fval is not None:
-                            use_cache = True
-                            amount = fval
-                            ts_display = ts
-
-                if not use_cache:
-                    # свежий курс (сколько CCY за 600_000 KZT)
-                    try:
-                        new_amount = convert_kzt(ccy_code)
-                    except FXError as e:
-                        logging.exception("convert_kzt(%s) FXError: %s", ccy_code, e)
-                        new_amount = None
-                    except Exception as e:
-                        logging.exception("convert_kzt(%s) failed: %s", ccy_code, e)
-                        new_amount = None
-
-                    fval = _safe_float(new_amount)
-                    if fval is None:
-                        await update.message.reply_text("⚠️ Не удалось получить курс для выбранной валюты, попробуйте позже.")
-                        # не выходим: дадим шанс отработать зарплату ниже, если она есть
-                    else:
-                        amount = fval
-                        try:
-                            cache_rate(title, amount)
-                        except Exception as e:
-                            logging.warning("cache_rate(%s) failed: %s", title, e)
-                        ts_display = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
+                # сколько CCY за 600_000 KZT
+                amount = snap.convert(ccy_code)
                 if amount is not None:
+                    ts_display = _fmt_snapshot_ts(snap)
+                    stale_note = ", курс устарел — обновляем" if stale else ""
                     parts.append(
-                        f"{'Казахский торт стоит' if cached and use_cache else 'Казахский торт стоит'} {amount:,.2f} {ccy_code} (обновлено: {ts_display})"
+                        f"Казахский торт стоит {amount:,.2f} {ccy_code} (обновлено: {ts_display}{stale_note})"
                     )
                 else:
                     parts.append("⚠️ Нет актуального курса для выбранной валюты.")
 
         except Exception as e:
             logging.exception("FX block failed: %s", e)
+            cacheable = False
             parts.append("⚠️ Ошибка обработки курса валюты.")
 
     # ── Блок 2: зарплата по стране ────────────────────────────────────────────
@@ -116,74 +267,380 @@ async def serve_cached_and_update(update, ccy_code: str | None, country_iso3: st
                 # В диспетчере не мапим; если сюда долетело не-ISO3 — просто сообщаем и идём дальше
                 parts.append(f"⚠️ Ожидал код страны (ISO3), получил: {iso3!r}. Попробуйте ещё раз.")
             else:
-                # Нужен KZT->USD (цена торта в USD)
-                usd_title = "KZT->USD"
-                price_usd = None
-
-                try:
-                    usd_cached = get_cached_rate(usd_title)
-                except Exception as e:
-                    logging.warning("get_cached_rate(%s) failed: %s", usd_title, e)
-                    usd_cached = None
-
-                if usd_cached and _is_fresh(usd_cached[2]):
-                    price_usd = _safe_float(usd_cached[1])
-
+                # Нужна цена торта в USD — из того же снимка
+                price_usd = snap.convert("USD") if snap else None
                 if price_usd is None:
-                    try:
-                        val = convert_kzt("USD")  # 600k KZT в USD
-                    except Exception as e:
-                        logging.exception("convert_kzt(USD) failed: %s", e)
-                        val = None
-
-                    price_usd = _safe_float(val)
-                    if price_usd is None:
-                        parts.append("⚠️ Не удалось получить курс USD для расчёта зарплаты.")
-                    else:
-                        try:
-                            cache_rate(usd_title, price_usd)
-                        except Exception as e:
-                            logging.warning("cache_rate(%s) failed: %s", usd_title, e)
+                    cacheable = False
+                    parts.append("⚠️ Не удалось получить курс USD для расчёта зарплаты.")
 
                 if price_usd is not None:
-                    calc = append_salary_iso3(iso3, price_usd)
+                    calc = append_salary_iso3(iso3, price_usd, provider=snap.provider, write_behind=write_behind)
                     if calc:
                         # доклеиваем результат валютного блока
                         calc["amount"] = amount
                         calc["ccy_code"] = ccy_code
                         calc["ts_display"] = ts_display
-
-                        try:
-                            await update.message.reply_text(
-                                salary_card(calc),
-                                parse_mode="HTML",
-                                disable_web_page_preview=True
-                            )
-                        except Exception as e:
-                            logging.exception("reply_text (card) failed: %s", e)
-                        return
+                        return salary_card(calc), _CARD_KWARGS, cacheable
                     else:
                         parts.append("⚠️ Зарплата для указанной страны не найдена.")
         except Exception as e:
             logging.exception("Salary block failed: %s", e)
+            cacheable = False
             parts.append("⚠️ Ошибка обработки данных по зарплате.")
 
-    # ── Ответ ─────────────────────────────────────────────────────────────────
     msg = "\n\n".join(parts) if parts else "⚠️ Ничего не распознано."
+    return msg, {}, cacheable
+
+# ───────────────────────────────
+# КЕШ ГОТОВЫХ ОТВЕТОВ: (ccy, iso3, версия снимка, версия зарплат) -> текст
+
+def _response_key(snap: FXSnapshot | None, stale: bool, ccy_code, country_iso3) -> tuple:
+    return (ccy_code, country_iso3, snap.version if snap else None, stale, wage_index.version())
+
+def _render_cached(snap, stale, ccy_code, country_iso3, write_behind: bool = True) -> tuple[str, dict]:
+    key = _response_key(snap, stale, ccy_code, country_iso3)
+    hit = response_cache.get(key)
+    if hit is not MISSING:
+        return hit
+    text, kwargs, cacheable = render_reply(snap, stale, ccy_code, country_iso3, write_behind=write_behind)
+    if cacheable:
+        response_cache.set(key, (text, kwargs))
+    return text, kwargs
+
+PRERENDER_CHUNK = 32   # пар между уступками event loop
+
+async def prerender_responses(snap: FXSnapshot) -> int:
+    """
+    Новый снимок → заранее рендерим все известные пары: каждая страна из индекса
+    зарплат с её валютой и каждая валюта снимка без страны. Старые версии выкидываем.
+    Пачками по PRERENDER_CHUNK с уступкой loop; write-behind зарплат не трогаем.
+    """
+    response_cache.clear()
+    iso3_to_ccy = cake_dictionary.current().iso3_to_ccy
+    pairs = [(iso3_to_ccy.get(iso3), iso3) for iso3 in wage_index.known_iso3()]
+    pairs += [(ccy, None) for ccy in snap.rates]
+    for i, (ccy_code, iso3) in enumerate(pairs, start=1):
+        _render_cached(snap, False, ccy_code, iso3, write_behind=False)
+        if i % PRERENDER_CHUNK == 0:
+            await asyncio.sleep(0)
+    return len(pairs)
+
+_prerendered_for: tuple | None = None   # (версия снимка, версия зарплат)
+_prerender_task: asyncio.Task | None = None
+
+def _schedule_prerender(snap: FXSnapshot | None) -> None:
+    """Пререндер в фоне, если сменилась версия снимка или зарплат; запрос его не ждёт."""
+    global _prerendered_for, _prerender_task
+    if not RESPONSE_PRERENDER or snap is None or not snap.is_fresh():
+        return
+    versions = (snap.version, wage_index.version())
+    if versions == _prerendered_for:
+        return
+    _prerendered_for = versions
+    if _prerender_task is not None and not _prerender_task.done():
+        _prerender_task.cancel()   # рендер прошлой версии уже не нужен
+
+    async def _run():
+        try:
+            n = await prerender_responses(snap)
+            logging.info("prerendered %d responses for FX snapshot %s: %s", n, snap.version, response_cache_stats())
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.warning("prerender failed: %s", e)
+
+    _prerender_task = asyncio.create_task(_run())
+
+def response_cache_stats() -> dict:
+    """Размер кеша ответов и грубая оценка занимаемой памяти (байты)."""
+    stats = response_cache.stats()
+    stats["memory_bytes"] = response_cache.memory_bytes()
+    return stats
+
+async def serve_cached_and_update(update, ccy_code: str | None, country_iso3: str | None):
+    logging.debug("serve_cached_and_update", extra={"ccy": ccy_code, "iso3": country_iso3})
+    # одинаковые пары в полёте делят одно вычисление, отвечает каждому своя reply_text
+    text, kwargs = await reply_flight.run((ccy_code, country_iso3), lambda: _compute_reply(ccy_code, country_iso3))
     try:
-        await update.message.reply_text(msg)
+        with metrics.span("reply_text"):
+            await update.message.reply_text(text, **kwargs)
     except Exception as e:
+        metrics.UPSTREAM_ERRORS.inc(upstream="telegram")
         logging.exception("reply_text failed: %s", e)
 
-def append_salary_iso3(iso3: str, price_usd: float) -> str | None:
-    iso3 = (iso3 or "").strip().upper()
+async def _compute_reply(ccy_code: str | None, country_iso3: str | None) -> tuple[str, dict]:
+    # Один снимок на весь запрос: и для CCY, и для USD в блоке зарплаты
+    snap, stale = None, False
+    if (ccy_code and ccy_code != "KZT") or country_iso3:
+        with metrics.span("snapshot"):
+            snap, stale = await current_snapshot()
+        _schedule_prerender(snap)
+
+    with metrics.span("render"):
+        return _render_cached(snap, stale, ccy_code, country_iso3)
+
+# ───────────────────────────────
+# /compare: много валют → один снимок, один проход, один ответ
+
+def split_compare_args(args) -> list[str]:
+    """Токены /compare: через запятую можно писать названия из нескольких слов («united states, евро»)."""
+    raw = " ".join(args or ())
+    parts = re.split(r"[,;\n]+", raw) if re.search(r"[,;\n]", raw) else raw.split()
+    return [p.strip() for p in parts if p.strip()]
+
+def resolve_compare_tokens(tokens) -> tuple[list[str], list[str]]:
+    """(валюты без повторов в порядке ввода, нераспознанные токены). Страна → её валюта."""
+    ccys: list[str] = []
+    unknown: list[str] = []
+    for token in tokens:
+        ccy, iso3 = cake_dictionary.resolve_user_input(token)
+        if not ccy and iso3:
+            ccy = cake_dictionary.current().iso3_to_ccy.get(iso3)
+        if ccy and _is_iso3(ccy):
+            if ccy not in ccys:
+                ccys.append(ccy)
+        else:
+            unknown.append(token)
+    return ccys[:MAX_COMPARE_ITEMS], unknown
+
+def render_compare(snap: FXSnapshot | None, stale: bool, ccys: list[str], unknown: list[str]) -> str:
+    if snap is None:
+        prices = {c: (float(CAKE_PRICE_KZT) if c == "KZT" else None) for c in ccys}
+    else:
+        prices = snap.convert_many(ccys)
+    lines = [f"🎂 Казахский торт ({CAKE_PRICE_KZT:,.0f} KZT):"]
+    for ccy in ccys:
+        amount = prices.get(ccy)
+        lines.append(f"• {amount:,.2f} {ccy}" if amount is not None else f"• {ccy}: нет курса")
+    if snap is not None:
+        stale_note = ", курс устарел — обновляем" if stale else ""
+        lines.append(f"\nОбновлено: {_fmt_snapshot_ts(snap)}{stale_note}")
+    elif any(p is None for p in prices.values()):
+        lines.append("\n⚠️ Не удалось получить курсы, попробуйте позже.")
+    if unknown:
+        lines.append("Не распознано: " + ", ".join(unknown))
+    return "\n".join(lines)
+
+async def serve_compare(update, tokens) -> None:
+    """Один снимок на все валюты и одно сообщение вместо N отдельных запросов."""
+    ccys, unknown = resolve_compare_tokens(tokens)
+    if not ccys:
+        await update.message.reply_text(
+            "Не распознал ни одной валюты. Пример: /compare USD EUR GBP или /compare all")
+        return
+    snap, stale = None, False
+    if any(c != "KZT" for c in ccys):
+        with metrics.span("snapshot"):
+            snap, stale = await current_snapshot()
+    with metrics.span("render"):
+        key = ("compare", tuple(ccys), tuple(unknown), snap.version if snap else None, stale)
+        text = response_cache.get(key)
+        if text is MISSING:
+            text = render_compare(snap, stale, ccys, unknown)
+            if snap is not None:
+                response_cache.set(key, text)
     try:
-        doc = get_wage_doc(iso3)
+        with metrics.span("reply_text"):
+            await update.message.reply_text(text)
     except Exception as e:
-        logging.exception("get_wage_doc(%s) failed: %s", iso3, e)
+        metrics.UPSTREAM_ERRORS.inc(upstream="telegram")
+        logging.exception("reply_text failed: %s", e)
+
+# ───────────────────────────────
+# /history CCY 30d: статистика цены торта по локальной истории снимков
+
+_PERIOD_DAYS = {"D": 1, "Д": 1, "W": 7, "Н": 7, "M": 30, "М": 30, "Y": 365, "Г": 365}
+HISTORY_DEFAULT_DAYS = 30
+HISTORY_MAX_DAYS = 3660
+
+def parse_history_args(args) -> tuple[str | None, int | None]:
+    """(валюта, дни) из «USD 30d», «евро 2w», «Германия 1y»; период по умолчанию — 30 дней."""
+    tokens = [t for t in (args or ()) if t.strip()]
+    days = HISTORY_DEFAULT_DAYS
+    if tokens:
+        m = re.fullmatch(r"(\d+)\s*([A-Za-zА-Яа-я])?", tokens[-1].strip())
+        if m:
+            unit = (m.group(2) or "D").upper()
+            if unit not in _PERIOD_DAYS:
+                return None, None
+            days = int(m.group(1)) * _PERIOD_DAYS[unit]
+            tokens = tokens[:-1]
+    if not tokens or not 0 < days <= HISTORY_MAX_DAYS:
+        return None, None
+    ccy, iso3 = cake_dictionary.resolve_user_input(" ".join(tokens))
+    if not ccy and iso3:
+        ccy = cake_dictionary.current().iso3_to_ccy.get(iso3)
+    return (ccy if _is_iso3(ccy) else None), days
+
+def render_history(stats: dict | None, ccy: str, days: int) -> str:
+    if not stats:
+        return f"📉 Истории по {ccy} за {days} дн. пока нет — курсы копятся с каждой загрузкой."
+    pct = f" ({stats['change_pct']:+.2f}%)" if stats["change_pct"] is not None else ""
+    return "\n".join([
+        f"📈 Казахский торт в {ccy} за {days} дн. ({stats['points']} снимков, "
+        f"{stats['from']:%Y-%m-%d} — {stats['to']:%Y-%m-%d}):",
+        f"• мин: {stats['min']:,.2f} {ccy}",
+        f"• макс: {stats['max']:,.2f} {ccy}",
+        f"• среднее: {stats['mean']:,.2f} {ccy}",
+        f"• сейчас: {stats['last']:,.2f} {ccy}",
+        f"• изменение: {stats['change']:+,.2f} {ccy}{pct}",
+    ])
+
+async def serve_history(update, args) -> None:
+    ccy, days = parse_history_args(args)
+    if not ccy:
+        await update.message.reply_text("Пример: /history USD 30d (периоды: 7d, 2w, 3m, 1y)")
+        return
+    if ccy == "KZT":
+        await update.message.reply_text(f"Торт в KZT всегда стоит {CAKE_PRICE_KZT:,.0f} KZT 🙂")
+        return
+    with metrics.span("history"):
+        try:
+            stats = await asyncio.to_thread(rate_history.cake_price_stats, ccy, days)
+        except Exception as e:
+            logging.exception("rate history query failed: %s", e)
+            stats = None
+    try:
+        with metrics.span("reply_text"):
+            await update.message.reply_text(render_history(stats, ccy, days))
+    except Exception as e:
+        metrics.UPSTREAM_ERRORS.inc(upstream="telegram")
+        logging.exception("reply_text failed: %s", e)
+
+# ───────────────────────────────
+# /trend Германия: сколько тортов в месяц зарабатывали по годам — ряд из wage_index,
+# цена торта в USD по снимку в памяти, как у inline: устаревший отдаём и обновляем в фоне.
+# Хранилище и FX API ждём только на холодном старте, когда снимка в процессе ещё нет
+
+_SPARK = "▁▂▃▄▅▆▇█"
+
+def cake_trend(iso3: str, cake_price_usd: float | None) -> dict | None:
+    series = wage_index.get_series(iso3)
+    if not series or not cake_price_usd:
+        return None
+    cakes = series.per_cake(cake_price_usd)
+    first = cakes[0]
+    return {"years": series.years, "cakes": cakes, "min": min(cakes), "max": max(cakes),
+            "change_pct": (cakes[-1] / first - 1) * 100 if first and len(cakes) > 1 else None}
+
+def render_trend(trend: dict | None, country_name: str) -> str:
+    if not trend:
+        return f"📉 По {country_name} пока нет зарплат по годам."
+    years, cakes, lo = trend["years"], trend["cakes"], trend["min"]
+    step = (trend["max"] - lo) / (len(_SPARK) - 1) or 1.0
+    lines = [f"📈 {country_name}: тортов в месяц по годам (по сегодняшней цене торта)",
+             "".join(_SPARK[round((c - lo) / step)] for c in cakes)]
+    lines += [f"• {y}: {c:,.2f}" for y, c in zip(years, cakes)]
+    if trend["change_pct"] is not None:
+        lines.append(f"Изменение за {years[0]}–{years[-1]}: {trend['change_pct']:+.1f}%")
+    return "\n".join(lines)
+
+async def serve_trend(update, args) -> None:
+    raw = " ".join(t for t in (args or ()) if t.strip())
+    iso3 = cake_dictionary.resolve_country_iso3_from_user_input(raw) if raw else None
+    if not iso3:
+        await update.message.reply_text("Пример: /trend Германия")
+        return
+    snap, stale = _inline_snapshot()
+    if snap is None:
+        snap, stale = await current_snapshot()
+    with metrics.span("trend"):
+        key = ("trend", iso3, snap.version if snap else None, stale, wage_index.version())
+        text = response_cache.get(key)
+        if text is MISSING:
+            doc = wage_index.get_wage(iso3) or {}
+            name = doc.get("country") or cake_dictionary.current().iso3_to_name.get(iso3, iso3)
+            text = render_trend(cake_trend(iso3, snap.convert("USD") if snap else None), name)
+            if snap is not None:
+                response_cache.set(key, text)
+    try:
+        with metrics.span("reply_text"):
+            await update.message.reply_text(text)
+    except Exception as e:
+        metrics.UPSTREAM_ERRORS.inc(upstream="telegram")
+        logging.exception("reply_text failed: %s", e)
+
+# ───────────────────────────────
+# INLINE: ответ на каждое нажатие клавиши — только из памяти (снимок, индекс зарплат),
+# в FX API и хранилище не ходим никогда; устаревший/отсутствующий снимок обновляем в фоне
+
+def _inline_snapshot() -> tuple[FXSnapshot | None, bool]:
+    snap = peek_fx_snapshot()
+    if snap is None or not snap.is_fresh():
+        _schedule_refresh()
+    return snap, snap is not None and not snap.is_fresh()
+
+def _inline_title(ccy: str | None, iso3: str | None) -> str:
+    if not iso3:
+        return ccy or ""
+    doc = wage_index.get_wage(iso3)
+    name = (doc or {}).get("country") or cake_dictionary.current().iso3_to_name.get(iso3, iso3).title()
+    return f"{name} ({ccy})" if ccy else name
+
+def inline_answers(query: str, default_ccys=()) -> list[dict]:
+    """
+    Подсказки для inline-запроса: [{"id", "title", "description", "text", "kwargs"}].
+    Пустой запрос — популярные валюты. Пустой список — если курсов в памяти ещё нет.
+    """
+    snap, stale = _inline_snapshot()
+    if snap is None:
+        return []
+    norm = " ".join((query or "").split()).upper()
+    key = (norm, snap.version, stale, wage_index.version(), cake_dictionary.current().version)
+    hit = inline_cache.get(key)
+    if hit is not MISSING:
+        return hit
+
+    if norm:
+        pairs = cake_dictionary.suggest(query, limit=INLINE_MAX_RESULTS * 2)
+    else:
+        pairs = [(c, None) for c in default_ccys]
+    results = []
+    for ccy, iso3 in pairs:
+        if ccy and snap.rate(ccy) is None and ccy != "KZT":
+            if not iso3:
+                continue   # «KAZ» и прочие три буквы, которых нет в снимке
+            ccy = None
+        if iso3 and not wage_index.is_loaded():
+            # без индекса зарплат страна потребовала бы чтения из хранилища — только валюта,
+            # а индекс догружаем в фоне
+            wage_index.schedule_refresh()
+            iso3 = None
+            if not ccy:
+                continue
+        text, kwargs = _render_cached(snap, stale, ccy, iso3)
+        results.append({
+            "id": f"{ccy or '-'}:{iso3 or '-'}",
+            "title": _inline_title(ccy, iso3),
+            "description": text.split("\n", 1)[0][:120],
+            "text": text,
+            "kwargs": kwargs,
+        })
+        if len(results) >= INLINE_MAX_RESULTS:
+            break
+    # дубли после понижения страны до валюты
+    seen, unique = set(), []
+    for r in results:
+        if r["id"] not in seen:
+            seen.add(r["id"])
+            unique.append(r)
+    inline_cache.set(key, unique)
+    return unique
+
+def append_salary_iso3(iso3: str, price_usd: float, *, provider: str | None = None,
+                       write_behind: bool = True) -> str | None:
+    iso3 = (iso3 or "").strip().upper()
+    if not wage_index.is_loaded():
+        # рендер идёт в event loop — хранилище отсюда не читаем: ответ пока без зарплаты,
+        # индекс догружается в фоне (версия индекса в ключе кеша — потом отрендерим заново)
+        wage_index.schedule_refresh()
         return None
+    with metrics.span("wage_lookup"):
+        doc = wage_index.get_wage(iso3)
 
-    print(f"[DEBUG] get_wage_doc({iso3}, {UNECE_YEAR}, {UNECE_UNIT}) → {doc}")
+    logging.debug("wage lookup", extra={"iso3": iso3, "year": wage_index.doc_year(doc) if doc else None,
+                                        "unit": UNECE_UNIT, "found": bool(doc),
+                                        "salary": doc.get("salary_usd", doc.get("value")) if doc else None})
     if not doc:
         return None
 
@@ -196,27 +653,28 @@ def append_salary_iso3(iso3: str, price_usd: float) -> str | None:
 
     try:
         kzt_per_usd = CAKE_PRICE_KZT / price_usd_f
-        calc = compute_cake_salary(salary_usd_f, kzt_per_usd=kzt_per_usd)
+        with metrics.span("compute"):
+            calc = compute_cake_salary(salary_usd_f, kzt_per_usd=kzt_per_usd, provider=provider)
     except Exception as e:
         logging.exception("compute_cake_salary failed: %s", e)
         return None
 
     try:
-        # добавим timestamp вручную
+        # добавим timestamp вручную; запись уйдёт в хранилище фоном (wage_writer)
         calc["updated_at"] = datetime.utcnow().isoformat()
-        upsert_wage_doc(
-            iso3,
-            {"salary_kzt": calc["salary_kzt"], "cake_salary": calc["cake_salary"], "updated_at": calc["updated_at"]},
-            UNECE_YEAR,
-            UNECE_UNIT,
-        )
+        if write_behind:
+            enqueue_wage_update(
+                iso3,
+                {"salary_kzt": calc["salary_kzt"], "cake_salary": calc["cake_salary"], "updated_at": calc["updated_at"]},
+                current=doc,
+            )
     except Exception as e:
-        logging.exception("upsert_wage_doc failed for %s: %s", iso3, e)
+        logging.exception("enqueue_wage_update failed for %s: %s", iso3, e)
 
     country_name = doc.get("country", iso3)
     src = doc.get("source", {})
     src_name = src.get("name", "UNECE")
-    src_year = src.get("year", UNECE_YEAR)
+    src_year = wage_index.doc_year(doc)
     src_url = src.get("url", "")
     upd_display = _fmt_ts(doc.get("updated_at") or doc.get("ingested_at") or calc.get("updated_at"))
     # 👇 ДОБАВЬ ЭТО:
@@ -224,6 +682,7 @@ def append_salary_iso3(iso3: str, price_usd: float) -> str | None:
     calc["unit"] = doc.get("unit", "USD")
     calc["value"] = salary_usd_f
     calc["source"] = doc.get("source", {})
+    calc["year"] = src_year
     calc["converted_price"] = price_usd_f
     calc["converted_ccy"] = "USD"
     calc["conversion_time"] = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
@@ -0,0 +1,163 @@
+# rate_history.py — локальная append-only история снимков курсов (SQLite, колоночный формат)
+#
+# Одна строка на загрузку снимка: все валюты одним BLOB-ом float64 (порядок колонок —
+# таблица currencies, только дописывается; NaN — валюты в этом снимке не было).
+# Первичный ключ — время загрузки, поэтому выборка «последние N дней» — range scan
+# по кластерному индексу, а колонку одной валюты вынимаем из BLOB-а без
+# разбора JSON (struct.unpack_from по смещению). Годы ежедневных снимков — тысячи строк, агрегаты за миллисекунды.
+import asyncio
+import logging
+import math
+import os
+import sqlite3
+import struct
+import threading
+from array import array
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+from config import CAKE_PRICE_KZT
+
+HISTORY_DB_PATH = os.getenv("HISTORY_DB_PATH", str(Path(__file__).resolve().parent / "rate_history.db"))
+
+_conn: sqlite3.Connection | None = None
+_lock = threading.RLock()
+_columns: dict[str, int] = {}   # code -> номер колонки (кеш таблицы currencies)
+
+_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS currencies (
+           idx  INTEGER PRIMARY KEY,
+           code TEXT NOT NULL UNIQUE
+       )""",
+    """CREATE TABLE IF NOT EXISTS snapshots (
+           fetched_at  INTEGER PRIMARY KEY,   -- unix, UTC
+           provider_ts INTEGER,
+           base        TEXT NOT NULL,
+           ncols       INTEGER NOT NULL,
+           rates       BLOB NOT NULL          -- float64[ncols], порядок байт машины (файл локальный)
+       ) WITHOUT ROWID""",
+)
+
+def _get_conn() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        with _lock:
+            if _conn is None:
+                conn = sqlite3.connect(HISTORY_DB_PATH, check_same_thread=False, isolation_level=None,
+                                       cached_statements=32)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.execute("PRAGMA busy_timeout=5000")
+                for sql in _SCHEMA:
+                    conn.execute(sql)
+                _columns.clear()
+                _columns.update({code: idx for idx, code in conn.execute("SELECT idx, code FROM currencies")})
+                _conn = conn
+    return _conn
+
+def close() -> None:
+    global _conn
+    with _lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
+            _columns.clear()
+
+def _unix(ts: datetime | None) -> int | None:
+    return int(ts.timestamp()) if ts else None
+
+_DOUBLE = struct.Struct("d")
+
+# ───────────────────────────────
+# ЗАПИСЬ
+
+def append_snapshot(snap) -> bool:
+    """Дописываем снимок (FXSnapshot). False — если такая загрузка уже есть."""
+    with _lock:
+        conn = _get_conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            new_codes = [c for c in sorted(snap.rates) if c not in _columns]
+            for code in new_codes:
+                idx = len(_columns)
+                conn.execute("INSERT INTO currencies (idx, code) VALUES (?, ?)", (idx, code))
+                _columns[code] = idx
+            values = array("d", [math.nan]) * len(_columns)
+            for code, rate in snap.rates.items():
+                values[_columns[code]] = float(rate)
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO snapshots (fetched_at, provider_ts, base, ncols, rates) VALUES (?, ?, ?, ?, ?)",
+                (_unix(snap.fetched_at), _unix(snap.provider_ts), snap.base, len(values), values.tobytes()),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            # колонки, добавленные в откаченной транзакции, перечитаем при следующем соединении
+            close()
+            raise
+    return cur.rowcount == 1
+
+# ───────────────────────────────
+# ЧТЕНИЕ
+
+def series(ccy: str, since: datetime, until: datetime | None = None) -> tuple[array, array]:
+    """(unix-время, курс) одной валюты за период; снимки без этой валюты пропускаем."""
+    code = (ccy or "").strip().upper()
+    with _lock:
+        conn = _get_conn()
+        idx = _columns.get(code)
+        if idx is None:
+            return array("q"), array("d")
+        rows = conn.execute(
+            "SELECT fetched_at, ncols, rates FROM snapshots WHERE fetched_at >= ? AND fetched_at <= ? ORDER BY fetched_at",
+            (_unix(since), _unix(until) if until else 2 ** 62),
+        ).fetchall()
+    ts, rates = array("q"), array("d")
+    offset = idx * _DOUBLE.size
+    unpack = _DOUBLE.unpack_from
+    for fetched_at, ncols, blob in rows:
+        if idx < ncols:
+            v = unpack(blob, offset)[0]
+            if v == v:   # не NaN
+                ts.append(fetched_at)
+                rates.append(v)
+    return ts, rates
+
+def cake_price_stats(ccy: str, days: int, now: datetime | None = None) -> dict | None:
+    """
+    Цена торта в CCY за последние days дней: min/max/mean, первая/последняя, изменение.
+    None — если в истории нет ни одной точки.
+    """
+    now = now or datetime.now(timezone.utc)
+    ts, rates = series(ccy, now - timedelta(days=days), now)
+    if not rates:
+        return None
+    # агрегаты по курсу (C-циклы по array), в цену торта — одним множителем в конце
+    lo, hi = min(rates), max(rates)
+    mean = math.fsum(rates) / len(rates)
+    first, last = rates[0], rates[-1]
+    k = float(CAKE_PRICE_KZT)
+    return {
+        "ccy": ccy.strip().upper(),
+        "days": days,
+        "points": len(rates),
+        "from": datetime.fromtimestamp(ts[0], timezone.utc),
+        "to": datetime.fromtimestamp(ts[-1], timezone.utc),
+        "min": lo * k,
+        "max": hi * k,
+        "mean": mean * k,
+        "first": first * k,
+        "last": last * k,
+        "change": (last - first) * k,
+        "change_pct": (last / first - 1) * 100 if first else None,
+    }
+
+def count() -> int:
+    with _lock:
+        return _get_conn().execute("SELECT COUNT(*) FROM snapshots").fetchone()[0]
+
+async def record_snapshot(snap) -> None:
+    """Из event loop: пишем в потоке, ошибки истории не должны мешать ответу."""
+    try:
+        await asyncio.to_thread(append_snapshot, snap)
+    except Exception as e:
+        logging.warning("rate history append failed: %s", e)
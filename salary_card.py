@@ -1,5 +1,3 @@
-from config import UNECE_YEAR
-
 def salary_card(calc: dict, cake_price_kzt: int = 600_000) -> str:
     """
     Возвращает текстовую карточку по зарплате и торту, устойчивую к отсутствию данных.
@@ -13,7 +11,7 @@ def salary_card(calc: dict, cake_price_kzt: int = 600_000) -> str:
     # Источник
     src = calc.get("source", {})
     src_name = src.get("name", "неизвестный источник")
-    src_year = src.get("year", UNECE_YEAR)
+    src_year = src.get("year") or calc.get("year") or "год неизв."
     src_url = src.get("url")
 
     # Дата обновления
@@ -0,0 +1,11 @@
+# Словари для тестов — образцы из benchmarks/data, без Firestore и без собранного снимка;
+# история курсов — в памяти, а не в rate_history.db рядом с кодом.
+# Выставляем до первого импорта cake_dictionary (он грузит словари при импорте).
+import os
+from pathlib import Path
+
+_ROOT = Path(__file__).resolve().parent.parent
+os.environ.setdefault("DICTIONARY_SOURCE", "local")
+os.environ.setdefault("DICTIONARY_DATA_DIR", str(_ROOT / "benchmarks" / "data"))
+os.environ.setdefault("DICTIONARY_SNAPSHOT", str(_ROOT / "benchmarks" / "data" / "missing.snapshot"))
+os.environ.setdefault("HISTORY_DB_PATH", ":memory:")
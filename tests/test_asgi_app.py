@@ -0,0 +1,191 @@
+import asyncio
+import json
+
+from telegram.ext import Application, MessageHandler, filters
+
+import asgi_app
+from benchmarks.fakes import FakeTelegramAPI, asgi_request, synthetic_update
+from update_processor import ChatOrderedUpdateProcessor
+
+_SECRET = "s3cret"
+_HEADERS = {"X-Telegram-Bot-Api-Secret-Token": _SECRET}
+_PATH = "/tgwebhook"
+
+
+def _make(handler, telegram=None, running=4, pending=None, **kwargs) -> asgi_app.WebhookApp:
+    telegram = telegram or FakeTelegramAPI()
+
+    def build():
+        app = (Application.builder().token("1:TEST").request(telegram).updater(None)
+               .concurrent_updates(ChatOrderedUpdateProcessor(running, pending)).build())
+        app.add_handler(MessageHandler(filters.TEXT, handler))
+        return app
+
+    return asgi_app.WebhookApp(build, url_path="tgwebhook", secret=_SECRET, **kwargs)
+
+
+def _body(update_id: int, chat_id: int = 1, text: str = "USD") -> bytes:
+    return json.dumps(synthetic_update(update_id, chat_id, text)).encode()
+
+
+def test_ack_comes_before_processing():
+    seen = []
+
+    async def scenario():
+        gate = asyncio.Event()
+
+        async def handler(update, context):
+            await gate.wait()
+            seen.append(update.update_id)
+            await update.message.reply_text("ok")
+
+        telegram = FakeTelegramAPI()
+        app = _make(handler, telegram)
+        await app.startup()
+        status, _ = await asgi_request(app, "POST", _PATH, _body(1), _HEADERS)
+        assert status == 200 and seen == []        # ответили Telegram, хендлер ещё ждёт
+        gate.set()
+        await app.queue.join()
+        assert seen == [1] and telegram.calls["sendMessage"] == 1
+        await app.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_secret_and_payload_are_validated():
+    async def handler(update, context):
+        pass
+
+    async def scenario():
+        app = _make(handler)
+        await app.startup()
+        assert (await asgi_request(app, "POST", _PATH, _body(1)))[0] == 403
+        assert (await asgi_request(app, "POST", _PATH, _body(1), {"X-Telegram-Bot-Api-Secret-Token": "x"}))[0] == 403
+        assert (await asgi_request(app, "POST", _PATH, b"not json", _HEADERS))[0] == 400
+        assert (await asgi_request(app, "POST", _PATH, b"x" * (asgi_app.MAX_BODY_BYTES + 1), _HEADERS))[0] == 413
+        assert (await asgi_request(app, "GET", "/nope"))[0] == 404
+        assert app.queue.qsize() == 0
+        await app.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_health_readiness_and_metrics():
+    async def handler(update, context):
+        pass
+
+    async def scenario():
+        app = _make(handler)
+        assert (await asgi_request(app, "GET", "/healthz"))[0] == 200
+        assert (await asgi_request(app, "GET", "/readyz"))[0] == 503
+        assert (await asgi_request(app, "POST", _PATH, _body(1), _HEADERS))[0] == 503
+        await app.startup()
+        status, body = await asgi_request(app, "GET", "/readyz")
+        assert status == 200 and json.loads(body) == {"ready": True, "queued": 0, "in_flight": 0}
+        status, body = await asgi_request(app, "GET", "/metrics")
+        assert status == 200 and b"cake_webhook_updates_total" in body
+        await app.shutdown()
+        assert (await asgi_request(app, "GET", "/readyz"))[0] == 503
+
+    asyncio.run(scenario())
+
+
+def test_full_queue_asks_telegram_to_retry_and_shutdown_drains():
+    done = []
+
+    async def scenario():
+        gate = asyncio.Event()
+
+        async def handler(update, context):
+            await gate.wait()
+            done.append(update.update_id)
+
+        app = _make(handler, running=1, pending=1, queue_size=2)
+        await app.startup()
+        statuses = []
+        for i in range(4):
+            statuses.append((await asgi_request(app, "POST", _PATH, _body(i, chat_id=i), _HEADERS))[0])
+            await asyncio.sleep(0)   # в работу уходит только первый — семафор процессора занят
+        assert statuses == [200, 200, 200, 503]
+        gate.set()
+        await app.shutdown()      # дорабатываем принятое
+
+    asyncio.run(scenario())
+    assert sorted(done) == [0, 1, 2]
+
+
+def test_updates_of_one_chat_stay_in_order():
+    order = []
+
+    async def handler(update, context):
+        await asyncio.sleep(0.001 * (update.update_id % 3))
+        order.append((update.effective_chat.id, update.update_id))
+
+    async def scenario():
+        app = _make(handler, running=8)
+        await app.startup()
+        for i in range(30):
+            await asgi_request(app, "POST", _PATH, _body(i, chat_id=i % 3), _HEADERS)
+        await app.queue.join()
+        await app.shutdown()
+
+    asyncio.run(scenario())
+    for chat in range(3):
+        ids = [u for c, u in order if c == chat]
+        assert ids == sorted(ids) and len(ids) == 10
+
+
+def test_busy_chat_does_not_stall_other_chats():
+    other_done = []
+
+    async def scenario():
+        gate = asyncio.Event()
+
+        async def handler(update, context):
+            if update.effective_chat.id == 1:
+                await gate.wait()
+            else:
+                other_done.append(update.update_id)
+
+        app = _make(handler, running=4)
+        await app.startup()
+        for i in range(20):   # очередь одного чата длиннее числа слотов
+            await asgi_request(app, "POST", _PATH, _body(i, chat_id=1), _HEADERS)
+        await asgi_request(app, "POST", _PATH, _body(100, chat_id=2), _HEADERS)
+        for _ in range(50):
+            if other_done:
+                break
+            await asyncio.sleep(0.001)
+        assert other_done == [100]   # чат 2 не ждал 20 апдейтов чата 1
+        gate.set()
+        await app.queue.join()
+        await app.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_lifespan_protocol():
+    async def handler(update, context):
+        pass
+
+    async def scenario():
+        app = _make(handler)
+        inbox = asyncio.Queue()
+        for t in ("lifespan.startup", "lifespan.shutdown"):
+            inbox.put_nowait({"type": t})
+        sent = []
+
+        async def send(message):
+            sent.append(message["type"])
+            if message["type"] == "lifespan.startup.complete":
+                assert app.ready()
+
+        await app({"type": "lifespan"}, inbox.get, send)
+        assert sent == ["lifespan.startup.complete", "lifespan.shutdown.complete"]
+
+    asyncio.run(scenario())
+
+
+def test_default_secret_is_stable_per_token():
+    assert asgi_app.webhook_secret("1:A") == asgi_app.webhook_secret("1:A") != asgi_app.webhook_secret("1:B")
+    assert asgi_app.webhook_secret(None) == ""
@@ -0,0 +1,18 @@
+import asyncio
+
+from benchmarks import bench_hotpaths, bench_webhook
+
+
+def test_hotpath_suite_runs_offline():
+    results = bench_hotpaths.run_all(60)
+    assert results["resolver/resolve_user_input"]["n"] == 60
+    warm = results["dispatcher/warm (cache hit)"]
+    assert warm["fx_requests"] == 0 and not warm["store_calls"]
+    cold = results["dispatcher/empty store → FX API"]
+    assert 0 < cold["fx_requests"] <= 1
+    assert not bench_hotpaths._regressions(results, results, 1.0)
+
+
+def test_webhook_load_run_offline():
+    stats = asyncio.run(bench_webhook.run_in_process(40, chats=10, send_ms=0, workers=4))
+    assert stats["n"] == 40 and stats["replies"] == 40
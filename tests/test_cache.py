@@ -0,0 +1,117 @@
+import asyncio
+import time
+
+import pytest
+
+import db
+from cache import LRUCache, MISSING, SingleFlight
+
+
+def test_lru_evicts_least_recently_used():
+    c = LRUCache("t", maxsize=2, ttl=60)
+    c.set("a", 1)
+    c.set("b", 2)
+    assert c.get("a") == 1       # a стал самым свежим
+    c.set("c", 3)                # вытесняем b
+    assert c.get("b") is MISSING
+    assert c.get("a") == 1 and c.get("c") == 3
+    assert c.stats()["evictions"] == 1
+
+
+def test_entries_expire_per_ttl():
+    c = LRUCache("t", maxsize=10, ttl=60)
+    c.set("short", "x", ttl=0.01)
+    c.set("long", "y")
+    time.sleep(0.02)
+    assert c.get("short") is MISSING
+    assert c.get("long") == "y"
+    assert c.stats()["hits"] == 1 and c.stats()["misses"] == 1
+
+
+class FakeBackend:
+    def __init__(self):
+        self.reads = 0
+        self.wages = {"DEU": {"iso3": "DEU", "value": 5000}}
+
+    def get_wage_doc(self, iso3):
+        self.reads += 1
+        return self.wages.get(iso3)
+
+    def upsert_wage_doc(self, iso3, patch, *args, **kwargs):
+        self.wages[iso3] = {**self.wages.get(iso3, {}), **patch}
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    fake = FakeBackend()
+    monkeypatch.setattr(db, "_backend", fake)
+    db.clear_caches()
+    yield fake
+    db.clear_caches()
+
+
+def test_repeated_lookups_skip_backend(backend):
+    for _ in range(5):
+        assert db.get_wage_doc("deu")["value"] == 5000
+    assert backend.reads == 1
+
+
+def test_unknown_iso3_is_negatively_cached(backend):
+    assert db.get_wage_doc("XXX") is None
+    assert db.get_wage_doc("XXX") is None
+    assert backend.reads == 1
+
+
+def test_write_invalidates_entry(backend):
+    db.get_wage_doc("DEU")
+    db.upsert_wage_doc("DEU", {"cake_salary": 4.2})
+    assert db.get_wage_doc("DEU")["cake_salary"] == 4.2
+    assert backend.reads == 2
+
+
+def test_single_flight_shares_result_and_errors():
+    sf = SingleFlight("t")
+    runs = []
+
+    async def work(key, fail=False):
+        runs.append(key)
+        await asyncio.sleep(0.01)
+        if fail:
+            raise ValueError(key)
+        return key * 2
+
+    async def scenario():
+        same = await asyncio.gather(*(sf.run("a", lambda: work("a")) for _ in range(5)), sf.run("b", lambda: work("b")))
+        assert same == ["aa"] * 5 + ["bb"]
+        errors = await asyncio.gather(*(sf.run("x", lambda: work("x", fail=True)) for _ in range(3)),
+                                      return_exceptions=True)
+        assert all(isinstance(e, ValueError) for e in errors)
+        # результат не кешируется: следующий вызов считает заново
+        assert await sf.run("a", lambda: work("a")) == "aa"
+
+    asyncio.run(scenario())
+    assert runs == ["a", "b", "x", "a"]
+    assert sf.shared == 6 and sf.inflight() == 0
+
+
+def test_single_flight_waiters_retry_when_leader_is_cancelled():
+    sf = SingleFlight("t")
+    runs = []
+
+    async def work():
+        runs.append(1)
+        await asyncio.sleep(0.01)
+        return len(runs)
+
+    async def scenario():
+        leader = asyncio.create_task(sf.run("k", work))
+        await asyncio.sleep(0)
+        waiters = [asyncio.create_task(sf.run("k", work)) for _ in range(3)]
+        await asyncio.sleep(0)
+        leader.cancel()
+        # ожидающие не наследуют отмену лидера: один пересчитывает, остальные ждут его
+        assert await asyncio.gather(*waiters) == [2, 2, 2]
+        assert leader.cancelled()
+
+    asyncio.run(scenario())
+    assert len(runs) == 2 and sf.inflight() == 0
@@ -0,0 +1,95 @@
+import asyncio
+from datetime import datetime, timezone, timedelta
+
+import httpx
+import pytest
+
+import calculator
+import fx_providers
+from calculator import FXError, FXSnapshot, convert_kzt, _get_usd_kzt_rate, _parse_snapshot
+from config import CAKE_PRICE_KZT
+
+_PAYLOAD = {
+    "result": "success",
+    "base_code": "KZT",
+    "time_last_update_unix": 1754784001,
+    "rates": {"KZT": 1, "USD": 0.00185, "EUR": 0.0016, "RUB": 0.1475},
+}
+
+
+@pytest.fixture
+def fake_api(monkeypatch):
+    """Подменяем HTTP-транспорт: handler(request) -> httpx.Response."""
+    calls = []
+
+    def install(handler):
+        def counted(request):
+            calls.append(request)
+            return handler(request)
+        monkeypatch.setattr(calculator, "_get_client",
+                            lambda: httpx.AsyncClient(transport=httpx.MockTransport(counted)))
+        monkeypatch.setattr(calculator, "_snapshot", None)
+        monkeypatch.setattr(calculator, "_refresh_lock", asyncio.Lock())
+        monkeypatch.setattr(calculator, "_RETRY_BACKOFF", 0)
+        monkeypatch.setattr(calculator, "_providers", [fx_providers.Provider("open_er_api", calculator._API)])
+        return calls
+
+    return install
+
+
+def test_parse_snapshot_keeps_whole_table():
+    snap = _parse_snapshot(_PAYLOAD)
+    assert snap.base == "KZT"
+    assert set(snap.rates) == {"KZT", "USD", "EUR", "RUB"}
+    assert snap.version == 1754784001
+    assert snap.convert("usd") == CAKE_PRICE_KZT * 0.00185
+    assert snap.convert("XXX") is None
+
+
+def test_snapshot_expiry():
+    old = datetime.now(timezone.utc) - timedelta(hours=25)
+    snap = FXSnapshot(base="KZT", rates={"USD": 0.002}, provider_ts=None, fetched_at=old)
+    assert not snap.is_fresh()
+    assert FXSnapshot(base="KZT", rates={"USD": 0.002}, provider_ts=None).is_fresh()
+
+
+def test_many_currencies_cost_one_upstream_call(fake_api):
+    calls = fake_api(lambda request: httpx.Response(200, json=_PAYLOAD))
+
+    async def scenario():
+        results = await asyncio.gather(*(convert_kzt(c) for c in ("USD", "EUR", "RUB", "USD")))
+        assert all(r is not None for r in results)
+        assert abs(await _get_usd_kzt_rate() - 1 / 0.00185) < 1e-9
+
+    asyncio.run(scenario())
+    assert len(calls) == 1
+
+
+def test_fetch_retries_server_errors(fake_api):
+    responses = iter([httpx.Response(503), httpx.Response(200, json=_PAYLOAD)])
+    calls = fake_api(lambda request: next(responses))
+
+    snap = asyncio.run(calculator.get_fx_snapshot())
+    assert snap.rate("EUR") == 0.0016
+    assert len(calls) == 2
+    assert snap.provider == "open_er_api" == FXSnapshot.from_doc(snap.to_doc()).provider
+    calc = calculator.compute_cake_salary(1000, kzt_per_usd=snap.kzt_per_usd(), provider=snap.provider)
+    assert calc["fx"]["provider"] == "open_er_api"
+
+
+def test_fetch_gives_up_after_bounded_retries(fake_api):
+    def handler(request):
+        raise httpx.ConnectTimeout("slow upstream", request=request)
+    calls = fake_api(handler)
+
+    with pytest.raises(FXError):
+        asyncio.run(calculator.get_fx_snapshot())
+    assert len(calls) == calculator._RETRIES + 1
+    assert asyncio.run(convert_kzt("USD")) is None
+
+
+def test_convert_many_matches_convert():
+    snap = _parse_snapshot(_PAYLOAD)
+    many = snap.convert_many(["usd", "EUR", "KZT", "XXX"])
+    assert many["USD"] == snap.convert("USD") and many["EUR"] == snap.convert("EUR")
+    assert many["KZT"] == 600_000 and many["XXX"] is None
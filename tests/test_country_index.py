@@ -0,0 +1,70 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from cake_dictionary import CountryIndex, norm_country, _prefix_distance
+
+DATA = Path(__file__).resolve().parent.parent / "benchmarks" / "data"
+
+
+@pytest.fixture(scope="module")
+def index():
+    raw = json.loads((DATA / "country_name_to_iso3.json").read_text(encoding="utf-8"))
+    # без руками выписанных 4-буквенных алиасов — индекс должен справиться сам
+    hand_written = {"БЕЛГ", "АМЕР", "АВСТРИ", "ГЕРМ"}
+    names = {norm_country(k): v for k, v in raw.items() if k not in hand_written}
+    return CountryIndex(names)
+
+
+@pytest.mark.parametrize("text, iso3", [
+    ("БЕЛЬГ", "BEL"),
+    ("АВСТРИ", "AUT"),
+    ("KAZAKH", "KAZ"),
+    ("ВЕЛИКОБ", "GBR"),
+])
+def test_unambiguous_prefix(index, text, iso3):
+    assert index.lookup(text) == iso3
+
+
+def test_ambiguous_prefix_is_not_guessed(index):
+    assert index.lookup("АВСТР") is None          # Австрия / Австралия
+    assert set(index.prefix("АВСТР")) == {"AUT", "AUS"}
+
+
+@pytest.mark.parametrize("text, iso3", [
+    ("ГЕРМАНЯ", "DEU"),
+    ("КАЗАХСТН", "KAZ"),
+    ("KAZAHSTAN", "KAZ"),
+    ("POLND", "POL"),
+    ("ШВЕЙЦАРИ", "CHE"),
+])
+def test_small_typos(index, text, iso3):
+    assert index.lookup(text) == iso3
+
+
+def test_short_or_far_inputs_do_not_match(index):
+    assert index.lookup("АБ") is None
+    assert index.lookup("ZZZZZZ") is None
+
+
+@pytest.mark.parametrize("text", ["ТОРТ", "TEST", "ПРИВЕТ", "ЦЕНА", "HELP", "ТОРТЫ", "CAKE", "МАМА", "ДОМ"])
+def test_common_words_are_not_countries(index, text):
+    assert index.lookup(text) is None
+
+
+def test_prefix_distance_is_bounded():
+    assert _prefix_distance("ГЕРМ", "ГЕРМАНИЯ", 1) == 0
+    assert _prefix_distance("ГИРМ", "ГЕРМАНИЯ", 1) == 1
+    assert _prefix_distance("XXXX", "ГЕРМАНИЯ", 1) == 2
+    assert _prefix_distance("ГИРМ", "ГЕРМАНИЯ", 1, whole=True) == 2
+    assert _prefix_distance("POLND", "POLAND", 1, whole=True) == 1
+
+
+def test_suggest_lists_currencies_and_countries_by_prefix():
+    import cake_dictionary
+    assert ("USD", "USA") in cake_dictionary.suggest("амер")
+    assert ("EUR", None) in cake_dictionary.suggest("ев")
+    assert cake_dictionary.suggest("австри") == [(None, "AUT")]
+    assert cake_dictionary.suggest("ру", limit=1) == cake_dictionary.suggest("ру")[:1]
+    assert cake_dictionary.suggest("") == []
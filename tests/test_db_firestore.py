@@ -0,0 +1,129 @@
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+import db_firestore
+
+_NOW = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def test_lease_is_free_rules():
+    assert db_firestore._lease_is_free(None, "a", _NOW)
+    held = {"owner": "b", "expires_at": _NOW + timedelta(seconds=5)}
+    assert not db_firestore._lease_is_free(held, "a", _NOW)
+    assert db_firestore._lease_is_free(held, "b", _NOW)                       # продление
+    assert db_firestore._lease_is_free(held, "a", _NOW + timedelta(seconds=5))  # истекла
+
+
+class _FakeFirestore:
+    """Только запись: любое чтение в тесте — ошибка."""
+
+    def __init__(self):
+        self.commits = []
+
+    def collection(self, name):
+        return self
+
+    def document(self, doc_id):
+        return doc_id
+
+    def batch(self):
+        db, ops = self, []
+
+        class Batch:
+            def set(self, ref, data, merge=False):
+                ops.append((ref, data))
+
+            def commit(self):
+                db.commits.append(ops)
+
+        return Batch()
+
+    def get_all(self, refs):
+        raise AssertionError("probe read")
+
+
+def test_wage_upserts_write_canonical_ids_without_reads(monkeypatch):
+    fake = _FakeFirestore()
+    monkeypatch.setattr(db_firestore, "_get_db", lambda: fake)
+    monkeypatch.setattr(db_firestore, "_BATCH_LIMIT", 2)
+    db_firestore.upsert_wage_docs({"kaz": {"cake_salary": 1.0, "updated_at": "t"}, "RUS": {"updated_at": "t"},
+                                   "UKR": {"updated_at": "t"}}, 2024, "usd")
+    assert [[ref for ref, _ in ops] for ops in fake.commits] == [["KAZ_2024_USD", "RUS_2024_USD"], ["UKR_2024_USD"]]
+    assert fake.commits[0][0][1] == {"iso3": "KAZ", "year": 2024, "unit": "USD", "cake_salary": 1.0, "updated_at": "t"}
+
+
+class _FakeWageQuery:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def collection(self, name):
+        return self
+
+    def where(self, field, op, value):
+        return _FakeWageQuery([d for d in self.docs if d.get(field) == value])
+
+    def stream(self):
+        return [SimpleNamespace(to_dict=lambda d=d: dict(d)) for d in self.docs]
+
+
+def test_wage_doc_skips_docs_without_salary(monkeypatch):
+    docs = [{"iso3": "KAZ", "year": 2025, "cake_salary": 1.0},   # только write-behind
+            {"iso3": "KAZ", "year": 2024, "value": 850.0}]
+    monkeypatch.setattr(db_firestore, "_get_db", lambda: _FakeWageQuery(docs))
+    assert db_firestore.get_wage_doc("KAZ")["value"] == 850.0
+    docs.pop()
+    assert db_firestore.get_wage_doc("KAZ") is None
+
+
+def test_wage_doc_prefers_pinned_then_latest_year(monkeypatch):
+    docs = [{"iso3": "KAZ", "year": y, "value": v} for y, v in ((2022, 700.0), (2024, 850.0), (2023, 800.0))]
+    monkeypatch.setattr(db_firestore, "_get_db", lambda: _FakeWageQuery(docs))
+    assert db_firestore.get_wage_doc("KAZ")["year"] == 2024
+    monkeypatch.setattr(db_firestore, "UNECE_YEAR", 2023)
+    assert db_firestore.get_wage_doc("KAZ")["year"] == 2023
+
+
+def test_parse_doc_id_handles_legacy_names():
+    assert db_firestore._parse_doc_id("KAZ_2024_USD") == ("KAZ", 2024, "USD")
+    assert db_firestore._parse_doc_id("UNITED STATES_2024_USD") == ("UNITED STATES", 2024, "USD")
+    assert db_firestore._parse_doc_id("garbage") is None
+
+
+# Транзакции — против эмулятора: gcloud emulators firestore start --host-port=localhost:8681
+#   FIRESTORE_EMULATOR_HOST=localhost:8681 GOOGLE_CLOUD_PROJECT=demo-cake python -m pytest tests/test_db_firestore.py
+emulator = pytest.mark.skipif(not os.getenv("FIRESTORE_EMULATOR_HOST"), reason="FIRESTORE_EMULATOR_HOST is not set")
+
+
+@emulator
+def test_lease_roundtrip_on_emulator():
+    name = f"test-{uuid.uuid4().hex[:8]}"
+    assert db_firestore.acquire_lease(name, "a", 30)
+    assert not db_firestore.acquire_lease(name, "b", 30)
+    db_firestore.release_lease(name, "b")
+    assert not db_firestore.acquire_lease(name, "b", 30)
+    db_firestore.release_lease(name, "a")
+    assert db_firestore.acquire_lease(name, "b", 30)
+
+
+@emulator
+def test_lease_race_has_one_winner_on_emulator():
+    name = f"race-{uuid.uuid4().hex[:8]}"
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(lambda i: db_firestore.acquire_lease(name, f"replica-{i}", 30), range(8)))
+    assert results.count(True) == 1
+
+
+@emulator
+def test_legacy_wage_ids_migrate_on_emulator():
+    col = db_firestore._wages_col()
+    col.document("KAZAKHSTAN_1999_USD").set({"country": "Kazakhstan", "value": 100})
+    db_firestore.upsert_wage_doc("KAZ", {"cake_salary": 2.0}, 1999, "USD")
+    assert db_firestore.migrate_legacy_wage_ids() >= 1
+    assert not col.document("KAZAKHSTAN_1999_USD").get().exists
+    doc = col.document("KAZ_1999_USD").get().to_dict()
+    assert doc["value"] == 100 and doc["cake_salary"] == 2.0
@@ -0,0 +1,104 @@
+import shutil
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+import db_sqlite
+from calculator import FXSnapshot
+
+LEGACY_DB = Path(__file__).resolve().parent.parent / "exchange_rates.db"
+
+
+@pytest.fixture
+def sqlite_db(tmp_path, monkeypatch):
+    def open_db(path):
+        db_sqlite.close()
+        monkeypatch.setattr(db_sqlite, "DB_PATH", str(path))
+        return db_sqlite
+
+    yield open_db
+    db_sqlite.close()
+
+
+def test_migration_cleans_legacy_rows(tmp_path, sqlite_db):
+    path = tmp_path / "legacy.db"
+    shutil.copy(LEGACY_DB, path)
+    db = sqlite_db(path)
+
+    assert db.get_cached_rate("KZT->USD")[1] == pytest.approx(1110.6)
+    assert not db.is_rate_cached("1110.6")
+    assert not db.is_rate_cached("USD")
+    titles = [r[0] for r in sqlite3.connect(path).execute("SELECT title FROM exchange_rates")]
+    assert all(t.startswith("KZT->") for t in titles)
+    assert db.migrate() == len(db._MIGRATIONS)  # повторный прогон — no-op
+
+
+def test_wal_and_rate_roundtrip(tmp_path, sqlite_db):
+    db = sqlite_db(tmp_path / "fresh.db")
+    db.cache_rate("kzt->eur", 1000)
+    db.cache_rate("KZT->EUR", 1020.5)
+    assert db.get_cached_rate("KZT->EUR")[1] == 1020.5
+    assert db._get_conn().execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_wage_upsert_merges_fields(tmp_path, sqlite_db, monkeypatch):
+    db = sqlite_db(tmp_path / "fresh.db")
+    assert db.get_wage_doc("DEU") is None
+    db.upsert_wage_doc("deu", {"country": "Germany", "value": 5000}, 2024)
+    db.upsert_wage_doc("DEU", {"cake_salary": 4.2}, 2024)
+    doc = db.get_wage_doc("DEU")
+    assert doc["country"] == "Germany"
+    assert doc["value"] == 5000
+    assert doc["cake_salary"] == 4.2
+    assert doc["iso3"] == "DEU"
+    db.upsert_wage_doc("DEU", {"cake_salary": 4.4}, 2025)   # год без зарплаты — не выбираем
+    assert db.get_wage_doc("DEU")["year"] == 2024
+    db.upsert_wage_doc("DEU", {"value": 4800}, 2023)
+    monkeypatch.setattr(db, "UNECE_YEAR", 2023)
+    assert db.get_wage_doc("DEU")["value"] == 4800
+
+
+def test_snapshot_roundtrip(tmp_path, sqlite_db):
+    db = sqlite_db(tmp_path / "fresh.db")
+    older = FXSnapshot(base="KZT", rates={"USD": 0.0019}, provider_ts=None)
+    newer = FXSnapshot(base="KZT", rates={"USD": 0.002, "EUR": 0.0017}, provider_ts=None, provider="currency_api")
+    db.cache_snapshot(older.to_doc())
+    db.cache_snapshot(newer.to_doc())
+    got = FXSnapshot.from_doc(db.get_latest_snapshot("KZT"))
+    assert got.rates == newer.rates
+    assert got.expires_at == newer.expires_at
+    assert got.provider == "currency_api"
+
+
+def test_batch_wage_upsert(tmp_path, sqlite_db):
+    db = sqlite_db(tmp_path / "fresh.db")
+    db.upsert_wage_docs({"DEU": {"cake_salary": 4.2}, "POL": {"cake_salary": 1.6}}, 2024)
+    assert {d["iso3"] for d in db.list_wage_docs()} == {"DEU", "POL"}
+
+
+def test_lease_single_holder_until_expiry_or_release(tmp_path, sqlite_db):
+    db = sqlite_db(tmp_path / "lease.db")
+    assert db.acquire_lease("fx", "a", 30)
+    assert not db.acquire_lease("fx", "b", 30)
+    assert db.acquire_lease("fx", "a", 30)       # продление своим владельцем
+    db.release_lease("fx", "b")                  # чужой release — no-op
+    assert not db.acquire_lease("fx", "b", 30)
+    db.release_lease("fx", "a")
+    assert db.acquire_lease("fx", "b", 0)        # ttl=0 — истекла сразу
+    assert db.acquire_lease("fx", "a", 30)
+    assert db.acquire_lease("other", "b", 30)    # имена независимы
+
+
+def test_lease_is_shared_between_connections(tmp_path, sqlite_db):
+    path = tmp_path / "lease.db"
+    db = sqlite_db(path)
+    assert db.acquire_lease("fx", "proc-1", 30)
+    # второе соединение (как у другого uvicorn worker) на том же файле видит аренду
+    other = sqlite3.connect(path)
+    owner, = other.execute("SELECT owner FROM leases WHERE name = 'fx'").fetchone()
+    assert owner == "proc-1"
+    other.execute("UPDATE leases SET expires_at = 0 WHERE name = 'fx'")
+    other.commit()
+    other.close()
+    assert db.acquire_lease("fx", "proc-2", 30)
@@ -0,0 +1,55 @@
+from pathlib import Path
+
+import dictionary_data
+from dictionary_data import build_maps, read_snapshot, write_snapshot, SNAPSHOT_MAGIC
+
+DATA = Path(__file__).resolve().parent.parent / "benchmarks" / "data"
+
+
+def test_snapshot_roundtrip(tmp_path, monkeypatch):
+    monkeypatch.setattr(dictionary_data, "DATA_DIR", DATA)
+    raw = dictionary_data.load_sources("local")
+    maps = dictionary_data.build_from_sources(raw)
+    assert maps["country_name_to_iso3"]["KAZAKHSTAN"] == "KAZ"
+
+    path = tmp_path / "dictionary.snapshot"
+    write_snapshot(maps, dictionary_data.source_version(raw), path)
+    snap = read_snapshot(path)
+    assert snap["maps"] == maps
+    assert snap["version"] == dictionary_data.source_version(raw)
+    assert snap["source"] == "local"
+
+
+def test_startup_ignores_snapshot_from_another_source(tmp_path, monkeypatch):
+    import cake_dictionary
+    path = tmp_path / "dictionary.snapshot"
+    write_snapshot(build_maps({"USD": ["$"]}, {}, {"BAKED": "USA"}), "baked", path, source="local")
+    monkeypatch.setattr(cake_dictionary, "SNAPSHOT_PATH", path)
+    monkeypatch.setattr(cake_dictionary, "load_sources", lambda: {"aliases.json": {"EUR": ["ЕВРО"]}})
+
+    monkeypatch.setattr(cake_dictionary, "source_kind", lambda: "local")
+    assert cake_dictionary._load_initial().version == "baked"
+    monkeypatch.setattr(cake_dictionary, "source_kind", lambda: "firestore")   # прод читает Firestore
+    fresh = cake_dictionary._load_initial()
+    assert fresh.version != "baked" and "BAKED" not in fresh.country_name_to_iso3
+
+
+def test_snapshot_other_format_is_ignored(tmp_path):
+    path = tmp_path / "dictionary.snapshot"
+    write_snapshot(build_maps({"USD": ["$"]}, {}, {}), "v1", path)
+    data = bytearray(path.read_bytes())
+    data[len(SNAPSHOT_MAGIC)] += 1
+    path.write_bytes(bytes(data))
+    assert read_snapshot(path) is None
+    assert read_snapshot(tmp_path / "missing") is None
+
+
+def test_load_sources_skips_firestore_for_sqlite(monkeypatch, tmp_path):
+    monkeypatch.setattr(dictionary_data, "DB_BACKEND", "sqlite")
+    monkeypatch.setattr(dictionary_data, "DATA_DIR", tmp_path)
+
+    def boom(names):
+        raise AssertionError("firestore must not be touched")
+
+    monkeypatch.setattr(dictionary_data, "_load_from_firestore", boom)
+    assert dictionary_data.load_sources() == {name: {} for name in dictionary_data.SOURCES}
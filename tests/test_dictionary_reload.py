@@ -0,0 +1,77 @@
+import json
+import threading
+
+import pytest
+
+import cake_dictionary
+import dictionary_data
+
+
+def _write(path, aliases, ccy_to_iso3, names):
+    for name, data in zip(dictionary_data.SOURCES, (aliases, ccy_to_iso3, names)):
+        (path / name).write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+
+
+@pytest.fixture
+def local_sources(tmp_path, monkeypatch):
+    monkeypatch.setattr(dictionary_data, "DB_BACKEND", "sqlite")
+    monkeypatch.setattr(dictionary_data, "DATA_DIR", tmp_path)
+    monkeypatch.setattr(cake_dictionary, "_current", cake_dictionary.current())
+    monkeypatch.setattr(cake_dictionary, "_stamps", None)
+    _write(tmp_path, {"EUR": ["ЕВРО"]}, {"EUR": "DEU"}, {"GERMANY": "DEU"})
+    cake_dictionary.reload_dictionaries(force=True)
+    return tmp_path
+
+
+def test_reload_publishes_new_version(local_sources):
+    first = cake_dictionary.current()
+    assert cake_dictionary.resolve_user_input("Germany") == ("EUR", "DEU")
+    assert cake_dictionary.resolve_user_input("Poland") == (None, None)
+
+    # без изменений — та же версия, объект не пересобирается
+    assert cake_dictionary.reload_dictionaries() is False
+    assert cake_dictionary.current() is first
+
+    _write(local_sources, {"EUR": ["ЕВРО"], "PLN": ["ЗЛОТЫЙ"]}, {"EUR": "DEU", "PLN": "POL"},
+           {"GERMANY": "DEU", "POLAND": "POL"})
+    assert cake_dictionary.reload_dictionaries() is True
+    assert cake_dictionary.current().version != first.version
+    assert cake_dictionary.resolve_user_input("Polan") == ("PLN", "POL")
+    assert cake_dictionary.COUNTRY_NAME_TO_ISO3["POLAND"] == "POL"
+    # старая версия осталась целой для тех, кто её уже держит
+    assert "POLAND" not in first.country_name_to_iso3
+
+
+def test_empty_source_keeps_previous_version(local_sources):
+    before = cake_dictionary.current()
+    _write(local_sources, {}, {}, {})
+    assert cake_dictionary.reload_dictionaries() is False
+    assert cake_dictionary.current() is before
+
+
+def test_readers_never_see_partial_maps(local_sources):
+    a = ({"EUR": ["ЕВРО"]}, {"EUR": "DEU"}, {"GERMANY": "DEU"})
+    b = ({"PLN": ["ЗЛОТЫЙ"]}, {"PLN": "POL"}, {"POLAND": "POL"})
+    stop = threading.Event()
+    bad = []
+
+    def reader():
+        while not stop.is_set():
+            d = cake_dictionary.current()
+            # внутри одной версии карты согласованы между собой
+            for name, iso3 in d.country_name_to_iso3.items():
+                if d.index.lookup(name[:4]) not in (iso3, None) or iso3 not in d.iso3_to_ccy:
+                    bad.append((d.version, name))
+
+    threads = [threading.Thread(target=reader) for _ in range(4)]
+    for t in threads:
+        t.start()
+    try:
+        for i in range(20):
+            _write(local_sources, *(a if i % 2 else b))
+            cake_dictionary.reload_dictionaries(force=True)
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+    assert not bad
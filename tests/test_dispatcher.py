@@ -0,0 +1,367 @@
+import asyncio
+import threading
+from datetime import datetime, timezone, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+import calculator
+import rate_dispatcher
+import rate_history
+from cache import MISSING
+from calculator import FXSnapshot
+
+_RATES = {"USD": 0.002, "EUR": 0.0017, "GBP": 0.0015}
+
+
+class FakeMessage:
+    def __init__(self):
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+
+
+class FakeUpdate:
+    def __init__(self):
+        self.message = FakeMessage()
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    """Хранилище снимков в памяти + счётчики чтений и обращений к FX API."""
+    state = SimpleNamespace(docs=[], reads=0, fx_calls=[], leases={})
+
+    async def fake_fetch():
+        state.fx_calls.append(1)
+        return FXSnapshot(base="KZT", rates=dict(_RATES), provider_ts=None)
+
+    def fake_latest(base="KZT", fresh=False):
+        state.reads += 1
+        return state.docs[-1] if state.docs else None
+
+    def fake_acquire(name, owner, ttl_seconds):
+        holder = state.leases.get(name)
+        if holder not in (None, owner):
+            return False
+        state.leases[name] = owner
+        return True
+
+    def fake_release(name, owner):
+        if state.leases.get(name) == owner:
+            del state.leases[name]
+
+    monkeypatch.setattr(calculator, "_fetch_snapshot", fake_fetch)
+    monkeypatch.setattr(calculator, "_snapshot", None)
+    monkeypatch.setattr(calculator, "_refresh_lock", asyncio.Lock())
+    monkeypatch.setattr(rate_dispatcher, "get_latest_snapshot", fake_latest)
+    monkeypatch.setattr(rate_dispatcher, "cache_snapshot", state.docs.append)
+    monkeypatch.setattr(rate_dispatcher, "_stored_at", None)
+    monkeypatch.setattr(rate_dispatcher, "_recorded_version", None)
+    monkeypatch.setattr(rate_dispatcher, "_refresh_task", None)
+    # индекс зарплат: пустой, загружается из «хранилища» в фоне при первом рендере
+    monkeypatch.setattr(rate_dispatcher.wage_index, "list_wage_docs", lambda: [])
+    for name in ("_index", "_series", "_loaded", "_version", "_refresh_task"):
+        monkeypatch.setattr(rate_dispatcher.wage_index, name, getattr(rate_dispatcher.wage_index, name))
+    monkeypatch.setattr(rate_dispatcher, "acquire_lease", fake_acquire)
+    monkeypatch.setattr(rate_dispatcher, "release_lease", fake_release)
+    monkeypatch.setattr(rate_dispatcher, "_lease_busy_until", 0.0)
+    monkeypatch.setattr(rate_dispatcher, "_prerendered_for", None)
+    monkeypatch.setattr(rate_dispatcher, "_prerender_task", None)
+    rate_dispatcher.response_cache.clear()
+    return state
+
+
+def _stale_doc():
+    fetched = datetime.now(timezone.utc) - timedelta(hours=30)
+    return FXSnapshot(base="KZT", rates={"EUR": 0.001665, "USD": 0.002}, provider_ts=None, fetched_at=fetched).to_doc()
+
+
+def test_snapshot_doc_roundtrip_keeps_expiry():
+    snap = FXSnapshot(base="KZT", rates=dict(_RATES), provider_ts=None)
+    again = FXSnapshot.from_doc(snap.to_doc())
+    assert again.expires_at == snap.expires_at
+    assert again.rates == snap.rates
+
+
+def test_stale_snapshot_is_served_immediately_and_refreshed_in_background(backend):
+    backend.docs.append(_stale_doc())
+
+    async def scenario():
+        update = FakeUpdate()
+        await rate_dispatcher.serve_cached_and_update(update, ccy_code="EUR", country_iso3=None)
+        assert backend.fx_calls == []  # ответ ушёл до похода в FX API
+        assert "999.00 EUR" in update.message.replies[0]
+        assert "устарел" in update.message.replies[0]
+        await rate_dispatcher._refresh_task
+
+    asyncio.run(scenario())
+    assert backend.fx_calls == [1]
+    assert backend.docs[-1]["rates"]["EUR"] == 0.0017
+
+
+def test_currency_and_usd_cost_one_store_read(backend):
+    fresh = FXSnapshot(base="KZT", rates=dict(_RATES), provider_ts=None)
+    backend.docs.append(fresh.to_doc())
+
+    update = FakeUpdate()
+    asyncio.run(rate_dispatcher.serve_cached_and_update(update, ccy_code="GBP", country_iso3="GBR"))
+    assert backend.reads == 1
+    assert backend.fx_calls == []
+    assert "900.00 GBP" in update.message.replies[0]
+
+
+def test_store_read_happens_off_the_event_loop(backend, monkeypatch):
+    backend.docs.append(FXSnapshot(base="KZT", rates=dict(_RATES), provider_ts=None).to_doc())
+    threads = []
+
+    def latest(base="KZT", fresh=False):
+        threads.append(threading.current_thread())
+        return backend.docs[-1]
+    monkeypatch.setattr(rate_dispatcher, "get_latest_snapshot", latest)
+
+    snap, stale = asyncio.run(rate_dispatcher.current_snapshot())
+    assert snap is not None and not stale
+    assert threads and threads[0] is not threading.main_thread()
+
+
+def test_prefetch_job_stores_new_snapshot_version(backend):
+    context = SimpleNamespace(job=SimpleNamespace(data=("USD", "EUR", "GBP")))
+    asyncio.run(rate_dispatcher.prefetch_popular_rates(context))
+    assert backend.fx_calls == [1]
+    assert len(backend.docs) == 1
+    assert backend.docs[0]["expires_at"] > backend.docs[0]["fetched_at"]
+
+
+def test_rendered_answers_are_reused_per_snapshot_version(backend, monkeypatch):
+    monkeypatch.setattr(rate_dispatcher, "RESPONSE_PRERENDER", False)
+    renders = []
+    real_render = rate_dispatcher.render_reply
+
+    def counting_render(*args, **kwargs):
+        renders.append(args[2:])
+        return real_render(*args, **kwargs)
+    monkeypatch.setattr(rate_dispatcher, "render_reply", counting_render)
+
+    async def scenario():
+        replies = []
+        for _ in range(3):
+            update = FakeUpdate()
+            await rate_dispatcher.serve_cached_and_update(update, ccy_code="EUR", country_iso3=None)
+            replies += update.message.replies
+        return replies
+
+    replies = asyncio.run(scenario())
+    assert len(set(replies)) == 1
+    assert renders == [("EUR", None)]
+    assert rate_dispatcher.response_cache_stats()["memory_bytes"] > 0
+
+
+def test_new_snapshot_prerenders_known_pairs_in_background(backend, monkeypatch):
+    monkeypatch.setattr(rate_dispatcher, "enqueue_wage_update", lambda *a, **k: pytest.fail("prerender queued a write"))
+    monkeypatch.setattr(rate_dispatcher.wage_index, "known_iso3", lambda: ["GBR"])
+    monkeypatch.setattr(rate_dispatcher.wage_index, "get_wage", lambda iso3: {"iso3": iso3, "value": 3000, "year": 2024})
+    monkeypatch.setattr(rate_dispatcher.wage_index, "is_loaded", lambda: True)
+    snap = FXSnapshot(base="KZT", rates=dict(_RATES), provider_ts=None)
+
+    async def scenario():
+        rate_dispatcher._schedule_prerender(snap)
+        task = rate_dispatcher._prerender_task
+        assert task is not None and not task.done()   # вызывающий не ждёт рендера
+        await task
+
+    asyncio.run(scenario())
+    key = rate_dispatcher._response_key(snap, False, "GBP", None)
+    assert rate_dispatcher.response_cache.get(key)[0].startswith("Казахский торт стоит 900.00 GBP")
+    assert rate_dispatcher.response_cache.get(rate_dispatcher._response_key(snap, False, "GBP", "GBR")) is not MISSING
+
+
+def test_refresh_starts_prerender(backend):
+    async def scenario():
+        await rate_dispatcher.refresh_snapshot(force=True)
+        assert rate_dispatcher._prerender_task is not None
+        await rate_dispatcher._prerender_task
+
+    asyncio.run(scenario())
+    assert len(rate_dispatcher.response_cache) > 0
+
+
+def test_forced_and_background_refresh_share_one_flight(backend):
+    async def scenario():
+        return await asyncio.gather(rate_dispatcher.refresh_snapshot(),
+                                    rate_dispatcher.refresh_snapshot(force=True))
+
+    plain, forced = asyncio.run(scenario())
+    assert plain is forced
+    assert backend.fx_calls == [1] and len(backend.docs) == 1
+
+
+def test_every_replica_records_history(backend, monkeypatch, tmp_path):
+    """Держатель аренды ходит в FX API, вторая реплика дочитывает хранилище — история есть у обеих."""
+    def replica(name):
+        rate_history.close()
+        monkeypatch.setattr(rate_history, "HISTORY_DB_PATH", str(tmp_path / f"{name}.db"))
+        monkeypatch.setattr(rate_dispatcher, "INSTANCE_ID", name)
+        monkeypatch.setattr(calculator, "_snapshot", None)
+        monkeypatch.setattr(rate_dispatcher, "_stored_at", None)
+        monkeypatch.setattr(rate_dispatcher, "_recorded_version", None)
+
+    def history_rows():
+        return rate_history._get_conn().execute("SELECT COUNT(*) FROM snapshots").fetchone()[0]
+
+    replica("a")
+    asyncio.run(rate_dispatcher.refresh_snapshot(force=True))
+    assert history_rows() == 1
+
+    replica("b")
+    backend.leases[rate_dispatcher.FX_LEASE] = "a"   # аренда у первой реплики
+    asyncio.run(rate_dispatcher.current_snapshot())
+    asyncio.run(rate_dispatcher.refresh_snapshot(force=True))   # та же версия от соседа — без дубля
+    assert history_rows() == 1
+    rate_history.close()
+
+    assert backend.fx_calls == [1]
+
+
+def test_prefetch_on_second_replica_adopts_fresh_store(backend, monkeypatch):
+    """Аренда свободна, но сосед только что записал снимок — второй поход в FX API не нужен."""
+    asyncio.run(rate_dispatcher.refresh_snapshot(force=True))   # реплика a: prefetch через 10 с после старта
+
+    monkeypatch.setattr(rate_dispatcher, "INSTANCE_ID", "b")
+    monkeypatch.setattr(calculator, "_snapshot", None)
+    monkeypatch.setattr(rate_dispatcher, "_stored_at", None)
+    snap = asyncio.run(rate_dispatcher.refresh_snapshot(force=True))   # реплика b: тот же prefetch
+
+    assert backend.fx_calls == [1] and len(backend.docs) == 1
+    assert snap.fetched_at == FXSnapshot.from_doc(backend.docs[0]).fetched_at
+    assert backend.leases == {}   # аренду отпустили и без похода в API
+
+
+def test_prefetch_refreshes_snapshot_older_than_half_interval(backend):
+    old = datetime.now(timezone.utc) - timedelta(hours=rate_dispatcher.FX_PREFETCH_HOURS)
+    backend.docs.append(FXSnapshot(base="KZT", rates=dict(_RATES), provider_ts=None, fetched_at=old).to_doc())
+    asyncio.run(rate_dispatcher.refresh_snapshot(force=True))
+    assert backend.fx_calls == [1] and len(backend.docs) == 2
+
+
+def test_split_compare_args():
+    assert rate_dispatcher.split_compare_args(["USD", "EUR", "gbp"]) == ["USD", "EUR", "gbp"]
+    assert rate_dispatcher.split_compare_args(["united", "states,", "евро"]) == ["united states", "евро"]
+    assert rate_dispatcher.split_compare_args([]) == []
+
+
+def test_compare_uses_one_snapshot_and_one_reply(backend):
+    update = FakeUpdate()
+    asyncio.run(rate_dispatcher.serve_compare(update, ["usd", "EUR", "евро", "Kazakhstan", "GBP", "blah"]))
+    assert len(backend.fx_calls) == 1
+    assert len(update.message.replies) == 1
+    text = update.message.replies[0]
+    assert "• 1,200.00 USD" in text and "• 1,020.00 EUR" in text and "• 900.00 GBP" in text
+    assert "• 600,000.00 KZT" in text
+    assert text.count("EUR") == 1
+    assert "Не распознано: blah" in text
+
+
+def test_inline_answers_never_wait_for_upstream(backend, monkeypatch):
+    monkeypatch.setattr(rate_dispatcher.wage_index, "_loaded", False)
+    loads = []
+
+    def storage_down():
+        loads.append(1)
+        raise RuntimeError("firestore down")
+    monkeypatch.setattr(rate_dispatcher.wage_index, "list_wage_docs", storage_down)
+    rate_dispatcher.inline_cache.clear()
+
+    async def scenario():
+        # курсов в памяти нет — пусто сразу, снимок догружается в фоне
+        assert rate_dispatcher.inline_answers("амер") == []
+        assert backend.fx_calls == []
+        await rate_dispatcher._refresh_task
+        return rate_dispatcher.inline_answers("амер"), rate_dispatcher.inline_answers("", default_ccys=("GBP", "EUR"))
+
+    answers, popular = asyncio.run(scenario())
+    assert len(backend.fx_calls) == 1
+    # без индекса зарплат страна понижается до валюты; индекс пробовали догрузить в фоне
+    assert [a["id"] for a in answers] == ["USD:-"]
+    assert loads
+    assert answers[0]["text"].startswith("Казахский торт стоит 1,200.00 USD")
+    assert [a["title"] for a in popular] == ["GBP", "EUR"]
+    hits = rate_dispatcher.inline_cache.hits
+    rate_dispatcher.inline_answers("  Амер ")
+    assert rate_dispatcher.inline_cache.hits == hits + 1
+
+
+def test_identical_requests_in_flight_share_one_computation(backend):
+    async def scenario():
+        updates = [FakeUpdate() for _ in range(20)]
+        await asyncio.gather(*(rate_dispatcher.serve_cached_and_update(u, ccy_code="EUR", country_iso3=None)
+                               for u in updates))
+        return updates
+
+    shared = rate_dispatcher.reply_flight.shared
+    updates = asyncio.run(scenario())
+    # чтения: промах in-process снимка и перечитывание под арендой (вдруг сосед уже записал)
+    assert backend.fx_calls == [1] and len(backend.docs) == 1 and backend.reads == 2
+    assert all("1,020.00 EUR" in u.message.replies[0] for u in updates)
+    assert rate_dispatcher.reply_flight.shared - shared == 19
+
+
+def test_only_lease_holder_calls_fx_others_serve_stale_and_pick_up(backend):
+    backend.docs.append(_stale_doc())
+    backend.leases[rate_dispatcher.FX_LEASE] = "other-replica"
+
+    async def scenario():
+        update = FakeUpdate()
+        await rate_dispatcher.serve_cached_and_update(update, ccy_code="EUR", country_iso3=None)
+        assert "устарел" in update.message.replies[0]
+        await rate_dispatcher._refresh_task
+        assert backend.fx_calls == []          # аренда у другой реплики — в FX API не ходим
+
+        # держатель аренды записал свежий снимок; после паузы подхватываем его из хранилища
+        backend.docs.append(FXSnapshot(base="KZT", rates=dict(_RATES), provider_ts=None).to_doc())
+        del backend.leases[rate_dispatcher.FX_LEASE]
+        rate_dispatcher._lease_busy_until = 0.0
+        update = FakeUpdate()
+        await rate_dispatcher.serve_cached_and_update(update, ccy_code="EUR", country_iso3=None)
+        if rate_dispatcher._refresh_task:
+            await rate_dispatcher._refresh_task
+        update = FakeUpdate()
+        await rate_dispatcher.serve_cached_and_update(update, ccy_code="EUR", country_iso3=None)
+        return update
+
+    update = asyncio.run(scenario())
+    assert backend.fx_calls == []
+    assert "1,020.00 EUR" in update.message.replies[0] and "устарел" not in update.message.replies[0]
+
+
+def test_cold_start_waits_for_lease_holder_snapshot(backend):
+    backend.leases[rate_dispatcher.FX_LEASE] = "other-replica"
+
+    async def peer_writes():
+        await asyncio.sleep(0.05)
+        backend.docs.append(FXSnapshot(base="KZT", rates=dict(_RATES), provider_ts=None).to_doc())
+
+    async def scenario():
+        update = FakeUpdate()
+        await asyncio.gather(peer_writes(),
+                             rate_dispatcher.serve_cached_and_update(update, ccy_code="EUR", country_iso3=None))
+        return update
+
+    update = asyncio.run(scenario())
+    assert backend.fx_calls == []
+    assert "1,020.00 EUR" in update.message.replies[0]
+
+
+def test_cold_start_fetches_itself_if_lease_holder_never_writes(backend, monkeypatch):
+    backend.leases[rate_dispatcher.FX_LEASE] = "stuck-replica"
+    monkeypatch.setattr(rate_dispatcher, "FX_LEASE_WAIT_SECONDS", 0.05)
+    update = FakeUpdate()
+    asyncio.run(rate_dispatcher.serve_cached_and_update(update, ccy_code="EUR", country_iso3=None))
+    assert backend.fx_calls == [1]
+    assert "1,020.00 EUR" in update.message.replies[0]
+
+
+def test_lease_is_released_after_refresh(backend):
+    asyncio.run(rate_dispatcher.refresh_snapshot(force=True))
+    assert backend.fx_calls == [1] and len(backend.docs) == 1
+    assert backend.leases == {}
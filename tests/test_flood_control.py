@@ -0,0 +1,52 @@
+from flood_control import DUPLICATE, LIMITED, OK, FloodGuard, TokenBucket
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_burst_then_rate():
+    clock = Clock()
+    bucket = TokenBucket(rate=2, burst=3, clock=clock)
+    assert [bucket.allow("k") for _ in range(4)] == [True, True, True, False]
+    clock.now = 0.5                      # +1 токен
+    assert bucket.allow("k") and not bucket.allow("k")
+    clock.now = 100                      # не больше burst
+    assert [bucket.allow("k") for _ in range(4)] == [True, True, True, False]
+    assert bucket.allow("other")         # у другого ключа своё ведро
+
+
+def test_token_bucket_keeps_bounded_number_of_keys():
+    bucket = TokenBucket(rate=1, burst=1, clock=Clock(), max_keys=3)
+    for k in range(10):
+        bucket.allow(k)
+    assert len(bucket) == 3
+
+
+def test_duplicate_requests_are_merged_without_spending_tokens():
+    clock = Clock()
+    guard = FloodGuard(chat_rate=1, chat_burst=2, user_rate=1, user_burst=2, duplicate_window=5, clock=clock)
+    assert guard.check(1, 10, ("USD", None)) == OK
+    assert [guard.check(1, 10, ("USD", None)) for _ in range(50)] == [DUPLICATE] * 50
+    assert guard.check(1, 10, ("EUR", None)) == OK          # ведро не потрачено повторами
+    clock.now = 6
+    assert guard.check(1, 10, ("EUR", None)) == OK          # окно прошло — снова настоящий запрос
+
+
+def test_group_flood_is_limited_per_chat_and_warned_once():
+    clock = Clock()
+    guard = FloodGuard(chat_rate=1, chat_burst=3, user_rate=1, user_burst=3, warn_every=30, clock=clock)
+    verdicts = [guard.check(-100, user, (f"C{user}", None)) for user in range(10)]
+    assert verdicts == [OK] * 3 + [LIMITED] * 7
+    assert guard.should_warn(-100) and not guard.should_warn(-100)
+    clock.now = 31
+    assert guard.should_warn(-100)
+
+
+def test_one_user_across_chats_is_limited():
+    guard = FloodGuard(chat_rate=10, chat_burst=10, user_rate=0.1, user_burst=2, clock=Clock())
+    assert [guard.check(chat, 7, ("USD", None)) for chat in range(4)] == [OK, OK, LIMITED, LIMITED]
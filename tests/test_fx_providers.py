@@ -0,0 +1,165 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+import tornado.web
+from tornado.httpserver import HTTPServer
+from tornado.testing import bind_unused_port
+
+import fx_providers
+import metrics
+from fx_providers import CircuitBreaker, FXError, Provider, configured, fetch_hedged
+
+_OPEN_ER = {"result": "success", "base_code": "KZT", "time_last_update_unix": 1754784001,
+            "rates": {"KZT": 1, "USD": 0.00185, "EUR": 0.0016}}
+_CURRENCY_API = {"date": "2025-08-10", "kzt": {"kzt": 1, "usd": 0.00186, "eur": 0.0016, "1inch": 7.5, "btc": 1e-8}}
+
+
+class _FakeFX(tornado.web.RequestHandler):
+    """mode: ok | slow | fail | flap (чередует 500 и 200)."""
+
+    def initialize(self, state: dict):
+        self.state = state
+
+    async def get(self):
+        st = self.state
+        st["hits"] += 1
+        mode = st["mode"]
+        if mode == "slow":
+            await asyncio.sleep(st.get("delay", 2.0))
+        if mode == "fail" or (mode == "flap" and st["hits"] % 2):
+            self.set_status(500)
+            return
+        self.write(st.get("body", _OPEN_ER))
+
+
+async def _server(mode: str, **extra) -> tuple[str, dict, HTTPServer]:
+    state = {"mode": mode, "hits": 0, **extra}
+    sock, port = bind_unused_port()
+    server = HTTPServer(tornado.web.Application([(r"/latest", _FakeFX, {"state": state})]))
+    server.add_sockets([sock])
+    return f"http://127.0.0.1:{port}/latest", state, server
+
+
+def _run(scenario):
+    """Поднимаем локальные HTTP-серверы и клиента в одном event loop."""
+    async def main():
+        servers = []
+
+        async def start(mode, **extra):
+            url, state, server = await _server(mode, **extra)
+            servers.append(server)
+            return url, state
+
+        async with httpx.AsyncClient(timeout=5.0) as client:
+            try:
+                return await scenario(client, start)
+            finally:
+                for s in servers:
+                    s.stop()
+
+    return asyncio.run(main())
+
+
+def test_slow_primary_is_hedged():
+    async def scenario(client, start):
+        slow_url, slow = await start("slow", delay=2.0)
+        ok_url, ok = await start("ok", body=_CURRENCY_API)
+        providers = [Provider("slow", slow_url), Provider("backup", ok_url, "currency_api")]
+        hedges = metrics.FX_HEDGES.value()
+        t0 = time.perf_counter()
+        provider, (base, rates, _) = await fetch_hedged(client, providers, hedge_after=0.05)
+        assert time.perf_counter() - t0 < 1.0
+        assert provider.name == "backup" and base == "KZT"
+        assert rates["USD"] == 0.00186 and "1INCH" not in rates and "BTC" in rates
+        assert metrics.FX_HEDGES.value() == hedges + 1
+        # проигравший отменён — это не ошибка, breaker не трогаем
+        assert providers[0].breaker.state == "closed" and providers[0].breaker.allow()
+
+    _run(scenario)
+
+
+def test_failing_primary_fails_over_without_waiting():
+    async def scenario(client, start):
+        bad_url, bad = await start("fail")
+        ok_url, ok = await start("ok")
+        providers = [Provider("bad", bad_url), Provider("good", ok_url)]
+        t0 = time.perf_counter()
+        provider, (_, rates, provider_ts) = await fetch_hedged(client, providers, hedge_after=10)
+        assert time.perf_counter() - t0 < 1.0
+        assert provider.name == "good" and rates["EUR"] == 0.0016 and provider_ts.year == 2025
+        assert bad["hits"] == 1 and ok["hits"] == 1
+
+    _run(scenario)
+
+
+def test_breaker_opens_and_recovers_through_half_open():
+    now = [0.0]
+
+    async def scenario(client, start):
+        url, state = await start("fail")
+        p = Provider("p", url, breaker=CircuitBreaker(failures=3, reset_after=30, clock=lambda: now[0]))
+        for _ in range(3):
+            with pytest.raises(FXError):
+                await fetch_hedged(client, [p])
+        assert p.breaker.state == "open"
+
+        # открыт — в сеть не ходим, ошибка сразу
+        with pytest.raises(FXError, match="open-circuit"):
+            await fetch_hedged(client, [p])
+        assert state["hits"] == 3
+
+        # half-open: одна проба; неудачная — снова open на полный срок
+        now[0] = 31
+        assert p.breaker.state == "half_open"
+        with pytest.raises(FXError):
+            await fetch_hedged(client, [p])
+        assert state["hits"] == 4 and p.breaker.state == "open"
+
+        now[0] = 62
+        state["mode"] = "ok"
+        provider, _ = await fetch_hedged(client, [p])
+        assert provider is p and p.breaker.state == "closed"
+
+    _run(scenario)
+
+
+def test_flapping_provider_does_not_trip_breaker():
+    async def scenario(client, start):
+        url, state = await start("flap")
+        backup_url, backup = await start("ok")
+        p = Provider("flap", url, breaker=CircuitBreaker(failures=3, reset_after=30))
+        providers = [p, Provider("backup", backup_url)]
+        winners = [(await fetch_hedged(client, providers, hedge_after=10))[0].name for _ in range(6)]
+        # каждый второй запрос падает, но подряд не три — провайдер остаётся в ротации
+        assert winners == ["backup", "flap"] * 3
+        assert p.breaker.state == "closed"
+
+    _run(scenario)
+
+
+def test_all_open_fails_fast():
+    def opened():
+        b = CircuitBreaker(failures=1, reset_after=60)
+        b.failure()
+        return b
+
+    providers = [Provider("a", "http://127.0.0.1:9/", breaker=opened()),
+                 Provider("b", "http://127.0.0.1:9/", breaker=opened())]
+
+    async def scenario():
+        async with httpx.AsyncClient() as client:
+            with pytest.raises(FXError, match="open-circuit"):
+                await fetch_hedged(client, providers)
+
+    asyncio.run(scenario())
+
+
+def test_configured_parses_names_and_custom_urls():
+    providers = configured("open_er_api, currency_api_mirror, mine=currency_api:http://fx.local/kzt.json, nope, x=bad:http://y")
+    assert [(p.name, p.kind) for p in providers] == [
+        ("open_er_api", "open_er_api"), ("currency_api_mirror", "currency_api"), ("mine", "currency_api")]
+    assert providers[2].url == "http://fx.local/kzt.json"
+    assert providers[0].url == fx_providers.KNOWN_PROVIDERS["open_er_api"][1]
+    assert providers[0].breaker is not providers[1].breaker
@@ -0,0 +1,123 @@
+import asyncio
+import io
+import json
+import logging
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import logs
+import metrics
+from update_processor import ChatOrderedUpdateProcessor
+
+
+@pytest.fixture
+def captured():
+    """logs.setup в StringIO; после теста снимаем обработчик и возвращаем уровень корня."""
+    root = logging.getLogger()
+    level = root.level
+    stream = io.StringIO()
+
+    def install(**kwargs):
+        logs.setup(kwargs.pop("level", "DEBUG"), kwargs.pop("fmt", "json"), stream=stream, **kwargs)
+        return stream
+
+    yield install
+    logs.shutdown()
+    root.setLevel(level)
+
+
+def _lines(stream) -> list[dict]:
+    logs.shutdown()   # дождаться, пока поток-писатель выгребет очередь
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+def test_json_lines_carry_request_context_and_extras(captured):
+    stream = captured(sample_rate=0.0)
+    update = SimpleNamespace(update_id=42, effective_chat=SimpleNamespace(id=7), effective_user=SimpleNamespace(id=9))
+    with logs.request_context(update, sample_rate=1.0):
+        rid = logs.current_context()["request_id"]
+        logging.info("hello %s", "world", extra={"ccy": "USD"})
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            logging.exception("boom")
+    logging.warning("outside")
+
+    first, second, third = _lines(stream)
+    assert first["message"] == "hello world" and first["severity"] == "INFO" and first["ccy"] == "USD"
+    assert first["request_id"] == rid and first["update_id"] == 42 and first["chat_id"] == 7 and first["user_id"] == 9
+    assert "sampled" not in first
+    assert second["request_id"] == rid and "ZeroDivisionError" in second["exception"]
+    assert third["request_id"] == "-"
+
+
+def test_debug_is_sampled_per_request(captured):
+    stream = captured(sample_rate=0.0)
+    with logs.request_context(sample_rate=0.0):
+        logging.debug("dropped")
+        logging.info("kept")
+    with logs.request_context(sample_rate=1.0):
+        logging.debug("sampled")
+    logging.debug("outside, rate 0")
+
+    assert [x["message"] for x in _lines(stream)] == ["kept", "sampled"]
+
+
+def test_emit_does_not_wait_for_slow_output(captured):
+    class SlowStream(io.StringIO):
+        def write(self, s):
+            time.sleep(0.05)
+            return super().write(s)
+
+    stream = SlowStream()
+    logs.setup("INFO", "json", stream=stream, queue_size=1000)
+    t0 = time.perf_counter()
+    for i in range(20):
+        logging.info("line %d", i)
+    assert time.perf_counter() - t0 < 0.05   # запись в поток заняла бы ≥ 1 с
+    assert len(_lines(stream)) == 20
+
+
+def test_full_queue_drops_and_counts(captured):
+    release = threading.Event()
+
+    class BlockedStream(io.StringIO):
+        def write(self, s):
+            release.wait(5)
+            return super().write(s)
+
+    stream = BlockedStream()
+    logs.setup("INFO", "json", stream=stream, queue_size=2)
+    before = metrics.LOG_DROPPED.value()
+    for i in range(10):
+        logging.info("line %d", i)
+    assert metrics.LOG_DROPPED.value() >= before + 6   # 1 у писателя + 2 в очереди, остальное — выброшено
+    release.set()
+
+
+def test_update_processor_binds_request_id(captured):
+    stream = captured(sample_rate=0.0)
+
+    async def handler(n):
+        logging.info("handled %d", n)
+
+    async def scenario():
+        processor = ChatOrderedUpdateProcessor(4)
+        updates = [SimpleNamespace(update_id=n, effective_chat=None, effective_user=None) for n in range(3)]
+        await asyncio.gather(*(processor.do_process_update(u, handler(u.update_id)) for u in updates))
+
+    asyncio.run(scenario())
+    lines = _lines(stream)
+    assert sorted(x["update_id"] for x in lines) == [0, 1, 2]
+    assert len({x["request_id"] for x in lines}) == 3
+
+
+def test_text_format(captured):
+    stream = captured(level="INFO", fmt="text")
+    with logs.bind(request_id="abc"):
+        logging.info("plain")
+    logs.shutdown()
+    assert stream.getvalue().rstrip().endswith("INFO - [abc] plain")
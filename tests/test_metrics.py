@@ -0,0 +1,43 @@
+import asyncio
+
+import metrics
+import rate_dispatcher
+from cache import LRUCache
+from tests.test_dispatcher import FakeUpdate, backend  # noqa: F401  (фикстура)
+
+
+def test_histogram_and_counter_render():
+    h = metrics.Histogram("t_seconds", "test", ("stage",), buckets=(0.1, 1.0))
+    h.observe(0.05, stage="a")
+    h.observe(0.5, stage="a")
+    h.observe(5, stage="a")
+    c = metrics.Counter("t_total", "test", ("kind",))
+    c.inc(kind='we"ird')
+    text = "\n".join(h.collect() + c.collect())
+    assert 't_seconds_bucket{stage="a",le="0.1"} 1' in text
+    assert 't_seconds_bucket{stage="a",le="1"} 2' in text
+    assert 't_seconds_bucket{stage="a",le="+Inf"} 3' in text
+    assert 't_seconds_count{stage="a"} 3' in text
+    assert 't_total{kind="we\\"ird"} 1' in text
+
+
+def test_registered_cache_is_exported():
+    cache = LRUCache("t_cache", 4, ttl=60)
+    metrics.register_cache(cache)
+    cache.get("x")
+    cache.set("x", 1)
+    cache.get("x")
+    text = metrics.render()
+    assert 'cake_cache_hits_total{cache="t_cache"} 1' in text
+    assert 'cake_cache_misses_total{cache="t_cache"} 1' in text
+    assert f'cake_cache_memory_bytes{{cache="t_cache"}} {cache.memory_bytes()}' in text
+
+
+def test_serve_records_stage_spans(backend):
+    before = {s: metrics.STAGE_SECONDS.count(stage=s) for s in ("snapshot", "render", "reply_text", "fx_fetch")}
+    update = FakeUpdate()
+    asyncio.run(rate_dispatcher.serve_cached_and_update(update, ccy_code="EUR", country_iso3=None))
+    assert update.message.replies
+    for stage in ("snapshot", "render", "reply_text"):
+        assert metrics.STAGE_SECONDS.count(stage=stage) == before[stage] + 1
+
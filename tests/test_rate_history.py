@@ -0,0 +1,66 @@
+import time
+from datetime import datetime, timezone, timedelta
+
+import pytest
+
+import rate_dispatcher
+import rate_history
+from calculator import FXSnapshot
+
+_NOW = datetime(2025, 6, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def history(tmp_path, monkeypatch):
+    rate_history.close()
+    monkeypatch.setattr(rate_history, "HISTORY_DB_PATH", str(tmp_path / "history.db"))
+    yield rate_history
+    rate_history.close()
+
+
+def _snap(days_ago: float, rates: dict) -> FXSnapshot:
+    return FXSnapshot(base="KZT", rates=rates, provider_ts=None, fetched_at=_NOW - timedelta(days=days_ago))
+
+
+def test_stats_over_window(history):
+    history.append_snapshot(_snap(40, {"USD": 0.001}))                  # вне окна
+    history.append_snapshot(_snap(20, {"USD": 0.002, "EUR": 0.0017}))
+    history.append_snapshot(_snap(10, {"EUR": 0.0018}))                 # без USD
+    history.append_snapshot(_snap(1, {"USD": 0.0025, "GBP": 0.0015}))   # новая колонка
+    assert history.append_snapshot(_snap(1, {"USD": 0.0025})) is False  # та же загрузка
+
+    stats = history.cake_price_stats("usd", 30, now=_NOW)
+    assert stats["points"] == 2
+    assert stats["min"] == pytest.approx(1200) and stats["max"] == pytest.approx(1500)
+    assert stats["mean"] == pytest.approx(1350)
+    assert stats["change"] == pytest.approx(300) and stats["change_pct"] == pytest.approx(25)
+    assert history.cake_price_stats("GBP", 30, now=_NOW)["points"] == 1
+    assert history.cake_price_stats("JPY", 30, now=_NOW) is None
+
+    # колонки переживают переоткрытие файла
+    history.close()
+    assert history.cake_price_stats("EUR", 30, now=_NOW)["points"] == 2
+
+
+def test_years_of_daily_snapshots_stay_fast(history):
+    rates = {f"C{i:02d}": 0.001 * (i + 1) for i in range(160)}
+    for day in range(5 * 365):
+        history.append_snapshot(_snap(day, {**rates, "USD": 0.002 + day * 1e-6}))
+    t0 = time.perf_counter()
+    stats = history.cake_price_stats("USD", 5 * 365, now=_NOW)
+    assert stats["points"] == 5 * 365
+    assert time.perf_counter() - t0 < 0.5
+
+
+@pytest.mark.parametrize("args, expected", [
+    (["USD", "30d"], ("USD", 30)),
+    (["евро", "2w"], ("EUR", 14)),
+    (["Kazakhstan", "1y"], ("KZT", 365)),
+    (["gbp"], ("GBP", 30)),
+    (["USD", "7"], ("USD", 7)),
+    ([], (None, None)),
+    (["USD", "5q"], (None, None)),
+    (["USD", "100y"], (None, None)),
+])
+def test_parse_history_args(args, expected):
+    assert rate_dispatcher.parse_history_args(args) == expected
@@ -0,0 +1,57 @@
+import asyncio
+
+from telegram import Chat, Message, Update
+
+from update_processor import ChatOrderedUpdateProcessor
+
+
+def _update(update_id: int, chat_id: int) -> Update:
+    chat = Chat(id=chat_id, type="private")
+    return Update(update_id=update_id, message=Message(message_id=update_id, date=None, chat=chat))
+
+
+async def _feed(processor, updates, handler):
+    # как Application: на каждый апдейт — отдельная задача
+    async with processor:
+        await asyncio.gather(*(processor.process_update(u, handler(u)) for u in updates))
+
+
+def test_same_chat_is_processed_in_order_while_chats_run_in_parallel():
+    seen: dict[int, list[int]] = {}
+    running = peak = 0
+
+    async def handler(update):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01 if update.update_id % 2 else 0.001)
+        seen.setdefault(update.effective_chat.id, []).append(update.update_id)
+        running -= 1
+
+    updates = [_update(i, chat_id=i % 5) for i in range(50)]
+    asyncio.run(_feed(ChatOrderedUpdateProcessor(max_running=4), updates, handler))
+
+    for chat_id, ids in seen.items():
+        assert ids == sorted(ids)
+    assert 1 < peak <= 4
+
+
+def test_flooding_chat_does_not_hold_slots_of_others():
+    order = []
+
+    async def handler(update):
+        await asyncio.sleep(0.02 if update.effective_chat.id == 1 else 0)
+        order.append(update.effective_chat.id)
+
+    updates = [_update(i, chat_id=1) for i in range(5)] + [_update(100, chat_id=2)]
+    asyncio.run(_feed(ChatOrderedUpdateProcessor(max_running=2), updates, handler))
+    assert order.index(2) < 2
+
+
+def test_inline_queries_are_not_serialized_per_user():
+    from telegram import InlineQuery, User
+    from update_processor import _order_key
+
+    user = User(id=5, first_name="u", is_bot=False)
+    update = Update(update_id=1, inline_query=InlineQuery(id="1", from_user=user, query="амер", offset=""))
+    assert _order_key(update) is None
@@ -0,0 +1,117 @@
+import asyncio
+from datetime import datetime, timezone, timedelta
+
+import pytest
+
+import calculator
+import rate_dispatcher
+import wage_index
+from benchmarks.fakes import FakeUpdate
+from calculator import FXSnapshot
+
+YEAR = 2024
+_DOCS = [
+    {"iso3": "DEU", "country": "Germany", "value": 4800, "source": {"year": YEAR - 1}},
+    {"iso3": "DEU", "country": "Germany", "value": 5000, "source": {"year": YEAR}},
+    {"iso3": "deu", "country": "Germany", "value": 5200, "source": {"year": YEAR + 1}},
+    {"iso3": "POL", "country": "Poland", "value": 1900},
+    {"country": "Nowhere", "value": 1},
+]
+
+
+@pytest.fixture
+def loaded(monkeypatch):
+    monkeypatch.setattr(wage_index, "list_wage_docs", lambda: _DOCS)
+    monkeypatch.setattr(wage_index, "_index", wage_index._EMPTY)
+    monkeypatch.setattr(wage_index, "_loaded", False)
+    asyncio.run(wage_index.refresh_wage_index())
+    return wage_index
+
+
+def test_index_takes_latest_year(loaded):
+    assert loaded.is_loaded()
+    assert loaded.get_wage("deu")["value"] == 5200
+    assert loaded.get_wage("POL")["country"] == "Poland"
+    assert loaded.get_wage("XXX") is None
+
+
+def test_index_prefers_configured_year(monkeypatch):
+    monkeypatch.setattr(wage_index, "UNECE_YEAR", YEAR)
+    assert wage_index.build_index(_DOCS)["DEU"]["value"] == 5000
+
+
+def test_series_hold_all_years_in_arrays(loaded):
+    deu = loaded.get_series("deu")
+    assert list(deu.years) == [YEAR - 1, YEAR, YEAR + 1] and list(deu.salaries) == [4800, 5000, 5200]
+    assert deu.years.typecode == "H" and deu.salaries.typecode == "d"
+    assert list(deu.per_cake(1000.0)) == pytest.approx([4.8, 5.0, 5.2])
+    assert loaded.get_series("POL") is None      # без года в ряд не попадает
+
+
+def test_index_is_immutable(loaded):
+    with pytest.raises(TypeError):
+        loaded._index["USA"] = {}
+    with pytest.raises(TypeError):
+        loaded.get_wage("DEU")["value"] = 1
+
+
+def test_failed_refresh_keeps_previous_index(loaded, monkeypatch):
+    def broken():
+        raise RuntimeError("firestore down")
+    monkeypatch.setattr(wage_index, "list_wage_docs", broken)
+    asyncio.run(wage_index.refresh_wage_index())
+    assert loaded.get_wage("POL") is not None
+
+
+def test_salary_lookup_does_not_touch_storage(loaded, monkeypatch):
+    monkeypatch.setattr(rate_dispatcher, "enqueue_wage_update", lambda *a, **k: True)
+
+    calc = rate_dispatcher.append_salary_iso3("DEU", 1200.0)
+    assert calc["country"] == "Germany" and calc["year"] == YEAR + 1
+    assert calc["cake_salary"] == pytest.approx(5200 / 1200.0)
+
+
+def test_unloaded_index_is_loaded_in_background_not_during_render(monkeypatch):
+    monkeypatch.setattr(wage_index, "list_wage_docs", lambda: _DOCS)
+    monkeypatch.setattr(wage_index, "_index", wage_index._EMPTY)
+    monkeypatch.setattr(wage_index, "_loaded", False)
+    monkeypatch.setattr(wage_index, "_refresh_task", None)
+    monkeypatch.setattr(rate_dispatcher, "enqueue_wage_update", lambda *a, **k: True)
+
+    async def scenario():
+        assert rate_dispatcher.append_salary_iso3("DEU", 1200.0) is None   # без зарплаты, но сразу
+        await wage_index._refresh_task
+        return rate_dispatcher.append_salary_iso3("DEU", 1200.0)
+
+    assert asyncio.run(scenario())["country"] == "Germany"
+
+
+def test_trend_is_computed_from_memory(loaded):
+    trend = rate_dispatcher.cake_trend("DEU", 1000.0)
+    assert list(trend["years"]) == [YEAR - 1, YEAR, YEAR + 1]
+    assert trend["change_pct"] == pytest.approx(100 * (5200 / 4800 - 1))
+    text = rate_dispatcher.render_trend(trend, "Germany")
+    assert "▁▅█" in text and f"• {YEAR}: 5.00" in text and "+8.3%" in text
+    assert rate_dispatcher.cake_trend("POL", 1000.0) is None
+    assert "нет" in rate_dispatcher.render_trend(None, "Poland")
+
+
+def test_trend_command_replies_from_memory(loaded, monkeypatch):
+    # торт = 1200 USD; снимок устарел — всё равно отвечаем из памяти, обновление — в фоне
+    stale = FXSnapshot(base="KZT", rates={"USD": 0.002}, provider_ts=None,
+                       fetched_at=datetime.now(timezone.utc) - timedelta(days=2))
+    monkeypatch.setattr(calculator, "_snapshot", stale)
+    refreshes = []
+    monkeypatch.setattr(rate_dispatcher, "_schedule_refresh", lambda: refreshes.append(1))
+    monkeypatch.setattr(rate_dispatcher, "get_latest_snapshot", lambda *a, **k: pytest.fail("storage read"))
+
+    async def scenario():
+        update, usage = FakeUpdate(), FakeUpdate()
+        await rate_dispatcher.serve_trend(update, ["Германия"])
+        await rate_dispatcher.serve_trend(usage, [])
+        return update.message.replies, usage.message.replies
+
+    replies, usage = asyncio.run(scenario())
+    assert "Germany" in replies[0] and f"• {YEAR + 1}: {5200 / 1200:,.2f}" in replies[0]
+    assert usage == ["Пример: /trend Германия"]
+    assert refreshes == [1]
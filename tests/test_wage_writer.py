@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+import wage_writer
+
+
+@pytest.fixture
+def writer(monkeypatch):
+    batches = []
+    monkeypatch.setattr(wage_writer, "upsert_wage_docs", lambda updates, *a: batches.append(dict(updates)))
+    monkeypatch.setattr(wage_writer, "_pending", {})
+    monkeypatch.setattr(wage_writer, "_last_written", {})
+    return batches
+
+
+def test_updates_are_coalesced_per_iso3(writer):
+    wage_writer.enqueue_wage_update("deu", {"salary_kzt": 100.0, "cake_salary": 1.0}, year=2024)
+    wage_writer.enqueue_wage_update("DEU", {"salary_kzt": 110.0, "cake_salary": 1.1}, year=2024)
+    wage_writer.enqueue_wage_update("POL", {"salary_kzt": 50.0, "cake_salary": 0.5}, year=2024)
+    assert wage_writer.flush_wage_updates() == 2
+    assert writer == [{"DEU": {"salary_kzt": 110.0, "cake_salary": 1.1}, "POL": {"salary_kzt": 50.0, "cake_salary": 0.5}}]
+
+
+def test_unchanged_values_are_skipped(writer):
+    assert not wage_writer.enqueue_wage_update("DEU", {"salary_kzt": 100.0, "cake_salary": 1.0, "updated_at": "x"},
+                                               current={"salary_kzt": 100.0004, "cake_salary": 1.0, "year": 2024})
+    assert wage_writer.enqueue_wage_update("POL", {"salary_kzt": 50.0, "cake_salary": 0.5, "updated_at": "a"}, year=2024)
+    wage_writer.flush_wage_updates()
+    assert not wage_writer.enqueue_wage_update("POL", {"salary_kzt": 50.0, "cake_salary": 0.5, "updated_at": "b"}, year=2024)
+    assert wage_writer.flush_wage_updates() == 0
+    assert len(writer) == 1
+
+
+def test_failed_flush_requeues_and_drain_writes(writer, monkeypatch):
+    def broken(updates, *a):
+        raise RuntimeError("firestore down")
+    monkeypatch.setattr(wage_writer, "upsert_wage_docs", broken)
+    wage_writer.enqueue_wage_update("DEU", {"salary_kzt": 100.0, "cake_salary": 1.0}, year=2024)
+    asyncio.run(wage_writer.flush_job())
+    assert wage_writer.pending_count() == 1
+
+    monkeypatch.setattr(wage_writer, "upsert_wage_docs", lambda updates, *a: writer.append(dict(updates)))
+    asyncio.run(wage_writer.drain())
+    assert wage_writer.pending_count() == 0
+    assert list(writer[0]) == ["DEU"]
+
+
+def test_flush_writes_one_batch_per_document_year(writer, monkeypatch):
+    calls = []
+    monkeypatch.setattr(wage_writer, "upsert_wage_docs", lambda updates, year, *a: calls.append((year, sorted(updates))))
+    wage_writer.enqueue_wage_update("DEU", {"cake_salary": 1.0}, current={"source": {"year": 2023}})
+    wage_writer.enqueue_wage_update("POL", {"cake_salary": 2.0}, current={"year": 2024})
+    wage_writer.enqueue_wage_update("USA", {"cake_salary": 3.0}, year=2024)
+    assert not wage_writer.enqueue_wage_update("ITA", {"cake_salary": 4.0})   # год неизвестен — некуда писать
+    assert wage_writer.flush_wage_updates() == 3
+    assert calls == [(2023, ["DEU"]), (2024, ["POL", "USA"])]
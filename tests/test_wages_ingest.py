@@ -0,0 +1,79 @@
+import json
+
+import pytest
+
+import wages_ingest
+from tests.test_db_sqlite import sqlite_db  # noqa: F401  (фикстура)
+
+_CSV = """Country,Year,Value,Unit
+Kazakhstan,2023,850.5,USD
+Россия,2023,"1 020,4",USD
+Atlantis,2023,100,USD
+KAZ,2024,900,USD
+Kazakhstan,19xx,1,USD
+Ukraine,2023,-5,USD
+Belarus,2023,700,EUR
+"""
+
+
+def test_csv_rows_are_validated_against_dictionary(tmp_path):
+    path = tmp_path / "unece.csv"
+    path.write_text(_CSV, encoding="utf-8")
+    docs = []
+    report = wages_ingest.ingest(wages_ingest.iter_rows(path), write=lambda batch: docs.extend(batch) or len(batch))
+
+    assert (report.rows, report.invalid, report.written) == (7, 4, 3)
+    assert [(d["iso3"], d["year"], d["value"]) for d in docs] == [("KAZ", 2023, 850.5), ("RUS", 2023, 1020.4),
+                                                                  ("KAZ", 2024, 900.0)]
+    assert "Atlantis" in report.errors[0] and "EUR" in report.errors[-1]
+    # название для карточки — из выгрузки, не нормализованный ключ словаря; у кода — не пишем
+    assert [d.get("country") for d in docs] == ["Kazakhstan", "Россия", None]
+
+
+def test_json_array_and_lines_are_streamed(tmp_path):
+    rows = [{"ref_area": "KAZ", "time_period": str(2000 + i), "obs_value": 100 + i} for i in range(50)]
+    (tmp_path / "a.json").write_text(json.dumps(rows, indent=1), encoding="utf-8")
+    (tmp_path / "b.jsonl").write_text("\n".join(json.dumps(r) for r in rows), encoding="utf-8")
+    for name in ("a.json", "b.jsonl"):
+        with open(tmp_path / name, encoding="utf-8") as fp:
+            assert list(wages_ingest._iter_json(fp, chunk_size=7)) == rows   # объекты режутся на границах чтения
+
+
+def test_chunks_dedupe_and_derived_fields():
+    rows = [{"country": "KAZ", "year": 2023, "value": v} for v in (100, 200)] + \
+           [{"country": "RUS", "year": y, "value": 300} for y in range(2001, 2006)]
+    batches = []
+    report = wages_ingest.ingest(rows, write=lambda b: batches.append(b) or len(b), kzt_per_usd=500, chunk=2)
+
+    assert [len(b) for b in batches] == [2, 2, 2]
+    assert batches[0][0]["value"] == 200                       # дубль ISO3_YYYY_UNIT — побеждает последний
+    assert batches[0][0]["salary_kzt"] == pytest.approx(100_000)
+    assert report.written == 6
+
+
+def test_ingest_and_legacy_migration_in_sqlite(tmp_path, sqlite_db):
+    db = sqlite_db(tmp_path / "wages.db")
+    rows = [{"country": "Kazakhstan", "year": 2023, "value": 850}, {"country": "Russia", "year": 2023, "value": 1000}]
+    assert wages_ingest.ingest(rows, write=db.put_wage_docs).written == 2
+
+    conn = db._get_conn()
+    conn.execute("INSERT INTO avg_wages_unece VALUES ('UKRAINE_2023_USD', 'UKR', 2023, 'USD', ?)",
+                 (json.dumps({"iso3": "UKR", "value": 500, "country": "Ukraine"}),))
+    db.upsert_wage_doc("UKR", {"cake_salary": 12.5}, 2023, "USD")   # write-behind уже пишет под каноническим ID
+
+    assert db.migrate_legacy_wage_ids() == 1
+    assert db.migrate_legacy_wage_ids() == 0
+    ids = sorted(r[0] for r in conn.execute("SELECT doc_id FROM avg_wages_unece"))
+    assert ids == ["KAZ_2023_USD", "RUS_2023_USD", "UKR_2023_USD"]
+    ukr = next(d for d in db.list_wage_docs() if d["iso3"] == "UKR")
+    assert ukr["value"] == 500 and ukr["cake_salary"] == 12.5
+
+
+def test_cli_dry_run_does_not_write(tmp_path, capsys, monkeypatch):
+    import db
+    path = tmp_path / "unece.csv"
+    path.write_text(_CSV, encoding="utf-8")
+    monkeypatch.setattr(db, "put_wage_docs", lambda docs: pytest.fail("dry run wrote"))
+    assert wages_ingest.main([str(path), "--dry-run", "--no-derived"]) == 0
+    assert wages_ingest.main([str(path), "--dry-run", "--no-derived", "--strict"]) == 1
+    assert "invalid: 4" in capsys.readouterr().out
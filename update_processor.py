@@ -0,0 +1,78 @@
+# update_processor.py — параллельная обработка апдейтов с сохранением порядка внутри чата
+import asyncio
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+import logs
+
+
+def _order_key(update: object):
+    """
+    Апдейты одного чата (или одного юзера, если чата нет) идут строго по очереди.
+    Inline-запросы независимы (каждое нажатие — новый запрос) — их не упорядочиваем,
+    иначе устаревшие нажатия задерживали бы свежие.
+    """
+    if isinstance(update, Update):
+        if update.inline_query:
+            return None
+        if update.effective_chat:
+            return ("chat", update.effective_chat.id)
+        if update.effective_user:
+            return ("user", update.effective_user.id)
+    return None
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Одновременно выполняется не больше max_running апдейтов, при этом апдейты
+    одного чата обрабатываются последовательно в порядке поступления.
+
+    Порядок захвата: сначала лок чата, потом общий слот — так чат, заспамивший
+    бота, ждёт свою очередь, не занимая слоты других чатов. Семафор базового
+    класса (max_pending) ограничивает общее число апдейтов в работе и ожидании:
+    сверх него новые апдейты ждут ещё до захвата лока (backpressure).
+    """
+
+    __slots__ = ("_max_running", "_running", "_chat_locks")
+
+    def __init__(self, max_running: int, max_pending: int | None = None):
+        if max_running < 1:
+            raise ValueError("`max_running` must be a positive integer!")
+        super().__init__(max(max_pending or max_running * 8, max_running))
+        self._max_running = max_running
+        self._running = asyncio.BoundedSemaphore(max_running)
+        self._chat_locks: dict[object, list] = {}  # key -> [Lock, число ожидающих]
+
+    @property
+    def max_running(self) -> int:
+        return self._max_running
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        # coroutine выполняется в контексте этой задачи — все логи апдейта получат его request_id
+        with logs.request_context(update):
+            await self._process_ordered(update, coroutine)
+
+    async def _process_ordered(self, update: object, coroutine) -> None:
+        key = _order_key(update)
+        if key is None:
+            async with self._running:
+                await coroutine
+            return
+
+        entry = self._chat_locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self._running:
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                # никого не осталось — не копим локи по всем чатам, что когда-то писали
+                self._chat_locks.pop(key, None)
+
+    async def initialize(self) -> None:
+        """Нечего инициализировать."""
+
+    async def shutdown(self) -> None:
+        """Нечего освобождать: незавершённые апдейты дожидается сам Application."""
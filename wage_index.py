@@ -0,0 +1,139 @@
+# wage_index.py — вся коллекция зарплат в памяти: ISO3 -> документ основного года
+# и ISO3 -> ряд по всем годам (компактные array для /trend).
+# Загружается один раз при старте и перечитывается фоном (JobQueue).
+# Индекс неизменяемый: обновление строит новый и подменяет ссылку целиком.
+import asyncio
+import logging
+from array import array
+from types import MappingProxyType
+from typing import Mapping
+from config import UNECE_YEAR
+from db import list_wage_docs
+
+_EMPTY: Mapping = MappingProxyType({})
+
+_index: Mapping[str, Mapping] = _EMPTY
+_series: Mapping[str, "WageSeries"] = _EMPTY
+_loaded = False
+_version = 0   # растёт с каждой загрузкой — часть ключа кеша ответов
+_refresh_task: asyncio.Task | None = None
+
+def doc_year(doc: dict) -> int | None:
+    year = doc.get("year") or (doc.get("source") or {}).get("year")
+    try:
+        return int(year)
+    except (TypeError, ValueError):
+        return None
+
+def _salary(doc: Mapping):
+    return doc.get("salary_usd", doc.get("value"))
+
+def _valid_docs(docs):
+    """(ISO3, документ) для документов с зарплатой."""
+    for doc in docs:
+        iso3 = str(doc.get("iso3") or "").strip().upper()
+        if len(iso3) != 3:
+            continue
+        if _salary(doc) is None:
+            continue   # только производные поля от write-behind — зарплаты в документе нет
+        yield iso3, doc
+
+def build_index(docs) -> Mapping[str, Mapping]:
+    """ISO3 -> документ; при нескольких годах берём UNECE_YEAR (если задан), иначе самый свежий."""
+    best: dict[str, dict] = {}
+    for iso3, doc in _valid_docs(docs):
+        cur = best.get(iso3)
+        if cur is None:
+            best[iso3] = doc
+            continue
+        year, cur_year = doc_year(doc), doc_year(cur)
+        if UNECE_YEAR and cur_year == UNECE_YEAR:
+            continue
+        if (UNECE_YEAR and year == UNECE_YEAR) or (year or 0) > (cur_year or 0):
+            best[iso3] = doc
+    return MappingProxyType({iso3: MappingProxyType(dict(doc)) for iso3, doc in best.items()})
+
+# ───────────────────────────────
+# РЯДЫ ПО ГОДАМ
+
+class WageSeries:
+    """Все годы одной страны: годы и зарплаты — параллельные array по возрастанию года."""
+    __slots__ = ("iso3", "years", "salaries")
+
+    def __init__(self, iso3: str, years: array, salaries: array):
+        self.iso3 = iso3
+        self.years = years          # array("H")
+        self.salaries = salaries    # array("d"), в UNECE_UNIT
+
+    def __len__(self) -> int:
+        return len(self.years)
+
+    def per_cake(self, cake_price: float) -> array:
+        """Зарплата в тортах за каждый год: одно умножение по всему массиву (map на C, без цикла в Python)."""
+        return array("d", map((1.0 / cake_price).__mul__, self.salaries))
+
+def build_series(docs) -> Mapping[str, WageSeries]:
+    """ISO3 -> WageSeries; документы без года в ряд не попадают, дубль года — побеждает последний."""
+    by_iso3: dict[str, dict[int, float]] = {}
+    for iso3, doc in _valid_docs(docs):
+        year = doc_year(doc)
+        try:
+            salary = float(_salary(doc))
+        except (TypeError, ValueError):
+            continue
+        if year is not None:
+            by_iso3.setdefault(iso3, {})[year] = salary
+    series = {}
+    for iso3, points in by_iso3.items():
+        years = sorted(points)
+        series[iso3] = WageSeries(iso3, array("H", years), array("d", (points[y] for y in years)))
+    return MappingProxyType(series)
+
+# ───────────────────────────────
+
+def load_wage_index() -> int:
+    """Перечитываем коллекцию и атомарно подменяем индекс и ряды. Возвращает число стран."""
+    global _index, _series, _loaded, _version
+    docs = list_wage_docs()
+    index, series = build_index(docs), build_series(docs)
+    _index, _series = index, series
+    _loaded = True
+    _version += 1
+    logging.info("wage index loaded: %d countries, %d yearly points", len(index), sum(map(len, series.values())))
+    return len(index)
+
+def get_wage(iso3: str) -> Mapping | None:
+    return _index.get((iso3 or "").strip().upper())
+
+def get_series(iso3: str) -> WageSeries | None:
+    return _series.get((iso3 or "").strip().upper())
+
+def is_loaded() -> bool:
+    return _loaded
+
+def version() -> int:
+    return _version
+
+def known_iso3() -> list[str]:
+    return list(_index)
+
+async def refresh_wage_index(context=None) -> None:
+    """Job для PTB JobQueue (и для post_init): читаем хранилище вне event loop."""
+    try:
+        await asyncio.to_thread(load_wage_index)
+    except Exception as e:
+        logging.warning("wage index refresh failed (keeping %d countries): %s", len(_index), e)
+
+def schedule_refresh() -> None:
+    """
+    Индекс не загрузился на старте (хранилище лежало) — догружаем в фоне, не дожидаясь;
+    пока одна загрузка в полёте, новые не стартуем. Вне event loop — ничего не делаем.
+    """
+    global _refresh_task
+    if _refresh_task is not None and not _refresh_task.done():
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    _refresh_task = loop.create_task(refresh_wage_index())
@@ -0,0 +1,90 @@
+# wage_writer.py — write-behind для производных полей зарплаты (salary_kzt / cake_salary)
+# Ответ пользователю не ждёт записи: апдейты копятся по ISO3 (последний побеждает),
+# неизменившиеся значения отбрасываются, раз в WAGE_FLUSH_SECONDS всё уходит batch-ем (по одному на год документа).
+import asyncio
+import logging
+import threading
+from typing import Mapping
+from config import UNECE_UNIT
+from db import upsert_wage_docs
+import metrics
+from wage_index import doc_year
+
+_TRACKED = ("salary_kzt", "cake_salary")
+
+_pending: dict[str, tuple[int, dict]] = {}            # iso3 -> (год документа, patch)
+_last_written: dict[tuple[str, int], tuple] = {}      # (iso3, год) -> значения _TRACKED, уже лежащие в хранилище
+_lock = threading.Lock()
+
+def _signature(values: Mapping) -> tuple:
+    # сравниваем с точностью до копейки/сотой торта: шум float не повод писать
+    return tuple(round(float(values[k]), 2) if values.get(k) is not None else None for k in _TRACKED)
+
+def enqueue_wage_update(iso3: str, patch: dict, current: Mapping | None = None, year: int | None = None) -> bool:
+    """
+    Ставим патч в очередь. current — документ, который уже лежит в хранилище
+    (например, из wage_index): если значения совпадают, писать нечего.
+    year — год документа (по умолчанию из current); без года не знаем, куда писать.
+    Возвращает True, если патч реально поставлен в очередь.
+    """
+    iso3 = (iso3 or "").strip().upper()
+    year = year or (doc_year(current) if current is not None else None)
+    if year is None:
+        logging.debug("wage write-behind: no year, skipped", extra={"iso3": iso3})
+        return False
+    sig = _signature(patch)
+    with _lock:
+        known = _last_written.get((iso3, year))
+        if known is None and current is not None:
+            known = _signature(current)
+        if sig == known:
+            _pending.pop(iso3, None)
+            return False
+        _pending[iso3] = (year, dict(patch))
+        return True
+
+def pending_count() -> int:
+    return len(_pending)
+
+def flush_wage_updates() -> int:
+    """Синхронно сбрасываем очередь: один batch на год; при ошибке возвращаем апдейты обратно."""
+    global _pending
+    with _lock:
+        batch, _pending = _pending, {}
+    if not batch:
+        return 0
+    by_year: dict[int, dict[str, dict]] = {}
+    for iso3, (year, patch) in batch.items():
+        by_year.setdefault(year, {})[iso3] = patch
+    written = 0
+    for year, updates in sorted(by_year.items()):
+        try:
+            with metrics.span("wage_upsert"):
+                upsert_wage_docs(updates, year, UNECE_UNIT)
+        except Exception:
+            with _lock:
+                # то, что успело прийти новее, не затираем; уже записанные годы не повторяем
+                for y, failed in by_year.items():
+                    if y >= year:
+                        for iso3, patch in failed.items():
+                            _pending.setdefault(iso3, (y, patch))
+            raise
+        with _lock:
+            for iso3, patch in updates.items():
+                _last_written[(iso3, year)] = _signature(patch)
+        written += len(updates)
+    return written
+
+async def flush_job(context=None) -> None:
+    """Job для PTB JobQueue: пишем вне event loop."""
+    try:
+        n = await asyncio.to_thread(flush_wage_updates)
+        if n:
+            logging.info("wage write-behind: flushed %d docs", n)
+    except Exception as e:
+        logging.warning("wage write-behind flush failed (%d pending): %s", pending_count(), e)
+
+async def drain() -> None:
+    """На остановке: дописываем всё, что осталось в очереди."""
+    if pending_count():
+        await flush_job()
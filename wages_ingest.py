@@ -0,0 +1,241 @@
+# wages_ingest.py — загрузка выгрузки UNECE (средние зарплаты) в avg_wages_unece
+#
+#   python wages_ingest.py export.csv [--chunk 500] [--kzt-per-usd 480] [--dry-run] [--strict]
+#   python wages_ingest.py export.json          # JSON-массив объектов или JSON Lines
+#   python wages_ingest.py --migrate-legacy     # разовый перенос NAME_YYYY_UNIT → ISO3_YYYY_UNIT
+#
+# Файл читается потоком: в памяти только текущая пачка документов. Страна проверяется
+# по COUNTRY_NAME_TO_ISO3 (точное совпадение, без опечаточного поиска) или задаётся ISO3.
+# Производные поля (salary_kzt, cake_salary) считаются здесь один раз по одному курсу;
+# запись — batch-коммитами под каноническим ID ISO3_YYYY_UNIT.
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import math
+import sys
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterable, Iterator
+
+import cake_dictionary
+from calculator import compute_cake_salary
+from config import UNECE_UNIT
+from dictionary_data import norm_country
+
+SOURCE_URL = "https://w3.unece.org/PXWeb/en"
+MIN_YEAR = 1990
+
+# названия столбцов/полей в выгрузках UNECE (PXWeb CSV, SDMX-JSON в плоском виде, ручные таблицы)
+_COLUMNS = {
+    "country": ("country", "ref_area", "reference area", "geo", "iso3"),
+    "year": ("year", "time", "time_period"),
+    "value": ("value", "obs_value"),
+    "unit": ("unit", "unit_measure", "currency"),
+}
+
+
+class RowError(ValueError):
+    pass
+
+
+# ───────────────────────────────
+# ЧТЕНИЕ
+
+def _iter_csv(fp) -> Iterator[dict]:
+    yield from csv.DictReader(fp)
+
+def _iter_json(fp, chunk_size: int = 1 << 16) -> Iterator[dict]:
+    """Объекты из JSON-массива или JSON Lines по мере чтения, без загрузки файла целиком."""
+    decoder = json.JSONDecoder()
+    buf, pos, eof = "", 0, False
+    while True:
+        # пропускаем разделители между объектами
+        while pos < len(buf) and (buf[pos].isspace() or buf[pos] in "[],"):
+            pos += 1
+        if pos == len(buf):
+            if eof:
+                return
+            buf, pos = fp.read(chunk_size), 0
+            eof = not buf
+            continue
+        try:
+            obj, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            more = fp.read(chunk_size)
+            eof = not more
+            buf, pos = buf[pos:] + more, 0
+            continue
+        pos = end
+        yield obj
+
+def iter_rows(path: str | Path, fmt: str | None = None) -> Iterator[dict]:
+    path = Path(path)
+    fmt = fmt or ("csv" if path.suffix.lower() == ".csv" else "json")
+    with open(path, encoding="utf-8-sig", newline="") as fp:
+        yield from (_iter_csv(fp) if fmt == "csv" else _iter_json(fp))
+
+
+# ───────────────────────────────
+# ПРОВЕРКА И ПРОИЗВОДНЫЕ ПОЛЯ
+
+def _field(row: dict, name: str):
+    for key in _COLUMNS[name]:
+        value = row.get(key)
+        if value not in (None, ""):
+            return value
+    return None
+
+def resolve_iso3(country) -> str | None:
+    d = cake_dictionary.current()
+    raw = str(country or "").strip()
+    if len(raw) == 3 and raw.upper() in d.iso3_to_name:
+        return raw.upper()
+    return d.country_name_to_iso3.get(norm_country(raw))
+
+def validate_row(row: dict, unit: str = UNECE_UNIT, max_year: int | None = None) -> dict:
+    """Строка выгрузки → документ без производных полей; RowError, если строка негодная."""
+    row = {str(k).strip().lower(): v for k, v in row.items()}
+    country = _field(row, "country")
+    iso3 = resolve_iso3(country)
+    if iso3 is None:
+        raise RowError(f"unknown country {country!r}")
+
+    max_year = max_year or datetime.now(timezone.utc).year
+    try:
+        year = int(str(_field(row, "year") or "").strip()[:4])
+    except ValueError:
+        raise RowError(f"bad year {_field(row, 'year')!r}") from None
+    if not MIN_YEAR <= year <= max_year:
+        raise RowError(f"year {year} out of range")
+
+    try:
+        value = float(str(_field(row, "value") or "").replace(" ", "").replace(",", "."))
+    except ValueError:
+        raise RowError(f"bad value {_field(row, 'value')!r}") from None
+    if not math.isfinite(value) or value <= 0:
+        raise RowError(f"bad value {value}")
+
+    row_unit = str(_field(row, "unit") or unit).strip().upper()
+    if row_unit != unit.upper():
+        # дальше по коду зарплата везде считается в USD — чужие единицы не смешиваем
+        raise RowError(f"unit {row_unit} != {unit.upper()}")
+
+    doc = {
+        "iso3": iso3,
+        "year": year,
+        "unit": row_unit,
+        "value": value,
+        "source": {"name": "UNECE", "year": year, "url": SOURCE_URL},
+    }
+    # название для карточки — как в выгрузке; ключи словаря (iso3_to_name) нормализованы
+    # в верхний регистр и для показа не годятся. Вместо названия код — поле не трогаем (merge)
+    name = str(country).strip()
+    if name.upper() != iso3:
+        doc["country"] = name
+    return doc
+
+def with_derived(doc: dict, kzt_per_usd: float | None) -> dict:
+    if kzt_per_usd is None:
+        return doc   # без курса: salary_kzt / cake_salary допишет write-behind при первом запросе
+    calc = compute_cake_salary(doc["value"], kzt_per_usd=kzt_per_usd)
+    return {**doc, **calc}
+
+async def _fetch_kzt_per_usd() -> float | None:
+    from calculator import get_fx_snapshot
+    try:
+        rate = (await get_fx_snapshot()).rate("USD")   # USD за 1 KZT
+    except Exception as e:
+        logging.warning("FX unavailable, derived fields skipped: %s", e)
+        return None
+    return 1 / rate if rate else None
+
+
+# ───────────────────────────────
+# ЗАГРУЗКА
+
+@dataclass
+class IngestReport:
+    rows: int = 0
+    written: int = 0
+    invalid: int = 0
+    errors: list[str] = field(default_factory=list)
+
+    MAX_ERRORS = 20   # в отчёт — первые, остальное только считаем
+
+    def reject(self, n: int, error: Exception) -> None:
+        self.invalid += 1
+        if len(self.errors) < self.MAX_ERRORS:
+            self.errors.append(f"row {n}: {error}")
+
+def ingest(rows: Iterable[dict], *, write=None, kzt_per_usd: float | None = None,
+           chunk: int = 500, unit: str = UNECE_UNIT) -> IngestReport:
+    """
+    Проверяем строки и пишем пачками по chunk через write(docs) — в CLI это db.put_wage_docs;
+    write=None — только проверка (--dry-run). Дубли ISO3_YYYY_UNIT внутри пачки: побеждает последний.
+    """
+    report = IngestReport()
+    pending: dict[tuple, dict] = {}
+
+    def flush():
+        if pending and write is not None:
+            report.written += write(list(pending.values()))
+        pending.clear()
+
+    for n, row in enumerate(rows, start=1):
+        report.rows += 1
+        try:
+            doc = validate_row(row, unit)
+        except RowError as e:
+            report.reject(n, e)
+            continue
+        pending[(doc["iso3"], doc["year"], doc["unit"])] = with_derived(doc, kzt_per_usd)
+        if len(pending) >= chunk:
+            flush()
+    flush()
+    return report
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="UNECE average wages → avg_wages_unece")
+    ap.add_argument("path", nargs="?", help="CSV, JSON-массив или JSON Lines")
+    ap.add_argument("--format", choices=("csv", "json"), help="по умолчанию — по расширению файла")
+    ap.add_argument("--chunk", type=int, default=500, help="документов в одном batch-коммите (Firestore: ≤ 500)")
+    ap.add_argument("--unit", default=UNECE_UNIT)
+    ap.add_argument("--kzt-per-usd", type=float, help="курс для производных полей; по умолчанию — текущий снимок FX")
+    ap.add_argument("--no-derived", action="store_true", help="не считать salary_kzt / cake_salary")
+    ap.add_argument("--dry-run", action="store_true", help="только проверка, без записи")
+    ap.add_argument("--strict", action="store_true", help="код выхода 1, если есть негодные строки")
+    ap.add_argument("--migrate-legacy", action="store_true", help="перенести NAME_YYYY_UNIT → ISO3_YYYY_UNIT")
+    args = ap.parse_args(argv)
+    if not args.path and not args.migrate_legacy:
+        ap.error("path or --migrate-legacy is required")
+
+    import db   # бэкенд хранилища выбирается при импорте — не трогаем его ради --help
+
+    if args.migrate_legacy:
+        print(f"legacy wage docs migrated: {db.migrate_legacy_wage_ids()}")
+    if not args.path:
+        return 0
+
+    kzt_per_usd = None
+    if not args.no_derived:
+        kzt_per_usd = args.kzt_per_usd or asyncio.run(_fetch_kzt_per_usd())
+    report = ingest(iter_rows(args.path, args.format), write=None if args.dry_run else db.put_wage_docs,
+                    kzt_per_usd=kzt_per_usd, chunk=max(1, args.chunk), unit=args.unit)
+
+    print(f"rows: {report.rows}  valid: {report.rows - report.invalid}  invalid: {report.invalid}  "
+          f"written: {report.written}" + ("  (dry run)" if args.dry_run else ""))
+    for line in report.errors:
+        print(f"  {line}", file=sys.stderr)
+    return 1 if args.strict and report.invalid else 0
+
+
+if __name__ == "__main__":
+    import logs
+    logs.setup()
+    sys.exit(main())